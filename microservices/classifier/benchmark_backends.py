@@ -0,0 +1,131 @@
+"""
+benchmark_backends.py
+=====================
+
+Compares the embedding backends of classifier/embedding_engine.py against PyTorch on
+classifier/data/train.csv:
+
+- agreement: cosine similarity between each backend's embeddings and the PyTorch ones.
+- accuracy: the saved classifier (model_bundle.pkl, trained on PyTorch embeddings) applied
+  to each backend's embeddings, without retraining. Without a saved bundle, a classifier
+  is fit on the PyTorch embeddings of a training split and scored on the rest.
+- speed: single-text latency (p50/p95) and batch throughput of embed_texts.
+
+The embedding cache is bypassed so every number measures the encoder.
+
+Usage:
+------
+python -m classifier.benchmark_backends
+python -m classifier.benchmark_backends --backends torch onnx-int8 --limit 300
+"""
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+from classifier.embedding_engine import BACKENDS, EmbeddingEngine
+from classifier.embedding_profiles import get_profile
+from classifier.train import MODEL_OUT, load_data
+from classifier.utils import embed_texts
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import train_test_split
+
+DATA_PATH = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "data", "train.csv")
+
+
+def time_engine(engine, texts, latency_samples=50, batch_size=32) -> dict:
+    """
+    Embeds texts with one engine and measures latency and throughput.
+
+    Returns:
+        dict: embeddings (np.ndarray), p50_ms, p95_ms and texts_per_sec.
+    """
+    embed_texts(texts[:batch_size], embedder=engine,
+                batch_size=batch_size, use_cache=False)  # warm up
+
+    latencies = []
+    for text in texts[:latency_samples]:
+        start = time.perf_counter()
+        embed_texts([text], embedder=engine, use_cache=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    X = embed_texts(texts, embedder=engine,
+                    batch_size=batch_size, use_cache=False)
+    elapsed = time.perf_counter() - start
+    return {
+        "embeddings": X,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "texts_per_sec": len(texts) / elapsed,
+    }
+
+
+def cosine_rows(a, b) -> np.ndarray:
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare embedding backends against PyTorch.")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Only use the first N rows of train.csv.")
+    parser.add_argument("--latency-samples", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    df = load_data(DATA_PATH)
+    if args.limit:
+        df = df.head(args.limit)
+    texts = df["text"].astype(str).tolist()
+    labels = df["label"].astype(str).tolist()
+
+    bundle = joblib.load(MODEL_OUT) if os.path.exists(MODEL_OUT) else None
+    profile = get_profile(bundle.get("embed_profile") if bundle else None)
+    backends = ["torch"] + [b for b in args.backends if b != "torch"]
+
+    results = {}
+    for backend in backends:
+        engine = EmbeddingEngine.for_profile(profile, backend=backend)
+        results[backend] = time_engine(engine, texts, latency_samples=args.latency_samples,
+                                       batch_size=args.batch_size)
+        del engine
+
+    reference = results["torch"]["embeddings"]
+    if bundle:
+        clf = bundle["clf"]
+        label2idx = bundle["label2idx"]
+        known = np.array([label in label2idx for label in labels])
+        y = np.array([label2idx[label] for label in labels if label in label2idx])
+        eval_rows = np.flatnonzero(known)
+        print(f"Classifier: {MODEL_OUT} on {len(eval_rows)} rows")
+    else:
+        idx = np.arange(len(texts))
+        train_rows, eval_rows = train_test_split(idx, test_size=0.3, random_state=42)
+        y_all = np.array(labels)
+        clf = SGDClassifier(loss="log_loss", max_iter=1000, tol=1e-3, random_state=42)
+        clf.fit(reference[train_rows], y_all[train_rows])
+        y = y_all[eval_rows]
+        print(f"No model bundle found; classifier fit on {len(train_rows)} PyTorch "
+              f"embeddings, scored on {len(eval_rows)} rows")
+    reference_pred = clf.predict(reference[eval_rows])
+
+    print(f"{'backend':<10} {'cos mean':>9} {'cos min':>9} {'accuracy':>9} {'same pred':>10} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'texts/s':>9} {'speedup':>8}")
+    for backend in backends:
+        result = results[backend]
+        cos = cosine_rows(result["embeddings"], reference)
+        pred = clf.predict(result["embeddings"][eval_rows])
+        print(f"{backend:<10} {cos.mean():>9.5f} {cos.min():>9.5f} {(pred == y).mean():>9.4f} "
+              f"{(pred == reference_pred).mean():>10.4f} {result['p50_ms']:>8.1f} "
+              f"{result['p95_ms']:>8.1f} {result['texts_per_sec']:>9.1f} "
+              f"{result['texts_per_sec'] / results['torch']['texts_per_sec']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+benchmark_chunk_sampling.py
+===========================
+
+Measures what embedding at most K chunks per text (embed_texts max_chunks, EMBED_MAX_CHUNKS)
+costs in accuracy and saves in time, for each chunk strategy:
+
+- train.csv rows: how many have more than K chunks (only those can change) and the
+  accuracy of the served classifier with and without sampling.
+- long articles: train.csv has short rows, so articles of 1000 to 20000 words are assembled
+  from held-out rows (a main label for DOMINANT_SHARE of the text, the rest mixed in). A
+  classifier fit on the other rows labels them from their full and their sampled embedding;
+  the report gives accuracy, the cosine similarity between sampled and full embeddings and
+  the embedding time per article.
+
+Usage:
+------
+python -m classifier.benchmark_chunk_sampling
+python -m classifier.benchmark_chunk_sampling --max-chunks 4 8 --lengths 5000 20000 --articles 10
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from classifier import model_service
+from classifier.embedding_engine import get_engine
+from classifier.train import load_data
+from classifier.utils import CHUNK_STRATEGIES, chunk_ids_by_tokens, embed_texts
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import train_test_split
+
+DATA_PATH = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "data", "train.csv")
+# share of an assembled article taken from its label
+DOMINANT_SHARE = 0.6
+
+
+def make_articles(texts, labels, words, count, rng):
+    """
+    Articles of about `words` words: DOMINANT_SHARE of rows of one label, the rest random rows.
+
+    Returns:
+        tuple: (articles, article labels)
+    """
+    by_label = {label: np.flatnonzero(labels == label) for label in np.unique(labels)}
+    articles, article_labels = [], []
+    for i in range(count):
+        label = list(by_label)[i % len(by_label)]
+        parts, length = [], 0
+        while length < words:
+            pool = by_label[label] if rng.random() < DOMINANT_SHARE else np.arange(len(texts))
+            text = texts[rng.choice(pool)]
+            parts.append(text)
+            length += len(text.split())
+        articles.append(" ".join(parts))
+        article_labels.append(label)
+    return articles, np.array(article_labels)
+
+
+def timed_embed(texts, embedder, **kwargs):
+    """
+    Embeddings of texts (cache bypassed) and the mean seconds per text.
+    """
+    start = time.perf_counter()
+    X = embed_texts(texts, embedder=embedder, use_cache=False, **kwargs)
+    return X, (time.perf_counter() - start) / max(1, len(texts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure chunk sampling for long texts.")
+    parser.add_argument("--max-chunks", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--strategies", nargs="+", default=list(CHUNK_STRATEGIES),
+                        choices=CHUNK_STRATEGIES)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[1000, 5000, 20000],
+                        help="Words per assembled article.")
+    parser.add_argument("--articles", type=int, default=20, help="Articles per length.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    df = load_data(DATA_PATH)
+    texts, labels = df["text"].astype(str).to_numpy(dtype=object), df["label"].to_numpy()
+    embedder = get_engine()
+    window = embedder.max_seq_length - embedder.num_special_tokens
+
+    # train.csv rows, with the served classifier
+    n_chunks = np.array([len(chunk_ids_by_tokens(embedder.tokenize_ids(t), window)) for t in texts])
+    X_full, _ = timed_embed(list(texts), embedder)
+    full_accuracy = np.mean(model_service.classify_embeddings(X_full).labels == labels)
+    print(f"train.csv: {len(texts)} rows, at most {n_chunks.max()} chunks per row; "
+          f"served classifier accuracy {full_accuracy:.4f}")
+    for k in args.max_chunks:
+        affected = np.flatnonzero(n_chunks > k)
+        for strategy in args.strategies:
+            accuracy = full_accuracy
+            if len(affected):
+                X = X_full.copy()
+                X[affected], _ = timed_embed(list(texts[affected]), embedder, max_chunks=k,
+                                             chunk_strategy=strategy)
+                accuracy = np.mean(model_service.classify_embeddings(X).labels == labels)
+            print(f"    K={k:<3} {strategy:<9} rows sampled {len(affected):>5}, accuracy {accuracy:.4f}")
+
+    # long articles assembled from held-out rows
+    train_idx, held_idx = train_test_split(np.arange(len(texts)), test_size=0.5,
+                                           stratify=labels, random_state=0)
+    clf = SGDClassifier(loss="log_loss", max_iter=1000, tol=1e-3, random_state=42)
+    clf.fit(X_full[train_idx], labels[train_idx])
+    print(f"\n{'words':>6} {'chunks':>7} {'K':>4} {'strategy':<9} {'accuracy':>9} "
+          f"{'cos mean':>9} {'cos min':>8} {'ms/article':>11}")
+    for words in args.lengths:
+        articles, article_labels = make_articles(texts[held_idx], labels[held_idx], words,
+                                                 args.articles, rng)
+        chunks = np.mean([len(chunk_ids_by_tokens(embedder.tokenize_ids(a), window)) for a in articles])
+        X_articles, seconds = timed_embed(articles, embedder)
+        accuracy = np.mean(clf.predict(X_articles) == article_labels)
+        print(f"{words:>6} {chunks:>7.0f} {'all':>4} {'':<9} {accuracy:>9.3f} {1:>9.3f} {1:>8.3f} "
+              f"{seconds * 1000:>11.1f}")
+        for k in args.max_chunks:
+            for strategy in args.strategies:
+                X, seconds = timed_embed(articles, embedder, max_chunks=k, chunk_strategy=strategy)
+                cosine = np.sum(X * X_articles, axis=1)  # both L2-normalized
+                accuracy = np.mean(clf.predict(X) == article_labels)
+                print(f"{words:>6} {chunks:>7.0f} {k:>4} {strategy:<9} {accuracy:>9.3f} "
+                      f"{cosine.mean():>9.3f} {cosine.min():>8.3f} {seconds * 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
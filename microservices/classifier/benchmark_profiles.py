@@ -0,0 +1,88 @@
+"""
+benchmark_profiles.py
+=====================
+
+Compares the embedding profiles of classifier/embedding_profiles.py on
+classifier/data/train.csv:
+
+- speed: single-text latency (p50/p95) and batch throughput of embed_texts, with the
+  embedding cache bypassed.
+- accuracy: the classifier train.py builds (calibrated SGDClassifier), fit on each
+  profile's embeddings and scored with stratified 5-fold cross-validation.
+
+Usage:
+------
+python -m classifier.benchmark_profiles
+python -m classifier.benchmark_profiles --profiles t5-base minilm --limit 800
+"""
+import argparse
+import os
+
+import numpy as np
+from classifier.benchmark_backends import time_engine
+from classifier.embedding_engine import EmbeddingEngine
+from classifier.embedding_profiles import PROFILES, get_profile
+from classifier.train import load_data
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import StratifiedKFold, cross_val_predict
+
+DATA_PATH = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "data", "train.csv")
+
+
+def cross_validated_predictions(X, y, folds=5) -> np.ndarray:
+    """
+    Out-of-fold predictions of the classifier train.py builds.
+    """
+    clf = CalibratedClassifierCV(
+        SGDClassifier(loss="log_loss", max_iter=1000, tol=1e-3, random_state=42),
+        method="sigmoid", cv=folds)
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=42)
+    return cross_val_predict(clf, X, y, cv=cv)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding profiles.")
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=sorted(PROFILES))
+    parser.add_argument("--backend", default=None,
+                        help="Embedding backend (default: EMBED_BACKEND).")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Only use the first N rows of train.csv.")
+    parser.add_argument("--latency-samples", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    df = load_data(DATA_PATH)
+    if args.limit:
+        df = df.head(args.limit)
+    # every class needs a sample in each (inner) fold
+    counts = df["label"].value_counts()
+    df = df[df["label"].isin(counts[counts >= 10].index)]
+    texts = df["text"].astype(str).tolist()
+    y = df["label"].astype(str).to_numpy()
+    print(f"{len(texts)} texts, {len(set(y))} classes")
+
+    rows = []
+    for name in args.profiles:
+        profile = get_profile(name)
+        engine = EmbeddingEngine.for_profile(profile, backend=args.backend)
+        result = time_engine(engine, texts, latency_samples=args.latency_samples,
+                             batch_size=args.batch_size)
+        del engine
+        pred = cross_validated_predictions(result["embeddings"], y)
+        rows.append((profile, result, accuracy_score(y, pred),
+                     f1_score(y, pred, average="macro")))
+
+    baseline = rows[0][1]["texts_per_sec"]
+    print(f"{'profile':<10} {'model':<20} {'dim':>5} {'accuracy':>9} {'macro f1':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'texts/s':>9} {'speedup':>8}")
+    for profile, result, accuracy, macro_f1 in rows:
+        print(f"{profile.name:<10} {profile.model:<20} {profile.dimension:>5} {accuracy:>9.4f} "
+              f"{macro_f1:>9.4f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+              f"{result['texts_per_sec']:>9.1f} {result['texts_per_sec'] / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+compiled_head.py
+================
+
+Compiles the calibrated classifier of a model bundle into plain NumPy arrays.
+
+The bundle's CalibratedClassifierCV (cv=5, sigmoid) averages five linear models, each
+followed by one sigmoid calibrator per class. All of it reduces to:
+
+    scores = X @ W + b                       # every fold's decision function, one matmul
+    p      = expit(-(a * scores + c))        # per-column sigmoid calibration
+    p      = p / p.sum(per fold)             # sklearn's one-vs-rest normalization
+    proba  = mean over folds
+
+W, b, a, c and the class labels are stored in a small .npz file next to the bundle
+(model_head.npz), which loads without sklearn or unpickling.
+
+Usage:
+------
+python -m classifier.compiled_head             # compile model_bundle.pkl and verify it
+python -m classifier.compiled_head --limit 200
+
+from classifier.compiled_head import CompiledHead
+head = CompiledHead.load(HEAD_FILE_PATH)
+probs = head.predict_proba(X)                  # same as bundle["clf"].predict_proba(X)
+"""
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+MICROSERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAD_FILE_PATH = os.path.join(MICROSERVICE_DIR, "model_head.npz")
+
+logger = logging.getLogger(__name__)
+
+
+def _expit(x):
+    # numerically stable logistic function, equal to scipy.special.expit
+    out = np.empty_like(x)
+    positive = x >= 0
+    out[positive] = 1.0 / (1.0 + np.exp(-x[positive]))
+    e = np.exp(x[~positive])
+    out[~positive] = e / (1.0 + e)
+    return out
+
+
+class CompiledHead:
+    """
+    Array form of a sigmoid-calibrated, cross-validated linear classifier.
+
+    Args:
+        weights (np.ndarray): (dim, folds * k) decision weights of all folds, stacked.
+        bias (np.ndarray): (folds * k,) decision intercepts.
+        calib_a (np.ndarray): (folds, k) sigmoid calibration slopes.
+        calib_b (np.ndarray): (folds, k) sigmoid calibration offsets.
+        class_index (np.ndarray): (folds, k) probability column each decision column calibrates.
+        classes (np.ndarray): (n_classes,) label of each probability column.
+        embed_profile (str): Embedding profile the classifier was trained on.
+    """
+
+    def __init__(self, weights, bias, calib_a, calib_b, class_index, classes, embed_profile=""):
+        # kept in the dtype the estimators were fit in (float32 for float32 embeddings) and
+        # promoted with X like in sklearn's decision_function, so the scores round the same
+        self.weights = np.ascontiguousarray(weights)
+        self.bias = np.asarray(bias, dtype=self.weights.dtype)
+        self.calib_a = np.asarray(calib_a, dtype=np.float64)
+        self.calib_b = np.asarray(calib_b, dtype=np.float64)
+        self.class_index = np.asarray(class_index, dtype=np.int64)
+        self.classes = np.asarray(classes, dtype=object)
+        self.embed_profile = str(embed_profile)
+        self.n_folds, self.k = self.calib_a.shape
+        self._fold_index = np.arange(self.n_folds)[:, None]
+
+    @classmethod
+    def from_bundle(cls, bundle) -> "CompiledHead":
+        """
+        Compiles bundle["clf"].
+
+        Raises:
+            ValueError: If the classifier is not a sigmoid CalibratedClassifierCV over
+                linear models (coef_ / intercept_).
+        """
+        clf = bundle["clf"]
+        folds = getattr(clf, "calibrated_classifiers_", None)
+        if not folds or getattr(clf, "method", None) != "sigmoid":
+            raise ValueError("Only sigmoid-calibrated CalibratedClassifierCV bundles can be compiled")
+        n_classes = len(clf.classes_)
+        weights, bias, calib_a, calib_b, class_index = [], [], [], [], []
+        for fold in folds:
+            estimator = fold.estimator
+            if not hasattr(estimator, "coef_") or not hasattr(estimator, "intercept_"):
+                raise ValueError(
+                    f"Cannot compile a {type(estimator).__name__}, expected a linear model")
+            columns = np.searchsorted(fold.classes, estimator.classes_)
+            if n_classes == 2:
+                # a binary decision function scores the second class only
+                columns = columns[1:]
+            if len(columns) != len(fold.calibrators) or len(columns) != (1 if n_classes == 2 else n_classes):
+                raise ValueError("All folds must see every class to be compiled")
+            weights.append(estimator.coef_.T)
+            bias.append(np.ravel(estimator.intercept_))
+            calib_a.append([c.a_ for c in fold.calibrators])
+            calib_b.append([c.b_ for c in fold.calibrators])
+            class_index.append(columns)
+        idx2label = bundle["idx2label"]
+        return cls(weights=np.hstack(weights), bias=np.concatenate(bias),
+                   calib_a=np.array(calib_a), calib_b=np.array(calib_b),
+                   class_index=np.array(class_index),
+                   classes=[idx2label[int(c)] for c in clf.classes_],
+                   embed_profile=bundle.get("embed_profile", ""))
+
+    @classmethod
+    def load(cls, path: str = HEAD_FILE_PATH) -> "CompiledHead":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(weights=data["weights"], bias=data["bias"], calib_a=data["calib_a"],
+                       calib_b=data["calib_b"], class_index=data["class_index"],
+                       classes=data["classes"].tolist(), embed_profile=str(data["embed_profile"]))
+
+    def save(self, path: str = HEAD_FILE_PATH):
+        """
+        Writes the arrays to path atomically (readers never see a partial file). The temp
+        file is per process, so processes saving at once never rename each other's.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"  # np.savez appends .npz otherwise
+        np.savez(tmp_path, weights=self.weights, bias=self.bias, calib_a=self.calib_a,
+                 calib_b=self.calib_b, class_index=self.class_index,
+                 classes=np.array(self.classes.tolist(), dtype=str),
+                 embed_profile=np.array(self.embed_profile))
+        os.replace(tmp_path, path)
+
+    def predict_proba(self, X) -> np.ndarray:
+        """
+        Calibrated class probabilities, identical to CalibratedClassifierCV.predict_proba.
+
+        Args:
+            X (np.ndarray): Embeddings of shape (n, dim).
+
+        Returns:
+            np.ndarray: Probabilities of shape (n, n_classes), columns ordered like classes.
+        """
+        X = np.asarray(X)
+        if X.dtype.kind != "f":
+            X = X.astype(np.float64)
+        n = X.shape[0]
+        n_classes = len(self.classes)
+        scores = (X @ self.weights + self.bias).reshape(n, self.n_folds, self.k)
+        calibrated = _expit(-(self.calib_a * scores + self.calib_b))
+        proba = np.zeros((n, self.n_folds, n_classes))
+        proba[:, self._fold_index, self.class_index] = calibrated
+        if n_classes == 2:
+            proba[:, :, 0] = 1.0 - proba[:, :, 1]
+        else:
+            denominator = proba.sum(axis=2, keepdims=True)
+            proba = np.divide(proba, denominator, out=np.full_like(proba, 1 / n_classes),
+                              where=denominator != 0)
+        proba[(1.0 < proba) & (proba <= 1.0 + 1e-5)] = 1.0
+        return proba.mean(axis=1)
+
+
+def export_compiled_head(bundle, path: str = HEAD_FILE_PATH) -> CompiledHead:
+    """
+    Compiles a loaded bundle and saves the head next to it.
+    """
+    head = CompiledHead.from_bundle(bundle)
+    head.save(path)
+    logger.info("Saved compiled classifier head to %s", path)
+    return head
+
+
+def verify_compiled_head(bundle, head: CompiledHead, X) -> float:
+    """
+    Checks that the compiled head reproduces the bundle's probabilities on X.
+
+    Returns:
+        float: Largest absolute difference between the two probability matrices.
+
+    Raises:
+        AssertionError: If the probabilities or the predicted labels differ.
+    """
+    expected = bundle["clf"].predict_proba(X)
+    actual = head.predict_proba(X)
+    max_diff = float(np.abs(expected - actual).max()) if len(X) else 0.0
+    # bit-identical in practice; the tolerance only absorbs BLAS summation order
+    assert np.allclose(actual, expected, rtol=0, atol=1e-6), \
+        f"compiled head differs from the bundle by up to {max_diff}"
+    assert (actual.argmax(axis=1) == expected.argmax(axis=1)).all(), "predicted labels differ"
+    return max_diff
+
+
+def main():
+    import joblib
+    from classifier.embedding_engine import get_engine
+    from classifier.train import MODEL_OUT, load_data
+    from classifier.utils import embed_texts
+
+    parser = argparse.ArgumentParser(
+        description="Compile model_bundle.pkl into model_head.npz and verify it.")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Only verify on the first N rows of train.csv.")
+    args = parser.parse_args()
+
+    bundle = joblib.load(MODEL_OUT)
+    head = export_compiled_head(bundle)
+
+    df = load_data(os.path.join(MICROSERVICE_DIR, "data", "train.csv"))
+    if args.limit:
+        df = df.head(args.limit)
+    X = embed_texts(df["text"].astype(str).tolist(),
+                    embedder=get_engine(bundle.get("embed_profile")))
+    max_diff = verify_compiled_head(bundle, head, X)
+    # also cover scores far outside the training distribution
+    rng = np.random.default_rng(0)
+    verify_compiled_head(bundle, head, rng.normal(scale=3.0, size=(256, X.shape[1])))
+    print(f"Compiled head matches the bundle on {len(X)} texts (max abs diff {max_diff:.2e})")
+
+    for name, predict in (("sklearn", bundle["clf"].predict_proba), ("compiled", head.predict_proba)):
+        for rows in (1, len(X)):
+            start = time.perf_counter()
+            repeats = 200 if rows == 1 else 5
+            for _ in range(repeats):
+                predict(X[:rows])
+            elapsed = (time.perf_counter() - start) / repeats * 1000
+            print(f"{name:<9} {rows:>5} rows: {elapsed:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+embedding_cache.py
+==================
+
+Content-hash cache in front of the embedding engine.
+
+Entries are keyed by sha256(model name, pooling, text), so a retried queue item or a
+re-promoted article skips the encoder entirely. Two tiers:
+
+- memory: an LRU of the most recently used vectors (EMBED_CACHE_MEMORY_ITEMS entries).
+- disk: vectors stored as float16 rows of a memory-mapped file, with a sqlite index
+  mapping keys to rows (EMBED_CACHE_DIR). When EMBED_CACHE_DISK_ITEMS is reached, the
+  least recently used rows are evicted and their slots reused.
+
+The disk tier is safe to share between worker processes: row allocation happens inside
+a sqlite write transaction and readers remap the vector file when it has grown. Evicted
+rows are only reused by a later transaction, so a vector is never written into a row that
+a committed key still maps to, and readers check the key -> row mapping again after
+reading: a reader that looked a key up just before its row was evicted and rewritten
+drops the vector instead of returning the new one.
+
+Set EMBED_CACHE=0 to disable the cache.
+
+Usage:
+------
+from classifier.embedding_cache import cached_embeddings
+X = cached_embeddings(model_name, dim, texts, pooling="mean", compute=embed_fn)
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MICROSERVICES_DIR = os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))
+
+CACHE_ENABLED = os.getenv("EMBED_CACHE", "1") != "0"
+CACHE_DIR = os.getenv("EMBED_CACHE_DIR", os.path.join(
+    MICROSERVICES_DIR, ".embedding_cache"))
+MEMORY_ITEMS = int(os.getenv("EMBED_CACHE_MEMORY_ITEMS", "4096"))
+DISK_ITEMS = int(os.getenv("EMBED_CACHE_DISK_ITEMS", "200000"))
+
+# log the hit rate every this many lookups
+_STATS_LOG_EVERY = 1000
+# rows added to the vector file each time it grows
+_GROW_ROWS = 4096
+# keys per sqlite IN (...) query
+_SQL_BATCH = 500
+# evicted rows kept ready for reuse by later writes once the cache is full
+_FREE_RESERVE = 1024
+
+logger = logging.getLogger(__name__)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class EmbeddingCache:
+    """
+    Two-tier (memory LRU + memory-mapped disk) cache of embedding vectors for one model.
+
+    Args:
+        model_name (str): Model the vectors belong to (part of every key).
+        dim (int): Embedding dimension.
+        cache_dir (Optional[str]): Directory of the disk tier, or None for memory only.
+        memory_items (int): Capacity of the in-memory LRU.
+        disk_items (int): Capacity of the disk tier.
+    """
+
+    def __init__(self, model_name: str, dim: int, cache_dir=CACHE_DIR,
+                 memory_items: int = MEMORY_ITEMS, disk_items: int = DISK_ITEMS):
+        self.model_name = model_name
+        self.dim = dim
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        self.path = None
+        if cache_dir:
+            slug = model_name.replace("/", "__")
+            self.path = os.path.join(cache_dir, f"{slug}-{dim}")
+            os.makedirs(self.path, exist_ok=True)
+        self._pid = None
+        self._db = None
+        self._vectors = None
+
+    # ----- keys and stats -----
+
+    def key(self, text: str, pooling: str) -> bytes:
+        h = hashlib.sha256()
+        for part in (self.model_name, pooling, text):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.digest()
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counters and the overall hit rate.
+        """
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    # ----- disk tier -----
+
+    def _open_disk(self):
+        """
+        (Re)opens the sqlite index and the vector file; also after a fork, since sqlite
+        connections must not cross processes.
+        """
+        if self.path is None:
+            return False
+        if self._pid == os.getpid() and self._db is not None:
+            return True
+        self._db = sqlite3.connect(os.path.join(self.path, "index.sqlite"), timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key BLOB PRIMARY KEY, row INTEGER NOT NULL, last_used REAL NOT NULL)""")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.execute(
+            "INSERT OR IGNORE INTO meta (name, value) VALUES ('next_row', 0)")
+        # rows of evicted entries, free for the next transactions
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)")
+        self._pid = os.getpid()
+        self._vectors = None
+        self._map_vectors()
+        return True
+
+    def _map_vectors(self, min_rows: int = 0):
+        """
+        Memory-maps the vector file, growing it to hold at least min_rows rows.
+        """
+        file_path = os.path.join(self.path, "vectors.f16")
+        row_bytes = self.dim * 2
+        size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        rows = size // row_bytes
+        if rows < min_rows:
+            rows = min(max(min_rows, rows + _GROW_ROWS), max(self.disk_items, min_rows))
+            with open(file_path, "ab") as f:
+                f.truncate(rows * row_bytes)
+        if rows == 0:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(file_path, dtype=np.float16, mode="r+",
+                                  shape=(rows, self.dim))
+
+    def _select(self, keys, query):
+        """
+        Runs an `IN ({})` query over keys in slices that stay under sqlite's variable limit.
+        """
+        rows = []
+        for start in range(0, len(keys), _SQL_BATCH):
+            part = keys[start:start + _SQL_BATCH]
+            rows.extend(self._db.execute(
+                query.format(",".join("?" * len(part))), part).fetchall())
+        return rows
+
+    def _disk_get(self, keys):
+        found = {}
+        if not keys or not self._open_disk():
+            return found
+        rows = self._select(keys, "SELECT key, row FROM entries WHERE key IN ({})")
+        if not rows:
+            return found
+        max_row = max(row for _, row in rows)
+        if self._vectors is None or max_row >= self._vectors.shape[0]:
+            # another process grew the file since we mapped it
+            self._map_vectors()
+        for key, row in rows:
+            found[key] = np.asarray(self._vectors[row], dtype=np.float32)
+        # a row is only rewritten after the eviction of its old key has committed: if the
+        # mapping still holds, the vector read above is the one of this key
+        current = dict(self._select(
+            [key for key, _ in rows], "SELECT key, row FROM entries WHERE key IN ({})"))
+        for key, row in rows:
+            if current.get(key) != row:
+                del found[key]
+        now = time.time()
+        self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                             [(now, key) for key in found])
+        return found
+
+    def _disk_put(self, keys, vecs):
+        if not keys or not self._open_disk():
+            return
+        now = time.time()
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            existing = {key for (key,) in self._select(
+                keys, "SELECT key FROM entries WHERE key IN ({})")}
+            new = list({key: vec for key, vec in zip(keys, vecs)
+                        if key not in existing}.items())
+            if not new:
+                db.execute("COMMIT")
+                return
+            next_row = db.execute(
+                "SELECT value FROM meta WHERE name = 'next_row'").fetchone()[0]
+            free = max(0, self.disk_items - next_row)
+            rows = list(range(next_row, next_row + min(free, len(new))))
+            if len(rows) < len(new):
+                # full: reuse rows evicted by earlier transactions (committed, so no reader
+                # can see them mapped any more)
+                reused = [row for (row,) in db.execute(
+                    "SELECT row FROM free_rows LIMIT ?", (len(new) - len(rows),)).fetchall()]
+                db.executemany("DELETE FROM free_rows WHERE row = ?", [(row,) for row in reused])
+                rows.extend(reused)
+            if not rows:
+                self._evict(db, len(new))
+                db.execute("COMMIT")
+                return
+            new = new[:len(rows)]
+            db.execute("UPDATE meta SET value = ? WHERE name = 'next_row'",
+                       (max([next_row] + [r + 1 for r in rows]),))
+            if self._vectors is None or max(rows) >= self._vectors.shape[0]:
+                self._map_vectors(min_rows=max(rows) + 1)
+            for (key, vec), row in zip(new, rows):
+                self._vectors[row] = vec
+            self._vectors.flush()
+            db.executemany("INSERT INTO entries (key, row, last_used) VALUES (?, ?, ?)",
+                           [(key, row, now) for (key, _), row in zip(new, rows)])
+            if next_row + len(rows) >= self.disk_items:
+                self._evict(db, 0)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def _evict(self, db, wanted: int):
+        """
+        Tops the free rows up to the reserve (or wanted rows, if more): evicts the least
+        recently used entries and frees their rows for the transactions after this one.
+        Runs inside the write transaction.
+        """
+        reserve = db.execute("SELECT COUNT(*) FROM free_rows").fetchone()[0]
+        missing = max(wanted, min(_FREE_RESERVE, self.disk_items // 10)) - reserve
+        if missing <= 0:
+            return
+        evicted = db.execute("SELECT key, row FROM entries ORDER BY last_used LIMIT ?",
+                             (missing,)).fetchall()
+        db.executemany("DELETE FROM entries WHERE key = ?",
+                       [(key,) for key, _ in evicted])
+        db.executemany("INSERT OR IGNORE INTO free_rows (row) VALUES (?)",
+                       [(row,) for _, row in evicted])
+
+    # ----- public API -----
+
+    def get_many(self, keys) -> dict:
+        """
+        Looks keys up in memory, then on disk.
+
+        Returns:
+            dict: key -> vector for the keys that were found.
+        """
+        with self._lock:
+            found = {}
+            missing = []
+            for key in keys:
+                vec = self._memory.get(key)
+                if vec is None:
+                    missing.append(key)
+                else:
+                    self._memory.move_to_end(key)
+                    found[key] = vec
+            self.hits_memory += len(keys) - len(missing)
+            if missing:
+                try:
+                    from_disk = self._disk_get(list(dict.fromkeys(missing)))
+                except sqlite3.Error as e:
+                    logger.warning("Embedding cache lookup failed: %s", e)
+                    from_disk = {}
+                hits = sum(1 for key in missing if key in from_disk)
+                self.hits_disk += hits
+                self.misses += len(missing) - hits
+                for key, vec in from_disk.items():
+                    self._remember(key, vec)
+                found.update(from_disk)
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            if lookups and lookups // _STATS_LOG_EVERY != (lookups - len(keys)) // _STATS_LOG_EVERY:
+                logger.info("Embedding cache stats: %s", self.stats())
+            return found
+
+    def put_many(self, keys, vecs):
+        """
+        Stores vectors in both tiers.
+        """
+        with self._lock:
+            for key, vec in zip(keys, vecs):
+                self._remember(key, np.asarray(vec, dtype=np.float32))
+            try:
+                self._disk_put(list(keys), vecs)
+            except sqlite3.Error as e:
+                logger.warning("Embedding cache write failed: %s", e)
+
+    def _remember(self, key, vec):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+
+def get_cache(model_name: str, dim: int):
+    """
+    Returns the process-wide cache for a model, or None when caching is disabled.
+    """
+    if not CACHE_ENABLED:
+        return None
+    cache = _caches.get((model_name, dim))
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get((model_name, dim))
+            if cache is None:
+                cache = EmbeddingCache(model_name, dim)
+                _caches[(model_name, dim)] = cache
+    return cache
+
+
+def cached_embeddings(model_name: str, dim: int, texts, pooling: str, compute) -> np.ndarray:
+    """
+    Returns one vector per text, computing only the ones not in the cache.
+
+    Args:
+        model_name (str): Model producing the vectors.
+        dim (int): Embedding dimension.
+        texts (list of str): Input texts.
+        pooling (str): Description of how the vectors are produced (pooling, chunking,
+            normalization); part of the key.
+        compute (Callable): Function mapping a list of texts to an array (n, dim).
+
+    Returns:
+        np.ndarray: Array of shape (len(texts), dim).
+    """
+    cache = get_cache(model_name, dim)
+    if cache is None:
+        return compute(texts)
+    keys = [cache.key(text, pooling) for text in texts]
+    found = cache.get_many(keys)
+    out = np.empty((len(texts), dim), dtype=np.float32)
+    missing = []
+    for i, key in enumerate(keys):
+        vec = found.get(key)
+        if vec is None:
+            missing.append(i)
+        else:
+            out[i] = vec
+    if missing:
+        # embed each distinct missing text once
+        unique = list(dict.fromkeys(texts[i] for i in missing))
+        vecs = compute(unique)
+        by_text = dict(zip(unique, vecs))
+        for i in missing:
+            out[i] = by_text[texts[i]]
+        cache.put_many([cache.key(text, pooling) for text in unique], vecs)
+    return out
@@ -0,0 +1,299 @@
+"""
+embedding_engine.py
+===================
+
+Process-wide sentence-transformer embedding engine.
+
+main.py, classifier.utils.embed_texts and classifier.model_service all share the engine
+returned by get_engine(), so a worker process holds a single copy of the model weights.
+The model comes from the active embedding profile (see embedding_profiles.py) and is
+loaded from its local copy (<model>-local/ under MODELS_DIR); the first call downloads it
+from the hub and saves it there.
+
+EMBED_BACKEND selects the runtime the encoder runs on:
+
+- "torch" (default): PyTorch.
+- "onnx": ONNX Runtime. The model is exported to <local copy>/onnx/model.onnx on first use.
+- "onnx-int8": ONNX Runtime with the weights dynamically quantized to int8
+  (<local copy>/onnx/model_int8_<EMBED_ONNX_QUANTIZATION>.onnx), created on first use.
+
+The ONNX backends need the optional optimum[onnxruntime] package. Run
+`python -m classifier.benchmark_backends` to check their agreement with the PyTorch
+embeddings and their speed before switching a deployment over.
+
+torch and sentence_transformers are only imported when the first engine is built, so
+importing this module (and everything that imports it) stays cheap.
+
+Usage:
+------
+from classifier.embedding_engine import get_engine
+engine = get_engine()
+vectors = engine.encode_batch(["first text", "second text"])   # shape (2, dim)
+vector = engine.encode("single text", normalize_embeddings=True)  # shape (dim,)
+"""
+import functools
+import logging
+import os
+import threading
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+from dotenv import load_dotenv
+from classifier.embedding_profiles import EmbeddingProfile, get_profile
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+load_dotenv()
+
+MICROSERVICES_DIR = os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))
+
+# local copies of the models are saved here, e.g. sentence-t5-base-local/
+MODELS_DIR = MICROSERVICES_DIR
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+# instruction set the int8 weights are quantized for: arm64, avx2, avx512 or avx512_vnni
+ONNX_QUANTIZATION = os.getenv("EMBED_ONNX_QUANTIZATION", "avx2")
+
+logger = logging.getLogger(__name__)
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def local_model_path(model_name: str) -> str:
+    """
+    Returns the directory the local copy of a model is saved to.
+    """
+    return os.path.join(MODELS_DIR, model_name.split("/")[-1] + "-local")
+
+
+class EmbeddingEngine:
+    """
+    Wraps one SentenceTransformer instance and exposes batch encode APIs.
+
+    Args:
+        model_name (str): Hub name of the sentence-transformer model.
+        local_path (str): Directory of the local copy of the model.
+        backend (str): One of BACKENDS (default: EMBED_BACKEND).
+        max_seq_length (Optional[int]): Overrides the max sequence length of the model.
+    """
+
+    def __init__(self, model_name: str, local_path: str, backend: str = None, max_seq_length: int = None):
+        backend = backend or EMBED_BACKEND
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+        self.model_name = model_name
+        self.local_path = local_path
+        self.backend = backend
+        self.profile = None
+        self.model = self._load()
+        if max_seq_length:
+            self.model.max_seq_length = max_seq_length
+
+    @classmethod
+    def for_profile(cls, profile: EmbeddingProfile, backend: str = None) -> "EmbeddingEngine":
+        """
+        Builds the engine of an embedding profile and checks its output dimension.
+
+        Raises:
+            ValueError: If the model does not produce profile.dimension-sized vectors.
+        """
+        engine = cls(profile.model, local_model_path(profile.model), backend=backend,
+                     max_seq_length=profile.max_seq_length)
+        if engine.dimension != profile.dimension:
+            raise ValueError(f"Embedding profile {profile.name!r} expects {profile.dimension} "
+                             f"dimensions, {profile.model} produces {engine.dimension}")
+        engine.profile = profile
+        return engine
+
+    def _load(self) -> "SentenceTransformer":
+        from sentence_transformers import SentenceTransformer
+
+        if not os.path.exists(self.local_path):
+            logger.info("Downloading %s and saving it to %s",
+                        self.model_name, self.local_path)
+            model = SentenceTransformer(self.model_name)
+            model.save(self.local_path)
+            if self.backend == "torch":
+                return model
+        if self.backend == "torch":
+            logger.info("Loading %s from %s", self.model_name, self.local_path)
+            return SentenceTransformer(self.local_path)
+        return self._load_onnx()
+
+    def _load_onnx(self) -> "SentenceTransformer":
+        """
+        Loads the ONNX Runtime model, exporting (and quantizing) the local copy on first use.
+        """
+        from sentence_transformers import SentenceTransformer
+
+        try:
+            import optimum.onnxruntime  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                f"EMBED_BACKEND={self.backend} needs ONNX Runtime: "
+                "pip install \"optimum[onnxruntime]\"") from e
+
+        if not os.path.exists(os.path.join(self.local_path, "onnx", "model.onnx")):
+            logger.info("Exporting %s to ONNX", self.model_name)
+            model = SentenceTransformer(self.local_path, backend="onnx")
+            model.save(self.local_path)
+        file_name = "onnx/model.onnx"
+        if self.backend == "onnx-int8":
+            suffix = f"int8_{ONNX_QUANTIZATION}"
+            file_name = f"onnx/model_{suffix}.onnx"
+            if not os.path.exists(os.path.join(self.local_path, file_name)):
+                from sentence_transformers import \
+                    export_dynamic_quantized_onnx_model
+                logger.info("Quantizing %s to int8 (%s)",
+                            self.model_name, ONNX_QUANTIZATION)
+                # quantize from the saved export; an in-memory export lives in a temp dir
+                fp32 = SentenceTransformer(self.local_path, backend="onnx",
+                                           model_kwargs={"file_name": "onnx/model.onnx"})
+                export_dynamic_quantized_onnx_model(fp32, ONNX_QUANTIZATION, self.local_path,
+                                                    file_suffix=suffix)
+        logger.info("Loading %s from %s (%s)", self.model_name,
+                    os.path.join(self.local_path, file_name), self.backend)
+        return SentenceTransformer(self.local_path, backend="onnx",
+                                   model_kwargs={"file_name": file_name})
+
+    @property
+    def cache_name(self) -> str:
+        """
+        Name embeddings of this engine are cached under; ONNX outputs differ slightly from
+        PyTorch ones, so each backend gets its own entries.
+        """
+        if self.backend == "torch":
+            return self.model_name
+        return f"{self.model_name}@{self.backend}"
+
+    @property
+    def tokenizer(self):
+        return getattr(self.model, "tokenizer", None)
+
+    @property
+    def max_seq_length(self) -> int:
+        return getattr(self.model, "max_seq_length", None) or 256
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    @functools.cached_property
+    def special_tokens(self) -> tuple:
+        """
+        (prefix ids, suffix ids) the tokenizer adds around a single sequence, e.g. ([], [</s>])
+        for T5 or ([CLS], [SEP]) for BERT. Found by tokenizing a probe with and without them.
+        """
+        tokenizer = self.tokenizer
+        if tokenizer is None:
+            return [], []
+        plain = tokenizer("probe", add_special_tokens=False)["input_ids"]
+        full = tokenizer("probe", add_special_tokens=True)["input_ids"]
+        for pos in range(len(full) - len(plain) + 1):
+            if full[pos:pos + len(plain)] == plain:
+                return full[:pos], full[pos + len(plain):]
+        return [], []
+
+    @property
+    def num_special_tokens(self) -> int:
+        """
+        Number of special tokens the tokenizer adds around a single sequence.
+        """
+        prefix, suffix = self.special_tokens
+        return len(prefix) + len(suffix)
+
+    def tokenize_ids(self, text: str) -> list:
+        """
+        Tokenizes a text once into input ids, without special tokens and without truncation.
+        """
+        return self.tokenizer(text, add_special_tokens=False, truncation=False,
+                              verbose=False)["input_ids"]
+
+    def encode_token_ids(self, id_windows, batch_size: int = 32, normalize_embeddings: bool = False) -> np.ndarray:
+        """
+        Encodes pre-tokenized windows straight through the model, skipping the tokenizer.
+
+        Args:
+            id_windows (list of list of int): Input ids without special tokens; each window must
+                fit the model together with its special tokens (see num_special_tokens).
+            batch_size (int): Number of windows per forward pass. Windows are sorted by length
+                so each batch is padded as little as possible.
+            normalize_embeddings (bool): L2-normalize the result.
+
+        Returns:
+            np.ndarray: Array of shape (len(id_windows), dim), in input order.
+        """
+        import torch
+
+        if len(id_windows) == 0:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        tokenizer = self.tokenizer
+        prefix, suffix = self.special_tokens
+        order = np.argsort([-len(ids) for ids in id_windows], kind="stable")
+        out = np.empty((len(id_windows), self.dimension), dtype=np.float32)
+        device = self.model.device
+        with torch.inference_mode():
+            for start in range(0, len(order), batch_size):
+                idx = order[start:start + batch_size]
+                batch = [prefix + list(id_windows[i]) + suffix for i in idx]
+                features = tokenizer.pad({"input_ids": batch}, padding=True, return_tensors="pt",
+                                         return_attention_mask=True)
+                features = {key: value.to(device)
+                            for key, value in features.items()}
+                embeddings = self.model(features)["sentence_embedding"]
+                if normalize_embeddings:
+                    embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+                out[idx] = embeddings.float().cpu().numpy()
+        return out
+
+    def encode_batch(self, texts, batch_size: int = 32, normalize_embeddings: bool = False) -> np.ndarray:
+        """
+        Encodes a list of texts in batches.
+
+        Returns:
+            np.ndarray: Array of shape (len(texts), dim).
+        """
+        if len(texts) == 0:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True,
+                                 show_progress_bar=False, normalize_embeddings=normalize_embeddings)
+
+    def encode(self, text, batch_size: int = 32, normalize_embeddings: bool = False) -> np.ndarray:
+        """
+        Encodes a single text (1-D result) or a list of texts (2-D result), like
+        SentenceTransformer.encode.
+        """
+        if isinstance(text, str):
+            return self.encode_batch([text], batch_size=batch_size,
+                                     normalize_embeddings=normalize_embeddings)[0]
+        return self.encode_batch(text, batch_size=batch_size, normalize_embeddings=normalize_embeddings)
+
+
+def get_engine(profile=None, backend: str = None) -> EmbeddingEngine:
+    """
+    Returns the process-wide engine for an embedding profile, loading it on first use.
+
+    Args:
+        profile (Optional[str | EmbeddingProfile]): Profile or profile name
+            (default: EMBED_PROFILE).
+        backend (str): Runtime to use (default: EMBED_BACKEND).
+
+    Returns:
+        EmbeddingEngine: Shared engine instance.
+    """
+    profile = get_profile(profile)
+    key = (profile.name, backend or EMBED_BACKEND)
+    engine = _engines.get(key)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(key)
+            if engine is None:
+                engine = EmbeddingEngine.for_profile(profile, backend=key[1])
+                _engines[key] = engine
+    return engine
@@ -0,0 +1,94 @@
+"""
+embedding_profiles.py
+=====================
+
+Registry of the sentence-transformer models the services can embed with.
+
+A profile fixes everything that has to match between training, classification and the
+stored promotion vectors: the model, its output dimension (the size of the
+promotions.embedding column), the max sequence length of each chunk and how chunk
+embeddings are pooled into one document vector. EMBED_PROFILE selects the active one.
+
+Profiles:
+---------
+- t5-base (default): sentence-t5-base, 768 dimensions.
+- minilm: all-MiniLM-L6-v2, 384 dimensions, several times cheaper to run.
+
+Compare them with `python -m classifier.benchmark_profiles`.
+
+Usage:
+------
+from classifier.embedding_profiles import get_profile
+profile = get_profile()           # active profile
+profile = get_profile("minilm")
+"""
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_PROFILE = "t5-base"
+EMBED_PROFILE = os.getenv("EMBED_PROFILE", DEFAULT_PROFILE)
+
+
+@dataclass(frozen=True)
+class EmbeddingProfile:
+    """
+    One embedding model and the settings it is used with.
+
+    Attributes:
+        name (str): Registry key, recorded in the model bundle.
+        model (str): Hub name of the sentence-transformer model.
+        dimension (int): Size of the embedding vectors.
+        max_seq_length (int): Max tokens per chunk, special tokens included.
+        pooling (str): How chunk embeddings are pooled per text: 'mean', 'max' or 'weighted'.
+    """
+    name: str
+    model: str
+    dimension: int
+    max_seq_length: int
+    pooling: str = "mean"
+
+
+PROFILES = {profile.name: profile for profile in (
+    EmbeddingProfile(name="t5-base", model="sentence-t5-base",
+                     dimension=768, max_seq_length=256),
+    EmbeddingProfile(name="minilm", model="all-MiniLM-L6-v2",
+                     dimension=384, max_seq_length=256),
+)}
+
+
+def get_profile(profile=None) -> EmbeddingProfile:
+    """
+    Resolves a profile.
+
+    Args:
+        profile (Optional[str | EmbeddingProfile]): Profile or profile name
+            (default: EMBED_PROFILE).
+
+    Returns:
+        EmbeddingProfile: The registered profile.
+
+    Raises:
+        ValueError: If the name is not registered.
+    """
+    if isinstance(profile, EmbeddingProfile):
+        return profile
+    name = profile or EMBED_PROFILE
+    if name not in PROFILES:
+        raise ValueError(
+            f"Unknown embedding profile {name!r}, expected one of {sorted(PROFILES)}")
+    return PROFILES[name]
+
+
+def profile_for_model(model_name: str) -> Optional[EmbeddingProfile]:
+    """
+    Returns the profile using a model, e.g. for bundles saved before profiles existed.
+    """
+    for profile in PROFILES.values():
+        if profile.model == model_name:
+            return profile
+    return None
@@ -0,0 +1,139 @@
+"""
+feature_store.py
+================
+
+Memory-mapped embeddings of the labeled training corpus.
+
+A store is a directory with one row per training example, in CSV order:
+
+- features.npy: (n, dim) float32 embeddings
+- labels.npy:   (n,) int32 label indices
+- keys.npy:     (n, 32) uint8 sha256 of each text
+- meta.json:    embedding profile, model, backend, dimension, pooling and chunk sampling the
+                features were built with
+
+All arrays are opened with mmap_mode, so training streams over them without loading the
+corpus into memory. When the store is rebuilt, rows whose text hash already exists in the
+previous store (built with the same embedding settings) are copied instead of re-embedded.
+A new store is written next to the old one and swapped in when complete.
+
+Usage:
+------
+store = FeatureStore.open(path, meta)        # None if missing or built with other settings
+writer = FeatureStoreWriter(path, n_rows, dim)
+writer.write(start, X, keys, labels)
+store = writer.commit(meta)
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+FEATURES_DIR = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "features")
+
+
+def text_key(text: str) -> bytes:
+    """
+    Returns the sha256 digest identifying a text in the store.
+    """
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def stable_fraction(keys) -> np.ndarray:
+    """
+    Maps text hashes to [0, 1) deterministically, for splits that stay the same across runs
+    and corpus growth.
+    """
+    keys = np.ascontiguousarray(keys)
+    return keys[:, :4].copy().view(">u4").ravel() / 2.0 ** 32
+
+
+class FeatureStore:
+    """
+    Read-only view of a committed store.
+
+    Args:
+        path (str): Store directory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.features = np.load(os.path.join(path, "features.npy"), mmap_mode="r")
+        self.labels = np.load(os.path.join(path, "labels.npy"), mmap_mode="r")
+        self.keys = np.load(os.path.join(path, "keys.npy"), mmap_mode="r")
+
+    @classmethod
+    def open(cls, path: str, meta: dict):
+        """
+        Opens the store at path if it exists and was built with the given settings.
+
+        Returns:
+            Optional[FeatureStore]: The store, or None.
+        """
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        store = cls(path)
+        if any(store.meta.get(name) != value for name, value in meta.items()):
+            return None
+        return store
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    def key_index(self) -> dict:
+        """
+        Maps each text hash to a row holding its features.
+        """
+        return {bytes(key): row for row, key in enumerate(self.keys)}
+
+
+class FeatureStoreWriter:
+    """
+    Writes a new store of n_rows rows into a temporary directory next to path.
+
+    Args:
+        path (str): Final store directory.
+        n_rows (int): Number of rows.
+        dim (int): Embedding dimension.
+    """
+
+    def __init__(self, path: str, n_rows: int, dim: int):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        open_memmap = np.lib.format.open_memmap
+        self.features = open_memmap(os.path.join(self.tmp_path, "features.npy"), mode="w+",
+                                    dtype=np.float32, shape=(n_rows, dim))
+        self.labels = open_memmap(os.path.join(self.tmp_path, "labels.npy"), mode="w+",
+                                  dtype=np.int32, shape=(n_rows,))
+        self.keys = open_memmap(os.path.join(self.tmp_path, "keys.npy"), mode="w+",
+                                dtype=np.uint8, shape=(n_rows, 32))
+
+    def write(self, start: int, X, keys, labels):
+        end = start + len(X)
+        self.features[start:end] = X
+        self.labels[start:end] = labels
+        self.keys[start:end] = np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(-1, 32)
+
+    def commit(self, meta: dict) -> FeatureStore:
+        """
+        Flushes the arrays and replaces the previous store with this one.
+        """
+        for array in (self.features, self.labels, self.keys):
+            array.flush()
+        self.features = self.labels = self.keys = None
+        with open(os.path.join(self.tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        old_path = self.path + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.replace(self.path, old_path)
+        os.replace(self.tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return FeatureStore(self.path)
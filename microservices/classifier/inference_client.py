@@ -0,0 +1,242 @@
+"""
+inference_client.py
+===================
+
+Thin client of the local inference server (classifier/inference_server.py).
+
+When INFERENCE_SERVER_URL is set, main.py and the pipeline worker import classify_text,
+embed_sentences and get_engine from here instead of loading the models: a worker process
+then only holds a socket, and all workers share the server's hot, micro-batched replicas.
+The functions take the same arguments as their in-process counterparts; the embedder
+arguments are accepted and ignored.
+
+Only the standard library and NumPy are imported, so starting a worker stays cheap.
+
+Usage:
+------
+INFERENCE_SERVER_URL=http://127.0.0.1:8765 python main.py
+
+from classifier.inference_client import classify_text, embed_texts
+result = classify_text("Some article text")     # same dict as model_service.classify_text
+X = embed_texts(["first article", "second"])     # same array as utils.embed_texts
+
+python -m classifier.inference_client --concurrency 16 --requests 400   # load test a running server
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import numpy as np
+from classifier.inference_server import DEFAULT_URL, decode_array, encode_array
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# empty: classify and embed in-process
+INFERENCE_SERVER_URL = os.getenv("INFERENCE_SERVER_URL", "")
+TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "120"))
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class InferenceClient:
+    """
+    Keeps one persistent connection to the server per thread.
+
+    Args:
+        url (str): http://host:port or unix:///path of the server.
+        timeout (float): Seconds to wait for a response.
+    """
+
+    def __init__(self, url: str, timeout: float = TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self._parsed = urlparse(url)
+        if self._parsed.scheme not in ("http", "unix"):
+            raise ValueError(f"Unsupported inference server URL {url!r}, expected http:// or unix://")
+        self._local = threading.local()
+        self._info = None
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self._parsed.scheme == "unix":
+                connection = UnixHTTPConnection(self._parsed.path, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(
+                    self._parsed.hostname, self._parsed.port or 80, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def request(self, method: str, path: str, payload: dict = None) -> dict:
+        """
+        Sends one request and returns the decoded JSON response.
+
+        Raises:
+            RuntimeError: If the server answers with an error.
+            OSError: If the server cannot be reached.
+        """
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # the server closed the kept-alive connection; reconnect once
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+        result = json.loads(data)
+        if response.status != 200:
+            raise RuntimeError(f"Inference server error {response.status} on {path}: "
+                               f"{result.get('error', data[:200])}")
+        return result
+
+    def info(self) -> dict:
+        """
+        Profile, model, backend and dimension the server embeds with (cached).
+        """
+        if self._info is None:
+            self._info = self.request("GET", "/health")
+        return self._info
+
+    def classify_texts(self, texts, top_k=3) -> list:
+        return self.request("POST", "/classify", {"texts": list(texts), "top_k": top_k})["results"]
+
+    def classify_embeddings(self, X, top_k=3) -> list:
+        return self.request("POST", "/classify/embeddings",
+                            {"embeddings": encode_array(np.asarray(X)), "top_k": top_k})["results"]
+
+    def embed_texts(self, texts) -> np.ndarray:
+        return decode_array(self.request("POST", "/embed/texts", {"texts": list(texts)})["embeddings"])
+
+    def embed_sentences(self, texts) -> np.ndarray:
+        return decode_array(self.request("POST", "/embed/sentences", {"texts": list(texts)})["embeddings"])
+
+
+class RemoteEngine:
+    """
+    Stands in for the EmbeddingEngine in workers (main.py only reads its dimension).
+    """
+
+    def __init__(self, client: InferenceClient):
+        self.client = client
+
+    @property
+    def dimension(self) -> int:
+        return int(self.client.info()["dimension"])
+
+    @property
+    def model_name(self) -> str:
+        return self.client.info()["model"]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> InferenceClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = InferenceClient(INFERENCE_SERVER_URL or DEFAULT_URL)
+        return _client
+
+
+def get_engine(profile=None, backend=None) -> RemoteEngine:
+    return RemoteEngine(get_client())
+
+
+def warmup():
+    """
+    Checks that the server is reachable (the models are loaded there).
+    """
+    get_client().info()
+
+
+def classify_texts(texts, top_k=3):
+    """
+    Same as model_service.classify_texts(texts, top_k, as_dict=True).
+    """
+    return get_client().classify_texts(texts, top_k=top_k)
+
+
+def classify_text(text, top_k=3):
+    """
+    Same as model_service.classify_text.
+    """
+    return get_client().classify_texts([text], top_k=top_k)[0]
+
+
+def classify_embeddings(X, top_k=3, as_dict=True):
+    """
+    Same as model_service.classify_embeddings(X, top_k, as_dict=True).
+    """
+    return get_client().classify_embeddings(X, top_k=top_k)
+
+
+def embed_texts(texts, embedder=None, **kwargs):
+    """
+    Same as utils.embed_texts with the server's default chunking and pooling.
+    """
+    return get_client().embed_texts(texts)
+
+
+def embed_sentences(texts, embedder=None, **kwargs):
+    """
+    Same as utils.embed_sentences.
+    """
+    return get_client().embed_sentences(texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running inference server.")
+    parser.add_argument("--url", default=INFERENCE_SERVER_URL or DEFAULT_URL)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--endpoint", choices=("classify", "embed"), default="classify")
+    args = parser.parse_args()
+
+    client = InferenceClient(args.url)
+    print("Server:", client.info())
+    sample = "A short article about a football match, the teams and the final score. "
+    texts = [f"{sample} Request {i}." for i in range(args.requests)]
+    call = client.classify_texts if args.endpoint == "classify" else client.embed_texts
+
+    def timed(text):
+        start = time.perf_counter()
+        call([text])
+        return (time.perf_counter() - start) * 1000
+
+    call(texts[:1])  # warm up
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = list(pool.map(timed, texts))
+    elapsed = time.perf_counter() - start
+    print(f"{args.requests} single-text requests, concurrency {args.concurrency}: "
+          f"{args.requests / elapsed:.1f} req/s, p50 {np.percentile(latencies, 50):.1f} ms, "
+          f"p95 {np.percentile(latencies, 95):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
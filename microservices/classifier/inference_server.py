@@ -0,0 +1,357 @@
+"""
+inference_server.py
+===================
+
+Local inference server: one set of hot model replicas shared by any number of worker processes.
+
+Workers that set INFERENCE_SERVER_URL talk to it through the thin client in
+classifier/inference_client.py instead of loading the embedder and the classifier themselves.
+
+Endpoints (JSON over HTTP, on localhost or a Unix socket):
+----------------------------------------------------------
+- POST /classify         {"texts": [...], "top_k": 3}  -> {"results": [classify_text dicts]}
+- POST /classify/embeddings {"embeddings": <array>, "top_k": 3} -> {"results": [...]}  (classify_embeddings)
+- POST /embed/texts      {"texts": [...]}              -> {"embeddings": <array>}  (embed_texts)
+- POST /embed/sentences  {"texts": [...]}              -> {"embeddings": <array>}  (embed_sentences)
+- GET  /health                                         -> profile, model, dimension, backend
+
+Arrays are sent as {"dtype", "shape", "data": base64 of the raw bytes}.
+
+Micro-batching:
+---------------
+Concurrent requests for the same operation are coalesced: a batcher thread takes the first
+waiting request, then keeps collecting until INFERENCE_MAX_BATCH texts are queued or
+INFERENCE_MAX_WAIT_MS milliseconds have passed, runs the whole batch through the model in one
+call and hands every request its rows back. Under load this turns many single-text forward
+passes into a few large ones; an idle server adds at most the wait to a request.
+
+Replicas:
+---------
+With --processes N (INFERENCE_PROCESSES) the server binds its socket, then forks N replicas
+that all accept on it. Each loads its own model and uses cpu_count // N torch threads.
+
+Usage:
+------
+python -m classifier.inference_server                                  # INFERENCE_SERVER_URL or http://127.0.0.1:8765
+python -m classifier.inference_server --url unix:///tmp/credx-inference.sock --processes 2
+"""
+import argparse
+import base64
+import functools
+import json
+import logging
+import os
+import queue
+import signal
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_URL = "http://127.0.0.1:8765"
+MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "32"))
+MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+PROCESSES = int(os.getenv("INFERENCE_PROCESSES", "1"))
+# largest request body accepted, in bytes
+MAX_REQUEST_BYTES = 32 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def encode_array(array: np.ndarray) -> dict:
+    array = np.ascontiguousarray(array)
+    return {"dtype": array.dtype.str, "shape": list(array.shape),
+            "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def decode_array(payload: dict) -> np.ndarray:
+    data = base64.b64decode(payload["data"])
+    return np.frombuffer(data, dtype=np.dtype(payload["dtype"])).reshape(payload["shape"])
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls of a batch function into micro-batches.
+
+    Args:
+        name (str): Name of the batcher thread.
+        run_batch (Callable): Takes a list of items and returns one result per item
+            (any sequence supporting slicing, e.g. a list or an array).
+        max_batch_size (int): Items per batch; a single larger request runs as its own batch.
+        max_wait_ms (float): How long the first request of a batch waits for others.
+    """
+
+    def __init__(self, name, run_batch, max_batch_size=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._requests = queue.Queue()
+        self._carry = None  # request that did not fit into the previous batch
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, items) -> Future:
+        """
+        Queues items for the next batch.
+
+        Returns:
+            Future: Resolves to the results of these items, in order.
+        """
+        future = Future()
+        items = list(items)
+        if not items:
+            future.set_result(self.run_batch([]))
+        else:
+            self._requests.put((items, future))
+        return future
+
+    def __call__(self, items):
+        return self.submit(items).result()
+
+    def _collect(self) -> list:
+        first = self._carry or self._requests.get()
+        self._carry = None
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                request = self._requests.get(timeout=timeout) if timeout > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for request_items, _ in batch for item in request_items]
+            try:
+                results = self.run_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for request_items, future in batch:
+                future.set_result(results[start:start + len(request_items)])
+                start += len(request_items)
+            logger.debug("%s: ran %d requests as one batch of %d items",
+                         self._thread.name, len(batch), len(items))
+
+
+class InferenceService:
+    """
+    The model operations the server exposes, each behind its own MicroBatcher.
+    """
+
+    def __init__(self, max_batch_size=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        from classifier import model_service
+        from classifier.utils import embed_sentences, embed_texts
+
+        model_service.warmup()
+        self.embedder = model_service.embedder
+        self._classify_texts = model_service.classify_texts
+        # one matmul, cheap enough to run per request without batching
+        self.classify_embeddings = functools.partial(model_service.classify_embeddings, as_dict=True)
+        self.classify = MicroBatcher("classify", self._classify_batch, max_batch_size, max_wait_ms)
+        self.embed_texts = MicroBatcher(
+            "embed-texts", lambda texts: embed_texts(texts, embedder=self.embedder),
+            max_batch_size, max_wait_ms)
+        self.embed_sentences = MicroBatcher(
+            "embed-sentences", lambda texts: embed_sentences(texts, embedder=self.embedder),
+            max_batch_size, max_wait_ms)
+
+    def _classify_batch(self, items):
+        # items are (text, top_k); classify once with the largest k, then trim per text
+        if not items:
+            return []
+        top_k = max(k for _, k in items)
+        result = self._classify_texts([text for text, _ in items], top_k=top_k)
+        class_labels = result.classes.tolist()
+        return [{
+            "label": result.labels[i],
+            "confidence": float(result.confidences[i]),
+            "top_probs": list(zip(result.top_labels[i, :k].tolist(), result.top_probs[i, :k].tolist())),
+            "all_probs": dict(zip(class_labels, result.probs[i].tolist())),
+        } for i, (_, k) in enumerate(items)]
+
+    def info(self) -> dict:
+        profile = getattr(self.embedder, "profile", None)
+        return {"status": "ok", "pid": os.getpid(),
+                "profile": profile.name if profile else None,
+                "model": self.embedder.model_name,
+                "backend": self.embedder.backend,
+                "dimension": self.embedder.dimension}
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, clients reuse their connection
+    # headers and body are written separately; without this, Nagle's algorithm and the
+    # client's delayed ACK hold every response back by ~40 ms
+    disable_nagle_algorithm = True
+    service: InferenceService = None
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self._send(404, {"error": f"Unknown path {self.path}"})
+        self._send(200, self.service.info())
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > MAX_REQUEST_BYTES:
+                return self._send(413, {"error": "Request too large"})
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/classify/embeddings":
+                X = decode_array(body["embeddings"])
+                if X.ndim != 2:
+                    return self._send(400, {"error": "'embeddings' must be a 2-d array"})
+                results = self.service.classify_embeddings(X, top_k=int(body.get("top_k", 3)))
+                return self._send(200, {"results": results})
+            texts = body.get("texts")
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                return self._send(400, {"error": "'texts' must be a list of strings"})
+        except (ValueError, TypeError, KeyError) as e:
+            return self._send(400, {"error": f"Invalid request: {e}"})
+        except Exception as e:
+            logger.error("Error handling %s: %s", self.path, e, exc_info=True)
+            return self._send(500, {"error": str(e)})
+
+        try:
+            if self.path == "/classify":
+                top_k = int(body.get("top_k", 3))
+                results = self.service.classify([(text, top_k) for text in texts])
+                return self._send(200, {"results": results})
+            if self.path == "/embed/texts":
+                return self._send(200, {"embeddings": encode_array(self.service.embed_texts(texts))})
+            if self.path == "/embed/sentences":
+                return self._send(200, {"embeddings": encode_array(self.service.embed_sentences(texts))})
+        except Exception as e:
+            logger.error("Error handling %s: %s", self.path, e, exc_info=True)
+            return self._send(500, {"error": str(e)})
+        self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # the default writes every request to stderr (and fails on Unix socket addresses)
+        logger.debug(format, *args)
+
+
+class UnixInferenceRequestHandler(InferenceRequestHandler):
+    disable_nagle_algorithm = False  # TCP only
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def make_server(url: str):
+    """
+    Binds (but does not start) the HTTP server for url: http://host:port or unix:///path.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        if os.path.exists(parsed.path):
+            os.unlink(parsed.path)
+        return ThreadingUnixHTTPServer(parsed.path, UnixInferenceRequestHandler)
+    if parsed.scheme != "http":
+        raise ValueError(f"Unsupported inference server URL {url!r}, expected http:// or unix://")
+    server = ThreadingHTTPServer((parsed.hostname or "127.0.0.1", parsed.port or 80),
+                                 InferenceRequestHandler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_replica(server, threads, max_batch_size=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+    """
+    Loads the models and serves requests on an already bound server until interrupted.
+    """
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+    InferenceRequestHandler.service = InferenceService(max_batch_size, max_wait_ms)
+    logger.info("Inference replica %d ready (%d torch threads)", os.getpid(), torch.get_num_threads())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_server(url=None, processes=PROCESSES, max_batch_size=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+    """
+    Serves the models on url with the given number of replica processes.
+    """
+    url = url or os.getenv("INFERENCE_SERVER_URL") or DEFAULT_URL
+    server = make_server(url)
+    processes = max(1, processes)
+    threads = max(1, (os.cpu_count() or 1) // processes)
+    logger.info("Inference server listening on %s (%d replicas, batches of up to %d, %.1f ms wait)",
+                url, processes, max_batch_size, max_wait_ms)
+    if processes == 1:
+        serve_replica(server, threads, max_batch_size, max_wait_ms)
+        return
+
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            serve_replica(server, threads, max_batch_size, max_wait_ms)
+            os._exit(0)
+        children.append(pid)
+    server.socket.close()
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        stop(signal.SIGINT, None)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Serve the embedder and classifier to local workers.")
+    parser.add_argument("--url", default=None,
+                        help=f"http://host:port or unix:///path (default: INFERENCE_SERVER_URL or {DEFAULT_URL}).")
+    parser.add_argument("--processes", type=int, default=PROCESSES)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    args = parser.parse_args()
+    run_server(args.url, args.processes, args.max_batch, args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,44 +6,83 @@ This module provides a service interface for text classification using a sentenc
 
 Main Functions:
 ---------------
+- warmup():
+    Loads the classifier and the embedder. Nothing is loaded at import time; the first classification
+    or update calls warmup() itself, services call it at startup so the first request is not slow.
+
 - classify_text(text, top_k=3):
     Classifies a given text into one of the trained categories.
     Returns a dictionary with the top label, confidence, and top-k probabilities.
 
+- classify_texts(texts, top_k=3, as_dict=False):
+    Classifies a list of texts in one batch (one embedding pass, one probability matrix).
+    Returns a BatchClassification of arrays, or a list of classify_text-style dicts.
+
+- classify_embeddings(X, top_k=3, as_dict=False):
+    Same as classify_texts for texts already embedded with utils.embed_texts.
+
 - incremental_update(new_texts, new_labels):
-    Incrementally updates the base SGDClassifier with new labeled data using partial_fit.
-    Persists the updated model bundle to disk. (No recalibration is done here.)
+    Incrementally updates a shadow copy of the base SGDClassifier with new labeled data using partial_fit.
+    Every MODEL_RECALIBRATE_EVERY samples the shadow is recalibrated on the bundle's held-out set,
+    snapshotted to disk and swapped in as the served model.
 
 Details:
 --------
-- Loads a model bundle (CalibratedClassifierCV for inference, SGDClassifier for updates, label mappings, embedder info) from disk.
-- Embeds input text using the same sentence-transformer model as used in training.
+- Classifies with the compiled head of the model bundle (model_head.npz, see compiled_head.py): one matmul plus the
+  sigmoid calibration, loaded without sklearn or unpickling. The head is (re)compiled from the bundle when it is
+  missing or older than the bundle.
+- The full model bundle (CalibratedClassifierCV, SGDClassifier for updates, label mappings, embedder info) is only
+  unpickled for incremental updates, or to classify when its classifier cannot be compiled.
+- Embeds input text with the shared embedding engine (classifier/embedding_engine.py), using the same model as in training.
 - Supports thread-safe incremental updates.
-- Uses softmax on decision_function output for probability estimates if available, otherwise uses predict_proba.
+- Without a compiled head, uses softmax on decision_function output for probability estimates if available, otherwise uses predict_proba.
+- Probabilities and top-k selection are computed for the whole batch at once (argpartition, no per-class Python loops).
 
 Usage:
 ------
-from model_service import classify_text, incremental_update
+from model_service import classify_text, incremental_update, warmup
+warmup()                                      # optional, loads the models now
 result = classify_text("Some article text")
+batch = classify_texts(["first article", "second article"])
+batch.labels        # array(['Technology', 'Sports'], dtype=object)
 
 Thread Safety:
 --------------
+- The served model is one immutable ModelState; updates and reloads replace the reference, so
+  classification never locks and never stalls while a model is updated.
 - Model updating is protected by a threading lock (_lock) to ensure atomic updates.
+- Bundle and head snapshots are written to a temp file and renamed into place. Other processes notice the
+  new files (checked every MODEL_RELOAD_INTERVAL seconds) and reload them without a restart.
+- Processes publish under an exclusive file lock (model_bundle.pkl.lock). A process whose bundle is older
+  than the one on disk reloads it and replays its own pending feedback onto it first, so no process
+  overwrites the updates another one published.
 
 """
+import copy
+import fcntl
 import logging
 import os
 import threading
+import time
+from typing import Any, NamedTuple, Optional
 
-import joblib
 import numpy as np
+from classifier.compiled_head import (HEAD_FILE_PATH, CompiledHead,
+                                     export_compiled_head)
+from classifier.embedding_engine import get_engine
+from classifier.embedding_profiles import get_profile, profile_for_model
 from classifier.utils import embed_texts
-from sentence_transformers import SentenceTransformer
-from sklearn.linear_model import SGDClassifier
+from dotenv import load_dotenv
+
+load_dotenv()
 
 MICROSERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_FILE_PATH = os.path.join(MICROSERVICE_DIR, "model_bundle.pkl")
-_lock = threading.Lock()
+# seconds between checks for a model published by another process
+RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", "30"))
+# feedback samples fit into the shadow classifier before it is recalibrated and published
+RECALIBRATE_EVERY = int(os.getenv("MODEL_RECALIBRATE_EVERY", "256"))
+_lock = threading.Lock()  # serializes updates; classification never takes it
 
 logger = logging.getLogger(__name__)
 
@@ -56,39 +95,326 @@ def softmax(x):
         x (np.ndarray): Input array.
 
     Returns:
-        np.ndarray: Softmax-transformed array.
+        np.ndarray: Softmax-transformed array (along the last axis, so row-wise for 2-D input).
+    """
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+class BatchClassification(NamedTuple):
+    """
+    Result of classify_texts for n texts and C classes.
+
+    Attributes:
+        labels (np.ndarray): (n,) top label per text.
+        confidences (np.ndarray): (n,) probability of the top label.
+        top_labels (np.ndarray): (n, k) labels of the k most probable classes, best first.
+        top_probs (np.ndarray): (n, k) their probabilities.
+        probs (np.ndarray): (n, C) probabilities of all classes, in the order of classes.
+        classes (np.ndarray): (C,) label of each probability column.
     """
-    e = np.exp(x - np.max(x))
-    return e / e.sum(axis=-1)
+    labels: np.ndarray
+    confidences: np.ndarray
+    top_labels: np.ndarray
+    top_probs: np.ndarray
+    probs: np.ndarray
+    classes: np.ndarray
+
+
+def bundle_profile_name(bundle):
+    """
+    Name of the embedding profile a bundle was trained with. Bundles saved before the
+    profile registry only record the model name.
+    """
+    if "embed_profile" in bundle:
+        return bundle["embed_profile"]
+    profile = profile_for_model(bundle.get("embed_model"))
+    return profile.name if profile else bundle.get("embed_model")
+
+
+def check_profile(trained_with, path):
+    """
+    Raises:
+        RuntimeError: If the model at path was trained with another embedding profile than
+            the active one; its classifier would be fed vectors from a different space.
+    """
+    profile = get_profile()
+    if trained_with != profile.name:
+        raise RuntimeError(
+            f"Model {path} was trained with embedding profile {trained_with!r}, "
+            f"but the active profile is {profile.name!r}. Set EMBED_PROFILE={trained_with} "
+            "or retrain the bundle with the active profile.")
+    return profile
 
 
 def load_bundle(path=MODEL_FILE_PATH):
     """
-    Load the model bundle and sentence transformer embedder from disk.
+    Load the model bundle from disk and attach the shared embedding engine.
 
     Args:
         path (str): Path to the model bundle file.
 
     Returns:
-        tuple: (bundle dict, embedder instance)
+        tuple: (bundle dict, EmbeddingEngine instance)
+
+    Raises:
+        RuntimeError: If the bundle was trained with another embedding profile than the
+            active one (see check_profile).
     """
     if os.path.exists(path) is False:
         logger.info("Model bundle not found at %s. Creating a new model", path)
         from classifier.train import initial_train
         initial_train()
+    import joblib
+
     logger.info("Loading model bundle from %s", path)
     bundle = joblib.load(path)
-    embedder = SentenceTransformer(bundle["embed_model"])
+    profile = check_profile(bundle_profile_name(bundle), path)
+    embedder = get_engine(profile)
     logger.info("Model bundle and embedder loaded successfully.")
     return bundle, embedder
 
 
-# load once (you can also lazy-load in functions)
-bundle, embedder = load_bundle()
-clf = bundle["clf"]  # CalibratedClassifierCV for inference
-idx2label = bundle["idx2label"]
-label2idx = bundle["label2idx"]
-base_clf = bundle.get("base_clf", None)  # SGDClassifier for updates
+def load_head(bundle_path=MODEL_FILE_PATH, head_path=HEAD_FILE_PATH):
+    """
+    Load the compiled classifier head, compiling it from the bundle first if it is missing
+    or older than the bundle.
+
+    Args:
+        bundle_path (str): Path to the model bundle file.
+        head_path (str): Path to the compiled head file.
+
+    Returns:
+        tuple: (CompiledHead or None, bundle dict or None, EmbeddingEngine instance). The
+            head is None when the bundle's classifier cannot be compiled; the bundle is None
+            when the head was up to date.
+    """
+    if os.path.exists(head_path) and (not os.path.exists(bundle_path)
+                                      or os.path.getmtime(head_path) >= os.path.getmtime(bundle_path)):
+        logger.info("Loading compiled classifier head from %s", head_path)
+        head = CompiledHead.load(head_path)
+        profile = check_profile(head.embed_profile, head_path)
+        return head, None, get_engine(profile)
+    bundle, embedder = load_bundle(bundle_path)
+    bundle.setdefault("embed_profile", bundle_profile_name(bundle))
+    try:
+        head = export_compiled_head(bundle, head_path)
+    except ValueError as e:
+        logger.warning("Classifying with the bundle, its classifier cannot be compiled: %s", e)
+        head = None
+    return head, bundle, embedder
+
+
+class ModelState(NamedTuple):
+    """
+    Everything classification reads. Published as a whole by swapping one module-level
+    reference, so readers never take a lock and never see a half-updated model.
+
+    Attributes:
+        head (Optional[CompiledHead]): Compiled classifier, None if it could not be compiled.
+        clf: Bundle classifier, only used when there is no head.
+        class_labels (np.ndarray): Label of each probability column.
+        version (tuple): (bundle, head) file modification times the state was loaded from.
+    """
+    head: Optional[CompiledHead]
+    clf: Any
+    class_labels: np.ndarray
+    version: tuple
+
+
+def model_files_version(bundle_path=MODEL_FILE_PATH, head_path=HEAD_FILE_PATH) -> tuple:
+    """
+    Modification times of the bundle and head files; changes when any process publishes.
+    """
+    return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None
+                 for path in (bundle_path, head_path))
+
+
+def make_state(head, bundle) -> ModelState:
+    if head is not None:
+        return ModelState(head=head, clf=None, class_labels=head.classes,
+                          version=model_files_version())
+    clf = bundle["clf"]
+    class_labels = np.array([bundle["idx2label"][int(c)] for c in clf.classes_], dtype=object)
+    return ModelState(head=None, clf=clf, class_labels=class_labels, version=model_files_version())
+
+
+# loaded by warmup(), on first use
+head = _bundle = embedder = None
+_state = None
+_load_lock = threading.Lock()
+
+# incremental updates: feedback is fit into a shadow copy of the base classifier and
+# published (recalibrated, snapshotted, swapped in) every RECALIBRATE_EVERY samples
+_shadow = None
+_pending = []  # (X, y) fit into the shadow since the last publish
+_bundle_version = None  # bundle file modification time _bundle was loaded from or saved as
+_reload_lock = threading.Lock()
+_next_reload_check = 0.0
+
+
+def warmup() -> ModelState:
+    """
+    Loads the compiled head (or the bundle) and the embedder, once per process.
+
+    Returns:
+        ModelState: The served model.
+    """
+    global head, _bundle, _bundle_version, embedder, _state, _next_reload_check
+    if _state is None:
+        with _load_lock:
+            if _state is None:
+                version = model_files_version()[0]
+                head, _bundle, embedder = load_head()
+                _bundle_version = version
+                _next_reload_check = time.monotonic() + RELOAD_INTERVAL
+                _state = make_state(head, _bundle)
+    return _state
+
+
+def current_state() -> ModelState:
+    """
+    Returns the served model, loading it on first use. At most every MODEL_RELOAD_INTERVAL
+    seconds, checks whether another process published a newer one and reloads it in the
+    background.
+    """
+    global _next_reload_check
+    if _state is None:
+        return warmup()
+    now = time.monotonic()
+    if now >= _next_reload_check and _reload_lock.acquire(blocking=False):
+        _next_reload_check = now + RELOAD_INTERVAL
+        if model_files_version() != _state.version:
+            threading.Thread(target=_reload_in_background, daemon=True).start()
+        else:
+            _reload_lock.release()
+    return _state
+
+
+def _reload_in_background():
+    try:
+        reload_model()
+    except Exception as e:
+        logger.error("Model reload failed, keeping the current model: %s", e, exc_info=True)
+    finally:
+        _reload_lock.release()
+
+
+def reload_model():
+    """
+    Loads the model published on disk and swaps it in. Feedback this process has not
+    published yet is replayed onto the new base classifier.
+    """
+    global _state
+    version = model_files_version()[0]
+    head, bundle, _ = load_head()
+    state = make_state(head, bundle)
+    with _lock:
+        _use_bundle(bundle, version)
+    _state = state
+    logger.info("Reloaded the classifier published at %s", MODEL_FILE_PATH)
+
+
+def predict_probabilities(X, state=None):
+    """
+    Class probabilities for a matrix of embeddings.
+
+    Args:
+        X (np.ndarray): Embeddings of shape (n, dim).
+        state (Optional[ModelState]): Model to use (default: the served one).
+
+    Returns:
+        np.ndarray: Probabilities of shape (n, n_classes), columns ordered like class_labels.
+    """
+    state = state or current_state()
+    if state.head is not None:
+        return state.head.predict_proba(X)
+    clf = state.clf
+    if hasattr(clf, "decision_function"):
+        scores = clf.decision_function(X)
+        if scores.ndim == 1:
+            # binary: the score is the logit of the second class
+            scores = np.column_stack([np.zeros_like(scores), scores])
+        return softmax(scores)
+    # fallback to predict_proba if available
+    return clf.predict_proba(X)
+
+
+def classify_texts(texts, top_k=3, as_dict=False, batch_size=32):
+    """
+    Classify a list of texts in one batch.
+
+    Args:
+        texts (list of str): The input texts.
+        top_k (int): Number of most probable classes to return per text.
+        as_dict (bool): Return one classify_text-style dict per text instead of arrays.
+        batch_size (int): Chunks per forward pass of the embedder.
+
+    Returns:
+        BatchClassification | list of dict: Arrays covering all texts, or one dict per text
+            (see classify_text).
+
+    Raises:
+        Exception: If embedding or classification fails.
+    """
+    try:
+        texts = list(texts)
+        # one snapshot for the whole call, so a concurrent swap cannot mix two models
+        state = current_state()
+        X = embed_texts(texts, embedder=embedder, batch_size=batch_size) if texts else None
+    except Exception as e:
+        logger.error("Error during classification: %s", str(e), exc_info=True)
+        raise
+    return classify_embeddings(X, top_k=top_k, as_dict=as_dict, state=state)
+
+
+def classify_embeddings(X, top_k=3, as_dict=False, state=None):
+    """
+    Classify texts already embedded with embed_texts (e.g. by an article analysis that
+    reuses the vectors for other steps).
+
+    Args:
+        X (Optional[np.ndarray]): (n_texts, dim) embeddings; None or empty for no texts.
+        top_k (int): Number of most probable classes to return per text.
+        as_dict (bool): Return one classify_text-style dict per text instead of arrays.
+        state (Optional[ModelState]): Model snapshot to use (default: the current one).
+
+    Returns:
+        BatchClassification | list of dict: As classify_texts.
+
+    Raises:
+        Exception: If classification fails.
+    """
+    try:
+        if state is None:
+            state = current_state()
+        class_labels = state.class_labels
+        n_classes = len(class_labels)
+        k = max(1, min(top_k, n_classes))
+        if X is None or len(X) == 0:
+            probs = np.zeros((0, n_classes))
+        else:
+            probs = predict_probabilities(np.asarray(X), state=state)
+        # unordered top k per row, then sort just those k
+        top_idx = np.argpartition(-probs, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(probs, top_idx, axis=1), axis=1, kind="stable")
+        top_idx = np.take_along_axis(top_idx, order, axis=1)
+        top_probs = np.take_along_axis(probs, top_idx, axis=1)
+        result = BatchClassification(labels=class_labels[top_idx[:, 0]], confidences=top_probs[:, 0],
+                                     top_labels=class_labels[top_idx], top_probs=top_probs,
+                                     probs=probs, classes=class_labels)
+        logger.debug("Classified %d texts", len(probs))
+        if not as_dict:
+            return result
+        return [{
+            "label": result.labels[i],
+            "confidence": float(result.confidences[i]),
+            "top_probs": list(zip(result.top_labels[i].tolist(), result.top_probs[i].tolist())),
+            "all_probs": dict(zip(class_labels.tolist(), probs[i].tolist())),
+        } for i in range(len(probs))]
+    except Exception as e:
+        logger.error("Error during classification: %s", str(e), exc_info=True)
+        raise
 
 
 def classify_text(text, top_k=3):
@@ -110,39 +436,126 @@ def classify_text(text, top_k=3):
     Raises:
         Exception: If embedding or classification fails.
     """
+    result = classify_texts([text], top_k=top_k, as_dict=True)[0]
+    logger.debug("Classification result: label=%s, confidence=%.4f",
+                 result["label"], result["confidence"])
+    return result
+
+
+def _ensure_bundle():
+    """
+    Unpickles the full model bundle if only the compiled head was loaded. Caller holds _lock.
+    """
+    global _bundle, _bundle_version
+    if _bundle is None:
+        version = model_files_version()[0]
+        _bundle, _ = load_bundle()
+        _bundle_version = version
+    return _bundle
+
+
+def _use_bundle(bundle, version):
+    """
+    Makes bundle (None: unpickled on next use) the base of updates and replays the feedback
+    not published yet onto its classifier. Caller holds _lock.
+    """
+    global _bundle, _bundle_version, _shadow
+    _bundle, _bundle_version, _shadow = bundle, version, None
+    if _pending:
+        shadow = _ensure_shadow()
+        classes = np.arange(len(_ensure_bundle()["label2idx"]))
+        for X, y in _pending:
+            shadow.partial_fit(X, y, classes=classes)
+
+
+def _ensure_shadow():
+    """
+    Returns the shadow classifier updates are fit into, copying it from the bundle's base
+    classifier on first use. Caller holds _lock.
+    """
+    global _shadow
+    if _shadow is None:
+        bundle = _ensure_bundle()
+        base = bundle.get("base_clf")
+        if base is None and hasattr(bundle["clf"], "calibrated_classifiers_"):
+            # bundles saved without base_clf: start from the first cross-validation fold
+            base = bundle["clf"].calibrated_classifiers_[0].estimator
+            base = getattr(base, "estimator", base)  # unwrap FrozenEstimator
+        if base is None:
+            from sklearn.linear_model import SGDClassifier
+            base = SGDClassifier(loss="log_loss", max_iter=1000, tol=1e-3)
+        _shadow = copy.deepcopy(base)
+    return _shadow
+
+
+def publish_model():
+    """
+    Recalibrates the shadow classifier on the bundle's held-out calibration set, snapshots
+    the new bundle and compiled head (write to a temp file, then rename) and swaps the
+    served model. Caller holds _lock; classification keeps running on the old model until
+    the swap.
+
+    Publishing is serialized between processes with an exclusive file lock. If another
+    process published since this one loaded its bundle, the new bundle is loaded and the
+    pending feedback replayed onto it first, so both processes' updates are kept.
+    """
+    with open(MODEL_FILE_PATH + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        version = model_files_version()[0]
+        if _bundle is None or version != _bundle_version:
+            bundle, _ = load_bundle()
+            _use_bundle(bundle, version)
+        _publish_locked()
+
+
+def _publish_locked():
+    """
+    publish_model once the file lock is held and _bundle is the newest bundle on disk.
+    """
+    global _state, _bundle, _bundle_version, _pending
+    from classifier.train import save_bundle
+    from sklearn.calibration import CalibratedClassifierCV
+    from sklearn.frozen import FrozenEstimator
+
+    bundle = _bundle
+    base = copy.deepcopy(_ensure_shadow())
+    calib_X, calib_y = bundle.get("calib_X"), bundle.get("calib_y")
+    if calib_X is None or calib_y is None:
+        logger.warning("Model bundle has no calibration set, so updates are saved but not "
+                       "served; retrain it with classifier.train to enable recalibration.")
+        new_bundle = dict(bundle, base_clf=base)
+        save_bundle(new_bundle, MODEL_FILE_PATH)
+        _bundle, _bundle_version, _pending = new_bundle, model_files_version()[0], []
+        return
+    calibrated = CalibratedClassifierCV(FrozenEstimator(base), method="sigmoid")
+    calibrated.fit(calib_X, calib_y)
+    new_bundle = dict(bundle, clf=calibrated, base_clf=base)
+    save_bundle(new_bundle, MODEL_FILE_PATH)
     try:
-        X = embed_texts([text], embedder=embedder)  # returns shape (1, dim)
-        # ensure shape then optional normalize (embed_texts already normalizes)
-        if hasattr(clf, "decision_function"):
-            scores = clf.decision_function(X)  # shape (1, n_classes)
-            if scores.ndim == 1:
-                probs = softmax(scores)
-            else:
-                probs = softmax(scores[0])
-        else:
-            # fallback to predict_proba if available
-            probs = clf.predict_proba(X)[0]
-        top_idx = int(np.argmax(probs))
-        top_label = idx2label[top_idx]
-        top_conf = float(probs[top_idx])
-        top_probs = sorted([(idx2label[i], float(probs[i]))
-                           for i in range(len(probs))], key=lambda x: -x[1])[:top_k]
-        logger.info(
-            "Classification result: label=%s, confidence=%.4f", top_label, top_conf)
-        return {"label": top_label, "confidence": top_conf, "top_probs": top_probs, "all_probs": {idx2label[i]: float(probs[i]) for i in range(len(probs))}}
-    except Exception as e:
-        logger.error("Error during classification: %s", str(e), exc_info=True)
-        raise
+        head = export_compiled_head(new_bundle, HEAD_FILE_PATH)
+    except ValueError as e:
+        logger.warning("Classifying with the bundle, its classifier cannot be compiled: %s", e)
+        head = None
+    _bundle, _bundle_version, _pending = new_bundle, model_files_version()[0], []
+    _state = make_state(head, new_bundle)
+    logger.info("Published recalibrated classifier to %s", MODEL_FILE_PATH)
 
 
-def incremental_update(new_texts, new_labels, batch_size=128):
+def incremental_update(new_texts, new_labels, batch_size=128, publish=None):
     """
-    Incrementally update the base SGDClassifier with new labeled data using partial_fit.
+    Incrementally update the classifier with new labeled data using partial_fit.
+
+    Updates are fit into a shadow copy of the base SGDClassifier, never into the served
+    model. Every RECALIBRATE_EVERY samples (or when publish=True) the shadow is
+    recalibrated and published (see publish_model). Classification does not wait for
+    either step.
 
     Args:
         new_texts (list of str): New input texts.
         new_labels (list of str): Corresponding labels (must be in existing categories).
-        batch_size (int): Batch size for updates (currently unused).
+        batch_size (int): Samples per partial_fit call.
+        publish (Optional[bool]): Force (True) or skip (False) publishing after this update
+            (default: publish once RECALIBRATE_EVERY samples are pending).
 
     Returns:
         None
@@ -150,28 +563,26 @@ def incremental_update(new_texts, new_labels, batch_size=128):
     Raises:
         Exception: If update fails.
     """
-    global bundle, embedder, clf, idx2label, label2idx, base_clf
     logger.info("Starting incremental update with %d new samples.",
                 len(new_texts))
     try:
+        warmup()
+        # embedding is the expensive part and runs outside the lock
         X = embed_texts(new_texts, embedder=embedder)
-        y = np.array([label2idx[l] for l in new_labels])
         with _lock:
-            if base_clf is None:
-                # Try to extract from calibrated clf if possible
-                if hasattr(clf, "base_estimator"):
-                    base_clf = clf.base_estimator
-                elif hasattr(clf, "estimator"):
-                    base_clf = clf.estimator
-                else:
-                    base_clf = SGDClassifier(
-                        loss="log_loss", max_iter=1000, tol=1e-3)
-                    base_clf.partial_fit(
-                        X, y, classes=np.arange(len(idx2label)))
-            base_clf.partial_fit(X, y)
-            bundle["base_clf"] = base_clf
-            joblib.dump(bundle, MODEL_FILE_PATH)
-        logger.info("Incremental update completed and model persisted.")
+            label2idx = _ensure_bundle()["label2idx"]
+            y = np.array([label2idx[l] for l in new_labels])
+            shadow = _ensure_shadow()
+            classes = np.arange(len(label2idx))
+            for start in range(0, len(y), batch_size):
+                shadow.partial_fit(X[start:start + batch_size], y[start:start + batch_size],
+                                   classes=classes)
+            _pending.append((X, y))
+            pending = sum(len(batch_y) for _, batch_y in _pending)
+            if publish or (publish is None and pending >= RECALIBRATE_EVERY):
+                publish_model()
+        logger.info("Incremental update completed (%d samples pending publication).",
+                    sum(len(batch_y) for _, batch_y in _pending))
     except Exception as e:
         logger.error("Error during incremental update: %s",
                      str(e), exc_info=True)
@@ -1,17 +1,35 @@
 """
 This script trains a text classification model using sentence-transformer embeddings and SGDClassifier.
 The trained model bundle is saved in the classifier microservice folder for consistent access.
+
+Two modes:
+- initial_train: loads train.csv into memory, embeds it and fits a 5-fold calibrated classifier.
+- stream_train: out-of-core. Streams the CSV in chunks into a memory-mapped feature store
+  (classifier/feature_store.py, features are reused when a text was embedded before), runs
+  partial_fit epochs over it and calibrates once on a held-out slice.
+
+Usage:
+------
+python -m classifier.train
+python -m classifier.train --stream --epochs 5 --chunksize 20000
 """
 
 
+import argparse
 import os
+from collections import Counter
 
 import joblib
 import numpy as np
 import pandas as pd
-from classifier.utils import EMBED_MODEL, embed_texts
-from sentence_transformers import SentenceTransformer
+from classifier.embedding_engine import get_engine
+from classifier.embedding_profiles import get_profile
+from classifier.feature_store import (FEATURES_DIR, FeatureStore,
+                                      FeatureStoreWriter, stable_fraction,
+                                      text_key)
+from classifier.utils import CHUNK_STRATEGY, MAX_CHUNKS, embed_texts
 from sklearn.calibration import CalibratedClassifierCV
+from sklearn.frozen import FrozenEstimator
 from sklearn.linear_model import SGDClassifier
 from sklearn.metrics import classification_report
 from sklearn.model_selection import train_test_split
@@ -19,6 +37,21 @@ from sklearn.utils import shuffle
 
 MICROSERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_OUT = os.path.join(MICROSERVICE_DIR, "model_bundle.pkl")
+DATA_PATH = os.path.join(MICROSERVICE_DIR, "data", "train.csv")
+
+
+def save_bundle(bundle, path=MODEL_OUT) -> None:
+    """
+    Save a model bundle atomically: workers hot-reloading the bundle never read a
+    partially written file.
+
+    Args:
+        bundle (dict): Model bundle.
+        path (str): Destination path.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(bundle, tmp_path)
+    os.replace(tmp_path, path)
 
 
 def load_data(csv_path) -> pd.DataFrame:
@@ -53,20 +86,20 @@ def prepare_labels(labels) -> tuple:
     return y, classes, label2idx, idx2label
 
 
-def initial_train(test_size=0.15, batch_size=128) -> None:
+def initial_train(test_size=0.15, batch_size=128, profile=None) -> None:
     """
     Train and calibrate a text classifier, then save the model bundle.
 
     Args:
-        test_size (float): Fraction of data to use for validation.
+        test_size (float): Fraction of data to use for validation, and of the rest to keep
+            for recalibrating updated models.
         batch_size (int): Batch size for partial_fit.
+        profile (Optional[str]): Embedding profile to train on (default: EMBED_PROFILE).
 
     Returns:
         None
     """
-    data_path = os.path.join(
-        os.path.dirname(__file__), "data", "train.csv")
-    df = load_data(data_path)
+    df = load_data(DATA_PATH)
 
     # Filter out classes with <2 samples
     class_counts = df['label'].value_counts()
@@ -83,20 +116,22 @@ def initial_train(test_size=0.15, batch_size=128) -> None:
     print(f"Classes: {classes}")
 
     # embed all texts (can be done in batches if memory limited)
-    embedder = SentenceTransformer(EMBED_MODEL)
+    profile = get_profile(profile)
+    print(f"Embedding profile: {profile.name} ({profile.model})")
+    embedder = get_engine(profile)
     X = embed_texts(texts, embedder=embedder)
 
     # train/test split
     X, y = shuffle(X, y, random_state=42)
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=test_size, random_state=42, stratify=y)  # ;)
+    # a separate slice for the recalibrations of model_service.publish_model, so they never
+    # see the evaluation rows (stratified unless a class has a single training row left)
+    stratify = y_train if np.bincount(y_train, minlength=len(classes)).min() >= 2 else None
+    X_train, X_calib, y_train, y_calib = train_test_split(
+        X_train, y_train, test_size=test_size, random_state=42, stratify=stratify)
 
     # classifier: SGD with log loss (approx logistic regression) supports partial_fit
-    clf = SGDClassifier(loss="log_loss", max_iter=1000, tol=1e-3)
-    calibrated_clf = CalibratedClassifierCV(clf, method="sigmoid", cv=5)
-    calibrated_clf.fit(X_train, y_train)
-    clf = calibrated_clf  # Use the calibrated classifier for evaluation and saving
-
     n = X_train.shape[0]
     classes_idx = np.arange(len(classes))
     base_clf = SGDClassifier(loss="log_loss", max_iter=1000, tol=1e-3)
@@ -119,12 +154,179 @@ def initial_train(test_size=0.15, batch_size=128) -> None:
     print("Validation results:")
     print(classification_report(y_test, ypred, target_names=classes))
 
-    # save bundle
+    # save bundle; base_clf and the held-out calibration set let
+    # model_service.incremental_update recalibrate and serve updated models
+    bundle = {
+        "clf": clf,
+        "base_clf": base_clf,
+        "calib_X": X_calib,
+        "calib_y": y_calib,
+        "label2idx": label2idx,
+        "idx2label": idx2label,
+        "embed_model": profile.model,
+        "embed_profile": profile.name,
+        "embed_dim": profile.dimension,
+    }
+    save_bundle(bundle, MODEL_OUT)
+    print("Saved model bundle to", MODEL_OUT)
+
+
+def scan_labels(csv_path, chunksize) -> tuple:
+    """
+    First pass over the CSV: counts the rows per label without keeping any text.
+
+    Returns:
+        tuple: (classes kept, number of rows kept)
+    """
+    class_counts = Counter()
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize, usecols=["text", "label"]):
+        chunk = chunk.dropna(subset=["text", "label"])
+        class_counts.update(chunk["label"].astype(str))
+    dropped_classes = sorted(c for c, count in class_counts.items() if count < 2)
+    if dropped_classes:
+        print(f"Warning: Dropping classes with <2 samples: {dropped_classes}")
+    classes = sorted(c for c, count in class_counts.items() if count >= 2)
+    return classes, sum(class_counts[c] for c in classes)
+
+
+def build_feature_store(csv_path, label2idx, n_rows, embedder, profile, chunksize=10000,
+                        embed_batch_size=64) -> FeatureStore:
+    """
+    Second pass over the CSV: writes the embeddings of every kept row into the feature
+    store of the profile, embedding only texts that the previous store does not have.
+
+    Returns:
+        FeatureStore: The new store.
+    """
+    path = os.path.join(FEATURES_DIR, profile.name)
+    meta = {"profile": profile.name, "model": profile.model,
+            "dimension": profile.dimension, "max_seq_length": profile.max_seq_length,
+            "pooling": profile.pooling,
+            # ONNX and torch outputs differ, and so do features of texts cut to fewer chunks
+            "embedder": getattr(embedder, "cache_name", profile.model),
+            "max_chunks": MAX_CHUNKS, "chunk_strategy": CHUNK_STRATEGY if MAX_CHUNKS else None}
+    previous = FeatureStore.open(path, meta)
+    previous_rows = previous.key_index() if previous is not None else {}
+    writer = FeatureStoreWriter(path, n_rows, profile.dimension)
+    start = reused = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize, usecols=["text", "label"]):
+        chunk = chunk.dropna(subset=["text", "label"])
+        chunk = chunk[chunk["label"].astype(str).isin(label2idx)]
+        if chunk.empty:
+            continue
+        texts = chunk["text"].astype(str).tolist()
+        keys = [text_key(t) for t in texts]
+        rows = np.array([previous_rows.get(k, -1) for k in keys], dtype=np.int64)
+        X = np.empty((len(texts), profile.dimension), dtype=np.float32)
+        hit = rows >= 0
+        if hit.any():
+            X[hit] = previous.features[rows[hit]]
+        missing = np.flatnonzero(~hit)
+        if len(missing):
+            X[missing] = embed_texts([texts[i] for i in missing], embedder=embedder,
+                                     batch_size=embed_batch_size, use_cache=False)
+        writer.write(start, X, keys, [label2idx[l] for l in chunk["label"].astype(str)])
+        start += len(texts)
+        reused += int(hit.sum())
+        print(f"Features: {start}/{n_rows} rows ({reused} reused)")
+    previous = None
+    store = writer.commit(meta)
+    print(f"Embedded {n_rows - reused} texts, reused {reused} cached features")
+    return store
+
+
+def stream_train(csv_path=DATA_PATH, chunksize=10000, epochs=5, batch_size=1024, holdout=0.15,
+                 max_calibration_rows=10000, profile=None) -> None:
+    """
+    Train a classifier out-of-core, then save the model bundle.
+
+    Memory stays bounded by the chunk, batch and calibration sizes: the corpus only
+    exists as a memory-mapped feature store.
+
+    Args:
+        csv_path (str): Labeled CSV with text and label columns.
+        chunksize (int): CSV rows read at a time.
+        epochs (int): partial_fit passes over the training rows.
+        batch_size (int): Rows per partial_fit call.
+        holdout (float): Fraction of rows held out, chosen by text hash (stable across runs);
+            half of it calibrates the classifier, the other half evaluates it.
+        max_calibration_rows (int): Cap on the calibration rows (also saved in the bundle).
+        profile (Optional[str]): Embedding profile to train on (default: EMBED_PROFILE).
+
+    Returns:
+        None
+    """
+    classes, n_rows = scan_labels(csv_path, chunksize)
+    label2idx = {c: i for i, c in enumerate(classes)}
+    idx2label = {i: c for c, i in label2idx.items()}
+    print(f"Classes: {classes}")
+
+    profile = get_profile(profile)
+    print(f"Embedding profile: {profile.name} ({profile.model})")
+    embedder = get_engine(profile)
+    store = build_feature_store(csv_path, label2idx, n_rows, embedder, profile,
+                                chunksize=chunksize)
+
+    fraction = stable_fraction(store.keys)
+    calib_rows = np.flatnonzero(fraction < holdout / 2)
+    eval_rows = np.flatnonzero((fraction >= holdout / 2) & (fraction < holdout))
+    train_rows = np.flatnonzero(fraction >= holdout)
+    rng = np.random.default_rng(42)
+    if len(calib_rows) > max_calibration_rows:
+        calib_rows = np.sort(rng.choice(calib_rows, max_calibration_rows, replace=False))
+    print(f"Rows: {len(train_rows)} train, {len(calib_rows)} calibration, {len(eval_rows)} evaluation")
+
+    # classifier: SGD with log loss (approx logistic regression), trained with partial_fit
+    # over shuffled batches of the memory-mapped features
+    base_clf = SGDClassifier(loss="log_loss", random_state=42)
+    classes_idx = np.arange(len(classes))
+    for epoch in range(epochs):
+        order = rng.permutation(train_rows)
+        for start in range(0, len(order), batch_size):
+            idx = np.sort(order[start:start + batch_size])
+            base_clf.partial_fit(store.features[idx], store.labels[idx], classes=classes_idx)
+        print(f"Epoch {epoch + 1}/{epochs} done")
+
+    # calibrate once on the held-out slice
+    calib_X = np.asarray(store.features[calib_rows])
+    calib_y = np.asarray(store.labels[calib_rows])
+    clf = CalibratedClassifierCV(FrozenEstimator(base_clf), method="sigmoid")
+    clf.fit(calib_X, calib_y)
+
+    # evaluate
+    y_eval = np.asarray(store.labels[eval_rows])
+    ypred = np.concatenate([clf.predict(store.features[eval_rows[start:start + batch_size]])
+                            for start in range(0, len(eval_rows), batch_size)] or [np.zeros(0, int)])
+    print("Validation results:")
+    print(classification_report(y_eval, ypred, labels=classes_idx, target_names=classes,
+                                zero_division=0))
+
     bundle = {
         "clf": clf,
+        "base_clf": base_clf,
+        "calib_X": calib_X,
+        "calib_y": calib_y,
         "label2idx": label2idx,
         "idx2label": idx2label,
-        "embed_model": EMBED_MODEL
+        "embed_model": profile.model,
+        "embed_profile": profile.name,
+        "embed_dim": profile.dimension,
     }
-    joblib.dump(bundle, MODEL_OUT)
+    save_bundle(bundle, MODEL_OUT)
     print("Saved model bundle to", MODEL_OUT)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the text classifier.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Train out-of-core from a memory-mapped feature store.")
+    parser.add_argument("--csv", default=DATA_PATH, help="Labeled CSV (--stream only).")
+    parser.add_argument("--chunksize", type=int, default=10000)
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--profile", default=None, help="Embedding profile (default: EMBED_PROFILE).")
+    args = parser.parse_args()
+    if args.stream:
+        stream_train(csv_path=args.csv, chunksize=args.chunksize, epochs=args.epochs,
+                     profile=args.profile)
+    else:
+        initial_train(profile=args.profile)
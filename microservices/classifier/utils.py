@@ -1,18 +1,19 @@
+import functools
 import os
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.preprocessing import normalize
+from classifier.embedding_cache import cached_embeddings
+from classifier.embedding_engine import get_engine
+from dotenv import load_dotenv
 
-EMBED_MODEL = "sentence-t5-base"
-# EMBED_MODEL = "all-MiniLM-L6-v2"
-LOCAL_MODEL_PATH = "./sentence-t5-base-local"
-# LOCAL_MODEL_PATH = "./all-MiniLM-L6-v2-local"
+load_dotenv()
 
-# Download and save the model locally if not already present
-if not os.path.exists(LOCAL_MODEL_PATH):
-    embedder = SentenceTransformer(EMBED_MODEL)
-    embedder.save(LOCAL_MODEL_PATH)
+# at most this many chunks of a text are embedded (0: all of them), chosen by
+# EMBED_CHUNK_STRATEGY: "spread" (lead + evenly spaced) or "salience" (lead + the chunks
+# lexically closest to the whole text)
+MAX_CHUNKS = int(os.getenv("EMBED_MAX_CHUNKS", "0"))
+CHUNK_STRATEGY = os.getenv("EMBED_CHUNK_STRATEGY", "spread")
+CHUNK_STRATEGIES = ("spread", "salience")
 
 
 def chunk_text(text, max_words=250):
@@ -38,58 +39,203 @@ def chunk_text_overlap(text, chunk_size=400, overlap=100):
     return chunks
 
 
-def chunk_text_by_tokens(text, tokenizer, chunk_size=400, overlap=50, max_length=256):
-    tokens = tokenizer.tokenize(text)
-    if len(tokens) <= chunk_size:
-        # Truncate to max_length if needed
-        chunk = tokenizer.convert_tokens_to_string(tokens[:max_length])
-        return [chunk]
-    chunks = []
+def chunk_ids_by_tokens(token_ids, window, overlap=50):
+    """
+    Split a tokenized text into overlapping windows of input ids.
+
+    token_ids: input ids of the whole text (from a single tokenization pass)
+    window: max ids per window, i.e. the model max length minus its special tokens
+    overlap: ids shared by consecutive windows (capped at half a window)
+    Returns list of id lists (a single, possibly empty, window for short texts)
+    """
+    window = max(1, window)
+    stride = max(1, window - min(overlap, window // 2))
+    windows = []
     start = 0
-    while start < len(tokens):
-        end = min(len(tokens), start + chunk_size)
-        chunk_tokens = tokens[start:end]
-        # Truncate to max_length for model safety
-        chunk_tokens = chunk_tokens[:max_length]
-        chunk = tokenizer.convert_tokens_to_string(chunk_tokens)
-        chunks.append(chunk)
-        if end == len(tokens):
+    while True:
+        windows.append(token_ids[start:start + window])
+        if start + window >= len(token_ids):
             break
-        start += chunk_size - overlap
-    return chunks
+        start += stride
+    return windows
+
+
+def chunk_salience(chunks) -> np.ndarray:
+    """
+    Lexical salience of each chunk: cosine similarity between the chunk's TF-IDF vector and
+    the whole text's, with the chunks as the documents. Terms found in every chunk (stopwords,
+    punctuation ids) weigh nothing, so chunks covering the text's recurring topics rank first.
+
+    chunks: token sequences (lists of input ids or of words) of one text
+    Returns numpy array shape (n_chunks,)
+    """
+    lengths = [len(chunk) for chunk in chunks]
+    if not sum(lengths):
+        return np.zeros(len(chunks))
+    # ids are their own hash; words get one of their own
+    flat = np.fromiter((hash(token) for chunk in chunks for token in chunk), dtype=np.int64, count=sum(lengths))
+    terms, flat = np.unique(flat, return_inverse=True)
+    rows = np.repeat(np.arange(len(chunks)), lengths)
+    # (chunk, term) pairs with their counts, without a dense chunks x terms matrix
+    pairs, pair_counts = np.unique(rows * len(terms) + flat, return_counts=True)
+    pair_rows, pair_terms = np.divmod(pairs, len(terms))
+    idf = np.log(len(chunks) / np.bincount(pair_terms, minlength=len(terms)))
+    # sublinear tf, so one term repeated all over a chunk does not dominate
+    weights = np.log1p(pair_counts) * idf[pair_terms]
+    total = np.log1p(np.bincount(flat, minlength=len(terms))) * idf
+    dots = np.bincount(pair_rows, weights * total[pair_terms], minlength=len(chunks))
+    norms = np.sqrt(np.bincount(pair_rows, weights ** 2, minlength=len(chunks))) * np.linalg.norm(total)
+    return np.divide(dots, norms, out=np.zeros(len(chunks)), where=norms > 0)
+
+
+def select_chunks(chunks, max_chunks, strategy="spread"):
+    """
+    Indices of at most max_chunks chunks to embed, in text order. The first (lead) chunk is
+    always kept; the others are evenly spaced over the text ("spread") or the most salient
+    ones ("salience", see chunk_salience).
+
+    chunks: token sequences of one text
+    Returns list of indices (all of them if there are at most max_chunks chunks)
+    """
+    n = len(chunks)
+    if not max_chunks or n <= max_chunks:
+        return list(range(n))
+    if strategy not in CHUNK_STRATEGIES:
+        raise ValueError(f"Unknown chunk strategy {strategy!r}, expected one of {CHUNK_STRATEGIES}")
+    if max_chunks == 1:
+        return [0]
+    if strategy == "salience":
+        salience = chunk_salience(chunks)[1:]
+        rest = np.argsort(-salience, kind="stable")[:max_chunks - 1] + 1
+        return [0] + sorted(rest.tolist())
+    return np.unique(np.linspace(0, n - 1, max_chunks).round().astype(int)).tolist()
+
+
+def pool_chunk_embeddings(vecs, counts, pool_method="mean", weights=None):
+    """
+    Pool consecutive chunk embeddings back into one vector per document.
+
+    vecs: array (n_chunks, dim) with the chunks of each document stored contiguously
+    counts: number of chunks of each document (all >= 1)
+    pool_method: 'mean', 'max', or 'weighted' (weighted mean using `weights`, one per chunk)
+    Returns numpy array shape (n_docs, dim)
+    """
+    counts = np.asarray(counts)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    if pool_method == "max":
+        return np.maximum.reduceat(vecs, starts, axis=0)
+    if pool_method == "weighted":
+        weights = np.maximum(np.asarray(weights, dtype=vecs.dtype), 1)
+        sums = np.add.reduceat(vecs * weights[:, None], starts, axis=0)
+        return sums / np.add.reduceat(weights, starts)[:, None]
+    # mean
+    return np.add.reduceat(vecs, starts, axis=0) / counts[:, None]
 
 
-def embed_texts(texts, embedder=None, chunk_size=400, overlap=50, batch_size=32, pool_method="mean"):
+def embed_texts(texts, embedder=None, chunk_size=None, overlap=50, batch_size=32, pool_method=None, use_cache=True,
+                max_chunks=None, chunk_strategy=None):
     """
     Embed a list of texts (handles long texts by chunking + pooling).
-    Uses overlapping token chunks for better context.
-    pool_method: 'mean', 'max', or 'weighted' (default: mean)
+    Uses overlapping token chunks for better context. Each text is tokenized once and
+    the id windows go straight into the model (no detokenize/retokenize round trip).
+    The chunks of all texts are encoded together, sorted by length into batches,
+    then pooled back per text.
+    chunk_size: tokens per chunk; defaults to (and is capped at) what the model accepts
+    pool_method: 'mean', 'max', or 'weighted' (default: the pooling of the embedder's profile, else mean)
+    embedder: EmbeddingEngine to use (default: the shared engine from get_engine())
+    use_cache: look texts up in the embedding cache first (see classifier/embedding_cache.py)
+    max_chunks: embed at most this many chunks per text, bounding the cost of very long texts
+        (default EMBED_MAX_CHUNKS; 0 embeds all of them)
+    chunk_strategy: how those chunks are chosen, 'spread' or 'salience' (see select_chunks;
+        default EMBED_CHUNK_STRATEGY)
     Returns numpy array shape (n_texts, dim)
     """
     if embedder is None:
-        embedder = SentenceTransformer(EMBED_MODEL)
+        embedder = get_engine()
+    if pool_method is None:
+        profile = getattr(embedder, 'profile', None)
+        pool_method = profile.pooling if profile else "mean"
+    if max_chunks is None:
+        max_chunks = MAX_CHUNKS
+    if chunk_strategy is None:
+        chunk_strategy = CHUNK_STRATEGY
+    texts = list(texts)
+    compute = functools.partial(_embed_texts_uncached, embedder=embedder, chunk_size=chunk_size,
+                                overlap=overlap, batch_size=batch_size, pool_method=pool_method,
+                                max_chunks=max_chunks, chunk_strategy=chunk_strategy)
+    if not use_cache or not hasattr(embedder, 'cache_name'):
+        return compute(texts)
+    pooling = f"chunks:{pool_method}:{chunk_size}:{overlap}"
+    if max_chunks:
+        pooling += f":{chunk_strategy}{max_chunks}"
+    return cached_embeddings(embedder.cache_name, embedder.dimension, texts, pooling, compute)
+
+
+def embed_sentences(texts, embedder=None, batch_size=32, use_cache=True):
+    """
+    Embed short texts (e.g. the promotion title + summary + tags) without chunking.
+    Returns L2-normalized numpy array shape (n_texts, dim)
+    """
+    if embedder is None:
+        embedder = get_engine()
+    texts = list(texts)
+
+    def compute(batch):
+        return embedder.encode_batch(batch, batch_size=batch_size, normalize_embeddings=True)
+    if not use_cache or not hasattr(embedder, 'cache_name'):
+        return compute(texts)
+    return cached_embeddings(embedder.cache_name, embedder.dimension, texts, "sentence:normalized", compute)
+
+
+def _embed_texts_uncached(texts, embedder, chunk_size, overlap, batch_size, pool_method,
+                          max_chunks=0, chunk_strategy="spread"):
     tokenizer = embedder.tokenizer if hasattr(embedder, 'tokenizer') else None
-    # Get model max length if available
-    max_length = getattr(embedder, 'max_seq_length', 256)
-    all_vecs = []
+    if tokenizer is None or not hasattr(embedder, 'encode_token_ids'):
+        return _embed_texts_by_words(texts, embedder, chunk_size or 400, overlap, batch_size, pool_method,
+                                     max_chunks, chunk_strategy)
+
+    # Align the window with the real model max length (minus the special tokens it adds)
+    window = embedder.max_seq_length - embedder.num_special_tokens
+    if chunk_size is not None:
+        window = min(window, chunk_size)
+    all_windows = []
+    counts = []
+    for t in texts:
+        windows = chunk_ids_by_tokens(embedder.tokenize_ids(t), window, overlap=overlap)
+        windows = [windows[i] for i in select_chunks(windows, max_chunks, chunk_strategy)]
+        all_windows.extend(windows)
+        counts.append(len(windows))
+    if not all_windows:
+        return np.zeros((0, embedder.dimension), dtype=np.float32)
+    from sklearn.preprocessing import normalize
+
+    vecs = embedder.encode_token_ids(all_windows, batch_size=batch_size)
+    weights = [len(ids) for ids in all_windows] if pool_method == "weighted" else None
+    X = pool_chunk_embeddings(vecs, counts, pool_method=pool_method, weights=weights)
+    X = normalize(X)
+    return X
+
+
+def _embed_texts_by_words(texts, embedder, chunk_size, overlap, batch_size, pool_method,
+                          max_chunks=0, chunk_strategy="spread"):
+    """
+    Fallback for encoders without a tokenizer: overlapping word chunks encoded as strings.
+    """
+    all_chunks = []
+    counts = []
     for t in texts:
-        if tokenizer is not None:
-            chunks = chunk_text_by_tokens(t, tokenizer, chunk_size=chunk_size, overlap=overlap, max_length=max_length)
-        else:
-            chunks = chunk_text_overlap(t, chunk_size=chunk_size, overlap=overlap)
-        vecs = embedder.encode(chunks, convert_to_numpy=True, show_progress_bar=False, batch_size=batch_size)
-        if vecs.ndim == 1:
-            vec = vecs
-        else:
-            if pool_method == "max":
-                vec = vecs.max(axis=0)
-            elif pool_method == "weighted":
-                weights = np.array([len(chunk) for chunk in chunks])
-                weights = weights / weights.sum()
-                vec = (vecs.T @ weights).T
-            else:  # mean
-                vec = vecs.mean(axis=0)
-        all_vecs.append(vec)
-    X = np.vstack(all_vecs)
+        chunks = chunk_text_overlap(t, chunk_size=chunk_size, overlap=overlap)
+        if max_chunks and len(chunks) > max_chunks:
+            keep = select_chunks([chunk.split() for chunk in chunks], max_chunks, chunk_strategy)
+            chunks = [chunks[i] for i in keep]
+        all_chunks.extend(chunks)
+        counts.append(len(chunks))
+    if not all_chunks:
+        return np.zeros((0, embedder.dimension), dtype=np.float32)
+    from sklearn.preprocessing import normalize
+
+    vecs = embedder.encode_batch(all_chunks, batch_size=batch_size)
+    weights = [len(chunk) for chunk in all_chunks] if pool_method == "weighted" else None
+    X = pool_chunk_embeddings(vecs, counts, pool_method=pool_method, weights=weights)
     X = normalize(X)
     return X
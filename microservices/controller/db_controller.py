@@ -96,3 +96,26 @@ def execute_query(cursor, query, params=None, fetch=False):
     else:
         logger.info("Query executed successfully!")
         return 200
+
+
+def fetch_all_rows(cursor, query, params=None):
+    """
+    Execute a SQL query and fetch every resulting row.
+
+    Args:
+        cursor: psycopg2 cursor
+        query: SQL query string
+        params: optional parameters tuple/dict
+
+    Returns:
+        list|int: list of row tuples (possibly empty), or 500 on failure.
+    """
+    try:
+        logger.debug("Executing query: %s params=%r", query, params)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        logger.debug("Fetched %d rows", len(rows))
+        return rows
+    except Exception as e:
+        logger.error(f"Query execution failed: {e}")
+        return 500
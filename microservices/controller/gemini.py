@@ -21,8 +21,6 @@ Example:
 import os
 
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
 
 # Load environment variables from .env
 load_dotenv()
@@ -44,6 +42,9 @@ def create_gemini_client():
     if API_KEY is None:
         raise ValueError("GEMINI_API_KEY environment variable not set")
 
+    # imported here: the SDK takes about a second to import
+    from google import genai
+
     client = genai.Client(api_key=API_KEY)
 
     return client
@@ -61,6 +62,8 @@ def generate_text(client, prompt, model="gemini-2.5-flash", ):
     Returns:
         str: The generated text response.
     """
+    from google.genai import types
+
     response = client.models.generate_content(
         model=model, contents=prompt,
         config=types.GenerateContentConfig(
@@ -0,0 +1,286 @@
+"""
+work_queue.py
+
+Work queues the article workers consume from.
+
+Two backends share one interface (lease / ack / retry / wait), selected with QUEUE_BACKEND:
+
+- "postgres": PostgresWorkQueue, built on the public.article_queue table (see
+  web/migrations/1761900000000_article-queue.js). Items are leased in batches with
+  FOR UPDATE SKIP LOCKED, so any number of workers can consume concurrently without
+  handing the same item out twice. A leased item stays hidden for a visibility timeout;
+  if the worker dies before acking, the item becomes visible again. Idle workers block
+  on LISTEN/NOTIFY instead of polling.
+- "http" (default): HttpWorkQueue, the legacy GET/DELETE /api/bloc/queue endpoint, which
+  only exposes the head of the queue.
+
+Usage:
+------
+    work_queue = open_work_queue()
+    for entry in work_queue.lease(batch_size=8):
+        ...
+        work_queue.ack(entry.item_id)
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+from typing import Any, List, NamedTuple, Optional
+
+import requests
+from controller.db_controller import (close_connection, execute_query,
+                                      fetch_all_rows, make_connection)
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "http")
+QUEUE_CHANNEL = "article_queue"
+VISIBILITY_TIMEOUT = int(os.getenv("QUEUE_VISIBILITY_TIMEOUT", "600"))  # seconds
+MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "5"))
+# message the queue API answers with when there is nothing to process
+EMPTY_QUEUE_MESSAGE = "Queue is empty"
+
+
+class QueueItem(NamedTuple):
+    """
+    A leased queue entry. item_id is None for the HTTP queue, which has no ids.
+    """
+    item_id: Optional[int]
+    payload: Any
+    attempts: int
+
+
+# ----- legacy HTTP queue -----
+
+def queue_api_url() -> str:
+    """
+    Returns the URL of the queue endpoint on the API server.
+    """
+    return os.getenv("API_SERVER", "http://localhost:3000") + "/api/bloc/queue"
+
+
+def delete_queue_item():
+    delete_response = requests.delete(queue_api_url(), timeout=30)
+    if delete_response.status_code != 200:
+        logger.error(
+            f"Failed to delete queue item: {delete_response.status_code} {delete_response.text}")
+    logger.info("Deleted processed queue item")
+
+
+def fetch_queue_payload():
+    """
+    Fetches the head of the queue from the API server.
+
+    Returns:
+        Any: The decoded JSON payload, or None if the API answered with an error.
+
+    Raises:
+        requests.RequestException: If the API server cannot be reached.
+        json.JSONDecodeError: If the response is not valid JSON.
+    """
+    response = requests.get(queue_api_url(), timeout=30)
+    if response.status_code != 200:
+        logger.error(f"Failed to fetch queue: {response.text}")
+        return None
+    queue_data_raw = response.json()
+    logger.debug("Raw queue response: %r", queue_data_raw)
+    return queue_data_raw
+
+
+def normalize_queue_message(queue_data_raw):
+    """
+    Robust parsing of the queue response (handles dict, list, or JSON/string payloads).
+
+    Args:
+        queue_data_raw: Decoded queue API response.
+
+    Returns:
+        None if the queue is empty, otherwise the queue message. The message is a dict
+        for well-formed items; any other type means the message has an unexpected format.
+    """
+    if not queue_data_raw:
+        return None
+
+    if isinstance(queue_data_raw, str):
+        try:
+            queue_data = json.loads(queue_data_raw)
+        except json.JSONDecodeError:
+            # If it's just a plain string (e.g. a URL), wrap it
+            queue_data = {"message": queue_data_raw}
+    elif isinstance(queue_data_raw, list):
+        queue_data = queue_data_raw[0] if queue_data_raw else {}
+    elif isinstance(queue_data_raw, dict):
+        queue_data = queue_data_raw
+    else:
+        queue_data = {}
+
+    if not queue_data:
+        return None
+
+    item = queue_data.get("message")
+    logger.debug("Normalized queue message before parsing: %r", item)
+    if item == EMPTY_QUEUE_MESSAGE:
+        return None
+    # If the message itself is a JSON string, parse it. If it's a simple string (e.g. URL), normalize it.
+    if isinstance(item, str):
+        try:
+            item = json.loads(item)
+        except json.JSONDecodeError:
+            # If it's just a URL string, normalize to dict
+            if item.startswith("http://") or item.startswith("https://"):
+                item = {"article_url": item}
+            else:
+                # fallback: wrap into message field
+                item = {"message": item}
+    return item
+
+
+class HttpWorkQueue:
+    """
+    Adapter for the head-only queue API of the web server.
+
+    Args:
+        claim_on_lease (bool): Delete the head as soon as it is leased. Needed when several
+            items are in flight at once (pipeline mode), since the API only exposes its head.
+            Delivery is then at-most-once.
+    """
+
+    def __init__(self, claim_on_lease: bool = False):
+        self.claim_on_lease = claim_on_lease
+
+    def lease(self, batch_size: int = 1) -> List[QueueItem]:
+        item = normalize_queue_message(fetch_queue_payload())
+        if item is None:
+            return []
+        if self.claim_on_lease:
+            delete_queue_item()
+        return [QueueItem(item_id=None, payload=item, attempts=1)]
+
+    def ack(self, item_id=None):
+        if not self.claim_on_lease:
+            delete_queue_item()
+
+    def retry(self, item_id=None, delay: int = 0):
+        # a head-only queue cannot defer an item; drop it so it does not block the queue
+        self.ack(item_id)
+
+    def wait(self, timeout: float) -> bool:
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+# ----- Postgres queue -----
+
+class PostgresWorkQueue:
+    """
+    Postgres-backed queue with SKIP LOCKED leasing and LISTEN/NOTIFY wakeups.
+
+    Uses two connections in autocommit mode: one for lease/ack/retry (shared between
+    threads behind a lock) and one that only LISTENs, so a worker blocked in wait() never
+    holds up acks from other threads.
+
+    Args:
+        visibility_timeout (int): Seconds a leased item stays hidden from other workers.
+        max_attempts (int): Items leased this many times are no longer handed out and stay
+            in the table for inspection.
+    """
+
+    def __init__(self, visibility_timeout: int = VISIBILITY_TIMEOUT, max_attempts: int = MAX_ATTEMPTS):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.connection = make_connection()
+        self.listen_connection = make_connection()
+        if self.connection is None or self.listen_connection is None:
+            self.close()
+            raise RuntimeError("Could not connect to the database for the work queue")
+        self.connection.autocommit = True
+        self.listen_connection.autocommit = True
+        with self.listen_connection.cursor() as cur:
+            cur.execute(f"LISTEN {QUEUE_CHANNEL}")
+
+    def lease(self, batch_size: int = 1) -> List[QueueItem]:
+        """
+        Claims up to batch_size visible items and hides them for the visibility timeout.
+        """
+        with self._lock, self.connection.cursor() as cur:
+            rows = fetch_all_rows(cur, """
+                WITH next_items AS (
+                    SELECT item_id FROM public.article_queue
+                    WHERE visible_at <= NOW() AND attempts < %s
+                    ORDER BY item_id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE public.article_queue q
+                SET visible_at = NOW() + make_interval(secs => %s),
+                    attempts = q.attempts + 1
+                FROM next_items
+                WHERE q.item_id = next_items.item_id
+                RETURNING q.item_id, q.payload, q.attempts
+            """, params=(self.max_attempts, batch_size, self.visibility_timeout))
+        if rows == 500:
+            return []
+        return [QueueItem(item_id=row[0], payload=row[1], attempts=row[2])
+                for row in sorted(rows)]
+
+    def ack(self, item_id):
+        """
+        Removes a processed item from the queue.
+        """
+        with self._lock, self.connection.cursor() as cur:
+            execute_query(cursor=cur, query="DELETE FROM public.article_queue WHERE item_id = %s",
+                          params=(item_id,))
+
+    def retry(self, item_id, delay: int = 0):
+        """
+        Makes a leased item visible again after delay seconds.
+        """
+        with self._lock, self.connection.cursor() as cur:
+            execute_query(cursor=cur, query="""
+                UPDATE public.article_queue
+                SET visible_at = NOW() + make_interval(secs => %s)
+                WHERE item_id = %s
+            """, params=(delay, item_id))
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Blocks until a producer notifies the queue channel or the timeout expires.
+
+        Returns:
+            bool: True if woken up by a notification.
+        """
+        conn = self.listen_connection
+        if not conn.notifies:
+            if select.select([conn], [], [], timeout) == ([], [], []):
+                return False
+        conn.poll()
+        notified = bool(conn.notifies)
+        conn.notifies.clear()
+        return notified
+
+    def close(self):
+        for conn in (getattr(self, "connection", None), getattr(self, "listen_connection", None)):
+            if conn:
+                close_connection(conn)
+
+
+def open_work_queue(claim_on_lease: bool = False):
+    """
+    Opens the work queue selected by QUEUE_BACKEND.
+
+    Args:
+        claim_on_lease (bool): See HttpWorkQueue; ignored by the Postgres queue.
+    """
+    if QUEUE_BACKEND == "postgres":
+        return PostgresWorkQueue()
+    return HttpWorkQueue(claim_on_lease=claim_on_lease)
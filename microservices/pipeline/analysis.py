@@ -0,0 +1,95 @@
+"""
+analysis.py
+
+Single-encode article analysis shared by both worker modes.
+
+analyze_article tokenizes and chunk-embeds the article content once (utils.embed_texts)
+and derives everything the later steps need from that pass:
+
+- the category, by running the classifier head on the content vector
+  (model_service.classify_embeddings) instead of embedding the content again;
+- the tags, whose lexical candidates come from one preprocessing pass over the content;
+  in TAG_MODE=semantic they are ranked against the same content vector;
+- the content vector itself, which can become the promotion vector.
+
+PROMOTION_VECTOR_SOURCE chooses the vector stored with the promotion:
+
+- "summary" (default): embed_sentences of title + summary + tags, as before. Costs one
+  short encode after the summary is written.
+- "content": the content vector of the analysis, no further encode. Vectors of the two
+  sources are not interchangeable; switch before promotions are stored, or re-embed.
+
+With INFERENCE_SERVER_URL set, the encode and the classification run on the server.
+"""
+
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any
+
+from classifier.inference_client import INFERENCE_SERVER_URL
+from dotenv import load_dotenv
+from pipeline.steps import promotion_text
+from tag_extraction.get_tags import extract_tags
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# with an inference server the models live there and this process only holds a client
+if INFERENCE_SERVER_URL:
+    from classifier.inference_client import (classify_embeddings,
+                                             embed_sentences, embed_texts)
+else:
+    from classifier.model_service import classify_embeddings
+    from classifier.utils import embed_sentences, embed_texts
+
+PROMOTION_VECTOR_SOURCE = os.getenv("PROMOTION_VECTOR_SOURCE", "summary")
+if PROMOTION_VECTOR_SOURCE not in ("summary", "content"):
+    raise ValueError(f"PROMOTION_VECTOR_SOURCE must be 'summary' or 'content', "
+                     f"got {PROMOTION_VECTOR_SOURCE!r}")
+
+
+@dataclass
+class ArticleAnalysis:
+    """
+    What the pipeline derives from one article's content.
+    """
+    title: str
+    content: str
+    embedding: Any  # normalized content vector (utils.embed_texts)
+    classification: dict = field(default_factory=dict)  # as classify_text
+    tags: list = field(default_factory=list)
+
+    @property
+    def category(self) -> str:
+        return self.classification["label"]
+
+    def promotion_vector(self, summary: str, embedder=None):
+        """
+        The vector stored with the promotion (see PROMOTION_VECTOR_SOURCE).
+        """
+        if PROMOTION_VECTOR_SOURCE == "content":
+            return self.embedding
+        return embed_sentences([promotion_text(self.title, summary, self.tags)], embedder=embedder)[0]
+
+
+def analyze_article(title: str, content: str, embedder=None, top_k_tags: int = 15) -> ArticleAnalysis:
+    """
+    Embeds the content once, then classifies and tags the article from that pass.
+
+    Args:
+        title (str): Article title.
+        content (str): Cleaned article text.
+        embedder (Optional[EmbeddingEngine]): Embedder (default: the shared engine).
+        top_k_tags (int): Tags to extract.
+
+    Returns:
+        ArticleAnalysis: Category, tags and content vector of the article.
+    """
+    embedding = embed_texts([content], embedder=embedder)[0]
+    classification = classify_embeddings(embedding[None, :], top_k=3, as_dict=True)[0]
+    tags = extract_tags(title=title, content=content, top_k=top_k_tags, doc_embedding=embedding)
+    logger.debug("Analyzed article %r: %s", title[:80], classification["label"])
+    return ArticleAnalysis(title=title, content=content, embedding=embedding,
+                           classification=classification, tags=tags)
@@ -0,0 +1,378 @@
+"""
+staged_worker.py
+
+Concurrent, pipelined worker mode for main.py (WORKER_MODE=pipeline).
+
+Every queue item flows through a chain of stages connected by bounded queues:
+
+    source -> fetch -> analyze -> summarize -> embed -> persist
+    (DB)      (I/O)    (CPU)      (I/O)        (CPU)   (DB)
+
+- I/O stages (article download, Gemini summary) run on many threads because they spend
+  most of their time waiting on the network.
+- CPU stages (cleaning, classification, tag extraction, embedding) share one compute
+  semaphore so that no more than PIPELINE_COMPUTE_WORKERS of them run at once. torch,
+  numpy and lxml release the GIL while they do the heavy lifting.
+- The queues between stages are bounded, so a slow stage makes the stages in front of
+  it block instead of piling items up in memory (backpressure).
+- The source and the persist stage each own a database connection; cursors are never
+  shared between threads.
+- The source leases batches from the work queue (controller/work_queue.py). A job is
+  acked when it leaves the pipeline and handed back to the queue if a stage raised.
+
+Usage:
+------
+    WORKER_MODE=pipeline python main.py
+"""
+
+import logging
+import os
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from controller.db_controller import close_connection, make_connection
+from controller.work_queue import QueueItem, open_work_queue
+from dotenv import load_dotenv
+from pipeline.analysis import ArticleAnalysis, analyze_article
+from pipeline.steps import (embedding_to_sql, is_valid_queue_item,
+                            lookup_verification_token, store_promotion,
+                            summarize_article)
+from scraper.scraper_mod import ScraperMod
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+RETRY_DELAY = int(os.getenv("RETRY_DELAY", "60"))  # seconds
+FETCH_WORKERS = int(os.getenv("PIPELINE_FETCH_WORKERS", "8"))
+SUMMARY_WORKERS = int(os.getenv("PIPELINE_SUMMARY_WORKERS", "8"))
+COMPUTE_WORKERS = int(os.getenv("PIPELINE_COMPUTE_WORKERS",
+                                str(os.cpu_count() or 1)))
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+
+# how long blocking queue operations wait before re-checking the stop flag
+_POLL_INTERVAL = 0.5
+
+
+@dataclass
+class ArticleJob:
+    """
+    State of one queue item as it moves through the pipeline.
+    """
+    entry: QueueItem
+    website_id: str
+    article_url: str
+    budget: float
+    promoter_id: str
+    scraper: ScraperMod
+    soup: Any = None
+    content: str = ""
+    title: str = ""
+    title_image: str = ""
+    category: str = ""
+    tags: list = field(default_factory=list)
+    analysis: Optional[ArticleAnalysis] = None
+    summary: str = ""
+    emb_sql: str = ""
+
+
+class Stage:
+    """
+    A pool of threads that take jobs from an inbox, run a handler and pass the
+    result on to the outbox.
+
+    Args:
+        name (str): Stage name used in logs and thread names.
+        handler (Callable): Function taking a job and returning the job to forward,
+            or None to drop it.
+        workers (int): Number of threads.
+        inbox (queue.Queue): Queue to read jobs from.
+        outbox (Optional[queue.Queue]): Queue to forward jobs to (None for the last stage).
+        compute_slots (Optional[threading.Semaphore]): Semaphore to hold while the handler
+            runs; used to bound the CPU-bound stages as a whole.
+        on_finish (Optional[Callable]): Called as on_finish(job, failed) when a job leaves
+            the pipeline in this stage (dropped, failed, or completed by the last stage).
+    """
+
+    def __init__(self, name: str, handler: Callable, workers: int, inbox: queue.Queue,
+                 outbox: Optional[queue.Queue] = None,
+                 compute_slots: Optional[threading.Semaphore] = None,
+                 on_finish: Optional[Callable] = None):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.inbox = inbox
+        self.outbox = outbox
+        self.compute_slots = compute_slots
+        self.on_finish = on_finish
+        self.threads = []
+
+    def start(self, stop_event: threading.Event):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(stop_event,),
+                                      name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info("Started stage %s with %d worker(s)",
+                    self.name, self.workers)
+
+    def _run(self, stop_event: threading.Event):
+        while not stop_event.is_set():
+            try:
+                job = self.inbox.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            failed = False
+            try:
+                if self.compute_slots is not None:
+                    with self.compute_slots:
+                        result = self.handler(job)
+                else:
+                    result = self.handler(job)
+            except Exception:
+                logger.exception("Stage %s failed for %s",
+                                 self.name, getattr(job, "article_url", job))
+                result = None
+                failed = True
+            finally:
+                self.inbox.task_done()
+            if result is not None and self.outbox is not None:
+                put_with_backpressure(self.outbox, result, stop_event)
+            elif self.on_finish is not None:
+                self.on_finish(job, failed)
+
+
+def put_with_backpressure(target: queue.Queue, job, stop_event: threading.Event) -> bool:
+    """
+    Blocks until the job fits into the bounded queue or the pipeline is stopping.
+
+    Returns:
+        bool: True if the job was queued.
+    """
+    while not stop_event.is_set():
+        try:
+            target.put(job, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+class PipelineWorker:
+    """
+    Wires the article processing steps into concurrent stages.
+
+    Args:
+        db_connection: Connection used by the source stage for lookups.
+        gemini_client: Gemini API client used for summaries.
+        embedder: EmbeddingEngine used for the promotion embedding.
+    """
+
+    def __init__(self, db_connection, gemini_client, embedder):
+        self.db_connection = db_connection
+        self.gemini_client = gemini_client
+        self.embedder = embedder
+        self.work_queue = None
+        self.stop_event = threading.Event()
+        self.compute_slots = threading.BoundedSemaphore(
+            max(1, COMPUTE_WORKERS))
+        self.persist_connection = None
+
+        self.fetch_q = queue.Queue(maxsize=QUEUE_SIZE)
+        self.analyze_q = queue.Queue(maxsize=QUEUE_SIZE)
+        self.summarize_q = queue.Queue(maxsize=QUEUE_SIZE)
+        self.embed_q = queue.Queue(maxsize=QUEUE_SIZE)
+        self.persist_q = queue.Queue(maxsize=QUEUE_SIZE)
+
+        self.stages = [
+            Stage("fetch", self.fetch, FETCH_WORKERS,
+                  self.fetch_q, self.analyze_q, on_finish=self.finish),
+            Stage("analyze", self.analyze, COMPUTE_WORKERS, self.analyze_q, self.summarize_q,
+                  compute_slots=self.compute_slots, on_finish=self.finish),
+            Stage("summarize", self.summarize, SUMMARY_WORKERS,
+                  self.summarize_q, self.embed_q, on_finish=self.finish),
+            Stage("embed", self.embed, COMPUTE_WORKERS, self.embed_q, self.persist_q,
+                  compute_slots=self.compute_slots, on_finish=self.finish),
+            # a single writer keeps the wallet updates of one item in one transaction
+            Stage("persist", self.persist, 1, self.persist_q,
+                  on_finish=self.finish),
+        ]
+
+    # ----- stages -----
+
+    def admit(self, entry: QueueItem, cursor) -> Optional[ArticleJob]:
+        """
+        Source stage: runs the database checks that do not need the article itself.
+        """
+        item = entry.payload
+        website_id = item.get("website_id")
+        article_url = item.get("article_url")
+        budget = item.get("budget")
+        promoter_id = item.get("promoter_id")
+
+        if not article_url or not budget or not website_id or not promoter_id:
+            logger.error("Invalid data in queue item. Dropping it.")
+            return None
+
+        verification_token = lookup_verification_token(cursor, website_id)
+        if verification_token is None:
+            return None
+
+        scraper = ScraperMod(article_url=article_url,
+                             verification_code=verification_token, promoter_id=promoter_id)
+        if not scraper.website_status(website_id=website_id, cursor=cursor):
+            logger.info("Skipping article of inactive website %s", website_id)
+            return None
+        # early filter only: store_promotion re-checks and charges the wallet atomically
+        if not scraper.check_budget(entered_budget=budget, cursor=cursor):
+            logger.warning("Insufficient budget. Skipping article.")
+            return None
+        return ArticleJob(entry=entry, website_id=website_id, article_url=article_url, budget=budget,
+                          promoter_id=promoter_id, scraper=scraper)
+
+    def fetch(self, job: ArticleJob) -> Optional[ArticleJob]:
+        job.soup = job.scraper.fetch_article_html()
+        if not job.soup:
+            logger.error("Failed to fetch article HTML for %s",
+                         job.article_url)
+            return None
+        if not job.scraper.has_credx_verification(job.soup):
+            logger.info("Skipping unverified article %s", job.article_url)
+            return None
+        return job
+
+    def analyze(self, job: ArticleJob) -> Optional[ArticleJob]:
+        job.content = job.scraper.scrape_and_clean_article(job.soup)
+        if not job.content:
+            logger.warning("Could not extract content from %s",
+                           job.article_url)
+            return None
+        job.title = job.content.strip().splitlines()[0]
+        job.title_image = job.scraper.get_title_image(job.soup)
+        # the parsed page is no longer needed, free it before queueing
+        job.soup = None
+        # one encode of the content gives the category, the tags and the content vector
+        job.analysis = analyze_article(job.title, job.content, embedder=self.embedder)
+        job.category = job.analysis.category
+        job.tags = job.analysis.tags
+        return job
+
+    def summarize(self, job: ArticleJob) -> Optional[ArticleJob]:
+        job.summary = summarize_article(self.gemini_client, job.content)
+        return job
+
+    def embed(self, job: ArticleJob) -> Optional[ArticleJob]:
+        emb = job.analysis.promotion_vector(job.summary, embedder=self.embedder)
+        job.analysis = None  # the content vector is no longer needed
+        job.emb_sql = embedding_to_sql(emb)
+        return job
+
+    def persist(self, job: ArticleJob) -> None:
+        cursor = self.persist_connection.cursor()
+        try:
+            promotion_id = store_promotion(
+                cursor, self.persist_connection, title=job.title, image_url=job.title_image,
+                summary=job.summary, tags=job.tags, category=job.category,
+                article_url=job.article_url, budget=job.budget, promoter_id=job.promoter_id,
+                website_id=job.website_id, emb_sql=job.emb_sql)
+            if promotion_id is None:
+                # e.g. the promoter's earlier items used up the budget since admission
+                logger.info("Dropped %s: promotion not stored", job.article_url)
+                self.persist_connection.rollback()
+        finally:
+            cursor.close()
+        return None
+
+    def finish(self, job: ArticleJob, failed: bool):
+        """
+        Acks a job that left the pipeline, or hands it back to the queue if a stage raised.
+        """
+        try:
+            if failed:
+                self.work_queue.retry(job.entry.item_id, delay=RETRY_DELAY)
+            else:
+                self.work_queue.ack(job.entry.item_id)
+        except Exception:
+            logger.exception("Failed to settle queue item %s", job.entry.item_id)
+
+    # ----- driver -----
+
+    def run(self):
+        """
+        Starts all stages and feeds them from the work queue until interrupted.
+        """
+        self.persist_connection = make_connection()
+        if self.persist_connection is None:
+            raise RuntimeError("Could not open the database connection for the persist stage")
+        # several items are in flight at once, so the head-only HTTP queue must be claimed on read
+        self.work_queue = open_work_queue(claim_on_lease=True)
+        for stage in self.stages:
+            stage.start(self.stop_event)
+        cursor = self.db_connection.cursor()
+        try:
+            while not self.stop_event.is_set():
+                if not self._feed(cursor):
+                    self.work_queue.wait(RETRY_DELAY)
+        finally:
+            self.stop()
+            cursor.close()
+
+    def _feed(self, cursor) -> bool:
+        """
+        Leases a batch of items sized to the free room in the fetch queue, admits them and
+        hands them to the fetch stage (blocking while the fetch queue is full).
+
+        Returns:
+            bool: True if items were leased, False if the queue is empty and the source should wait.
+        """
+        batch_size = max(1, QUEUE_SIZE - self.fetch_q.qsize())
+        try:
+            leased = self.work_queue.lease(batch_size=batch_size)
+        except Exception:
+            logger.exception("Failed to lease items from the work queue")
+            return False
+        if not leased:
+            logger.debug("No articles in the queue.")
+            return False
+        for entry in leased:
+            if not is_valid_queue_item(entry.payload):
+                logger.warning(
+                    "Invalid queue message; dropping it. Item: %r", entry.payload)
+                self.work_queue.ack(entry.item_id)
+                continue
+            logger.info(f"Processing article: {entry.payload.get('article_url')}")
+            try:
+                job = self.admit(entry, cursor)
+            except Exception:
+                logger.exception("Failed to admit queue item %r", entry.payload)
+                self.db_connection.rollback()
+                self.work_queue.retry(entry.item_id, delay=RETRY_DELAY)
+                continue
+            self.db_connection.rollback()  # end the read-only transaction
+            if job is None:
+                self.work_queue.ack(entry.item_id)
+            elif not put_with_backpressure(self.fetch_q, job, self.stop_event):
+                # shutting down; let the lease expire so another worker picks it up
+                break
+        return True
+
+    def stop(self):
+        self.stop_event.set()
+        for stage in self.stages:
+            for thread in stage.threads:
+                thread.join(timeout=5)
+        if self.persist_connection:
+            close_connection(self.persist_connection)
+            self.persist_connection = None
+        if self.work_queue:
+            self.work_queue.close()
+            self.work_queue = None
+
+
+def run_pipeline(db_connection, gemini_client, embedder):
+    """
+    Runs the staged pipeline worker until interrupted.
+    """
+    PipelineWorker(db_connection, gemini_client, embedder).run()
@@ -0,0 +1,250 @@
+"""
+steps.py
+
+Per-article processing steps shared by the serial worker loop in main.py and the
+staged pipeline worker (pipeline/staged_worker.py).
+
+Each step does one thing (look up the website, summarize, store the promotion, ...) so
+the two worker modes run exactly the same logic and only differ in how the steps are
+scheduled.
+"""
+
+import logging
+
+from controller.db_controller import execute_query, fetch_all_rows
+from controller.gemini import generate_text
+from tag_extraction.get_tags import update_tag_idf
+
+logger = logging.getLogger(__name__)
+
+# wallet that receives the platform fee for every promotion
+PLATFORM_WALLET_USER_ID = "a1b2c3d4-e5f6-5432-1098-76543210abcd"
+SUMMARY_MODEL = "gemini-2.5-flash"
+
+
+# new helper to validate queue message structure
+def is_valid_queue_item(item):
+    try:
+        return bool(
+            item.get("article_url")
+            and item.get("budget") is not None
+            and item.get("website_id")
+            and item.get("promoter_id")
+        )
+    except AttributeError:
+        return False
+
+
+def first_column(value):
+    """
+    Unwraps a single value from the row shapes returned by execute_query.
+    Possible shapes: [('token',)], ['token'], ('token',), 'token'
+    """
+    if isinstance(value, (list, tuple)) and len(value) > 0:
+        first = value[0]
+        if isinstance(first, (list, tuple)) and len(first) > 0:
+            return first[0]
+        return first
+    return value
+
+
+def lookup_verification_token(cursor, website_id):
+    """
+    Fetches the verification token of a website.
+
+    Args:
+        cursor: Database cursor to execute the query.
+        website_id (str): The ID of the website.
+
+    Returns:
+        Optional[str]: The verification token, or None if it is missing or the query failed.
+    """
+    verification_token = execute_query(
+        cursor=cursor,
+        query="""
+    SELECT verification_token FROM public.websites WHERE website_id = %s
+    """,
+        params=(str(website_id),),
+        fetch=True,
+    )
+    # Log raw result and its type for debugging
+    logger.debug(
+        "Raw verification_token (db) for website_id=%s: %r", website_id, verification_token)
+
+    # If execute_query returned the error sentinel, treat as DB error
+    if verification_token == 500:
+        logger.error(
+            "Database query failed when fetching verification token for website_id=%s", website_id)
+        return None
+    if not verification_token:
+        logger.error("No verification token provided.")
+        return None
+    verification_token = first_column(verification_token)
+    # now verification_token should be a string
+    if not isinstance(verification_token, str):
+        logger.error("Invalid verification token format.")
+        return None
+    return verification_token
+
+
+def summarize_article(gemini_client, content: str) -> str:
+    """
+    Generates the short promotional summary shown in the recommendation widget.
+    """
+    prompt = f"""
+                    Generate a very short blog post summary in 80 words or less from the below context,
+                    make sure it is super interesting such that it compels the user to click and read the full article.
+                    output should be in plain text only Context: {content}"""
+    return generate_text(client=gemini_client, prompt=prompt, model=SUMMARY_MODEL)
+
+
+def promotion_text(title: str, summary: str, tags) -> str:
+    """
+    Builds the text that is embedded into the promotion vector.
+    """
+    return f"{title} {summary} {' '.join(tags)}"
+
+
+def embedding_to_sql(emb) -> str:
+    """
+    Formats an embedding as a pgvector literal.
+    """
+    return "[" + ",".join([str(x) for x in emb.tolist()]) + "]"
+
+
+def check_embedding_dimension(cursor, dimension: int):
+    """
+    Checks that promotions.embedding stores vectors of the embedder's dimension, so a
+    profile switch fails at startup instead of on every insert.
+
+    Raises:
+        RuntimeError: If the pgvector column has another dimension.
+    """
+    rows = fetch_all_rows(cursor, """
+        SELECT atttypmod FROM pg_attribute
+        WHERE attrelid = 'public.promotions'::regclass AND attname = 'embedding'
+    """)
+    if rows == 500 or not rows:
+        logger.warning("Could not read the dimension of promotions.embedding")
+        return
+    column_dimension = rows[0][0]
+    # pgvector stores the dimension as the type modifier; -1 means unconstrained
+    if column_dimension > 0 and column_dimension != dimension:
+        raise RuntimeError(
+            f"promotions.embedding is vector({column_dimension}) but the embedding profile "
+            f"produces {dimension} dimensions. Migrate the column (and re-embed existing "
+            "promotions) or switch EMBED_PROFILE back.")
+
+
+def store_promotion(cursor, db_connection, *, title, image_url, summary, tags, category,
+                    article_url, budget, promoter_id, website_id, emb_sql):
+    """
+    Charges the promoter, inserts the promotion and credits the platform fee, then commits.
+
+    The charge is a single conditional UPDATE that only succeeds while the wallet holds the
+    budget; the row stays locked until the commit, so concurrent promotions of one promoter
+    (pipeline mode admits several before any is stored) cannot overdraw it.
+
+    Returns:
+        The new promotion_id, or None if the wallet cannot pay for it or the promotion could
+        not be inserted (the transaction is rolled back).
+    """
+    platform_fee = (budget * 5/100)
+    impressions = (budget - platform_fee) * 10
+    boost = 1.0
+
+    # re-check the budget and charge it in one step
+    promoter_wallet_update = execute_query(cursor=cursor, query="""
+        UPDATE wallets
+        SET balance = balance - %s
+        WHERE user_id = %s AND balance >= %s
+        returning wallet_id
+    """, params=(budget, promoter_id, budget), fetch=True)
+    if promoter_wallet_update == 500:
+        logger.error(
+            "Failed to update promoter wallet for user_id=%s", promoter_id)
+        db_connection.rollback()
+        return None
+    if promoter_wallet_update is None:
+        logger.warning(
+            "Insufficient budget for user_id=%s at store time. Skipping article.", promoter_id)
+        db_connection.rollback()
+        return None
+    logger.debug("Promoter wallet update result: %r",
+                 promoter_wallet_update)
+
+    promotion_insertion_status = execute_query(cursor=cursor, query="""
+        INSERT INTO promotions
+            (title,
+            image_url,
+            summary,
+            tags,
+            categories,
+            article_url,
+            budget,
+            remaining_impressions,
+            boost,
+            embedding,
+            promoter_id,
+            status,
+            website_id
+            )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s::vector, %s, %s, %s)
+        RETURNING promotion_id
+    """, params=(title, image_url, summary, tags, category, article_url, budget, impressions,
+                 boost, emb_sql, promoter_id, "active", website_id), fetch=True)
+    # execute_query now returns a scalar for single-column fetches,
+    # a tuple/list for multi-column rows, None when no row, or 500 on error.
+    if promotion_insertion_status == 500 or promotion_insertion_status is None:
+        logger.error(
+            "Failed to insert promotion into the database. Raw result: %r", promotion_insertion_status)
+        db_connection.rollback()
+        return None
+
+    # Normalize to a scalar promotion_id regardless of shape
+    if isinstance(promotion_insertion_status, (list, tuple)):
+        promotion_id = promotion_insertion_status[0] if len(
+            promotion_insertion_status) > 0 else None
+    else:
+        promotion_id = promotion_insertion_status
+
+    if promotion_id is None:
+        logger.error(
+            "Failed to obtain promotion_id after insert. Raw result: %r", promotion_insertion_status)
+        db_connection.rollback()
+        return None
+
+    logger.debug("Inserted promotion_id=%r", promotion_id)
+
+    # take the platform fee and update admin wallet
+    platform_fee_status = execute_query(cursor=cursor, query="""
+        UPDATE wallets
+        SET balance = balance + %s
+        WHERE user_id = %s
+    """, params=(budget, PLATFORM_WALLET_USER_ID), fetch=False)
+    if platform_fee_status == 500:
+        logger.error(
+            "Failed to update admin wallet with platform fee of credit = %s.", platform_fee)
+
+    # add transaction log entry for platform fee
+    transaction_log_status = execute_query(cursor=cursor, query="""
+    INSERT INTO transactions (from_wallet_id, to_wallet_id, amount, transaction_type)
+    VALUES ( %s, %s, %s, %s )
+    """, params=(promoter_wallet_update,
+                 PLATFORM_WALLET_USER_ID,
+                 platform_fee, "platform_fee"),
+        fetch=False)
+    if transaction_log_status == 500:
+        logger.error(
+            "Failed to log transaction for platform fee of credit = %s.", platform_fee)
+
+    logger.info("Successfully processed and stored article")
+    db_connection.commit()
+    logger.info("Database changes committed.")
+
+    # keep the tag IDF statistics in step with the promotions corpus
+    try:
+        update_tag_idf([f"{title} {summary}"])
+    except Exception as e:
+        logger.warning("Failed to add the promotion to the tag IDF model: %s", e)
+    return promotion_id
@@ -0,0 +1,440 @@
+"""
+artifact_store.py
+
+On-disk store of fetched articles, so that retries, re-promotions and backfills do not
+download and clean the same page again.
+
+Pages are looked up by the identifier of ScraperMod.generate_unique_identifier (sha256 of
+the URL). Their contents are content-addressed: the raw HTML and the cleaned text are gzip
+files under objects/ named after the sha256 of their bytes, so a page served under several
+URLs, or unchanged after a refetch, is stored once. A sqlite index (WAL, shared by the worker
+processes like the embedding cache) holds:
+
+- per URL: the final URL, the HTML hash, the ETag / Last-Modified validators and when the
+  page was last validated with the origin;
+- per HTML hash and extraction backend: the cleaned text hash and the title image.
+
+ScraperMod uses a page validated less than ARTIFACT_STORE_FRESH_FOR seconds ago without any
+request, and revalidates an older one with a conditional GET (If-None-Match /
+If-Modified-Since): a 304 reuses the stored page and its extraction, a 200 replaces it. When
+the objects grow over ARTIFACT_STORE_MAX_BYTES, the least recently used pages are evicted down
+to 90% of it, together with the objects no remaining page refers to.
+
+Set ARTIFACT_STORE=0 to disable the store.
+
+Usage:
+------
+from scraper.artifact_store import get_store, url_identifier
+store = get_store()                                  # None when disabled
+artifact = store.get(url_identifier(url))            # PageArtifact (with .html) or None
+extraction = store.get_extraction(artifact.html_sha, "lxml-tokens")   # .text, .title_image
+
+python -m scraper.artifact_store stats
+python -m scraper.artifact_store show https://example.com/article
+"""
+
+import argparse
+import gzip
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+MICROSERVICES_DIR = os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))
+
+STORE_ENABLED = os.getenv("ARTIFACT_STORE", "1") != "0"
+STORE_DIR = os.getenv("ARTIFACT_STORE_DIR", os.path.join(
+    MICROSERVICES_DIR, ".artifact_store"))
+MAX_BYTES = int(os.getenv("ARTIFACT_STORE_MAX_BYTES", str(1024 ** 3)))
+FRESH_FOR = float(os.getenv("ARTIFACT_STORE_FRESH_FOR", "300"))  # seconds
+
+# eviction stops at this fraction of MAX_BYTES, so that it does not run on every write
+_EVICT_TO = 0.9
+_COMPRESS_LEVEL = 6
+
+
+def url_identifier(url: str) -> str:
+    """
+    Returns the sha256 hex digest of a URL, the key of its page in the store.
+    """
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class PageArtifact:
+    """
+    A stored page.
+    """
+    identifier: str
+    url: str  # final URL, after redirects
+    html_sha: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    validated_at: float  # when the origin last returned or confirmed this page
+    html: bytes
+
+    def conditional_headers(self) -> dict:
+        """
+        Returns the headers revalidating this page: a 304 answer means it is unchanged.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+@dataclass
+class Extraction:
+    """
+    What an extraction backend got out of a stored page; None for what was not stored yet.
+    """
+    text: Optional[str]
+    title_image: Optional[str]
+
+
+class ArtifactStore:
+    """
+    Content-addressed gzip objects with a sqlite index of pages and extractions.
+
+    Args:
+        path (str): Store directory.
+        max_bytes (int): Size of the (compressed) objects above which pages are evicted.
+        fresh_for (float): Seconds after a validation during which a page is used as is.
+    """
+
+    def __init__(self, path: str = STORE_DIR, max_bytes: int = MAX_BYTES, fresh_for: float = FRESH_FOR):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fresh_for = fresh_for
+        os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._db = None
+
+    # ----- index and objects -----
+
+    def _open(self) -> sqlite3.Connection:
+        """
+        (Re)opens the sqlite index; also after a fork, since sqlite connections must not
+        cross processes.
+        """
+        if self._pid == os.getpid() and self._db is not None:
+            return self._db
+        db = sqlite3.connect(os.path.join(self.path, "index.sqlite"), timeout=30,
+                             isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""CREATE TABLE IF NOT EXISTS pages (
+            id TEXT PRIMARY KEY, url TEXT NOT NULL, html_sha TEXT NOT NULL, etag TEXT,
+            last_modified TEXT, validated_at REAL NOT NULL, last_used REAL NOT NULL)""")
+        db.execute("CREATE INDEX IF NOT EXISTS pages_last_used ON pages(last_used)")
+        db.execute("CREATE INDEX IF NOT EXISTS pages_html_sha ON pages(html_sha)")
+        db.execute("""CREATE TABLE IF NOT EXISTS extractions (
+            html_sha TEXT NOT NULL, extractor TEXT NOT NULL, text_sha TEXT, title_image TEXT,
+            PRIMARY KEY (html_sha, extractor))""")
+        db.execute("CREATE INDEX IF NOT EXISTS extractions_text_sha ON extractions(text_sha)")
+        db.execute("CREATE TABLE IF NOT EXISTS objects (sha TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        db.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('total_bytes', 0)")
+        self._db = db
+        self._pid = os.getpid()
+        return db
+
+    def _object_path(self, sha: str) -> str:
+        return os.path.join(self.path, "objects", sha[:2], sha + ".gz")
+
+    def _read_object(self, sha: str) -> Optional[bytes]:
+        try:
+            with open(self._object_path(sha), "rb") as f:
+                return gzip.decompress(f.read())
+        except (OSError, EOFError):
+            return None  # evicted by another process in the meantime, or damaged
+
+    def _write_object(self, db: sqlite3.Connection, data: bytes) -> str:
+        """
+        Stores data under its sha256, once. Must run inside a write transaction.
+        """
+        sha = hashlib.sha256(data).hexdigest()
+        file_path = self._object_path(sha)
+        known = db.execute("SELECT 1 FROM objects WHERE sha = ?", (sha,)).fetchone()
+        if known and os.path.exists(file_path):
+            return sha
+        compressed = gzip.compress(data, compresslevel=_COMPRESS_LEVEL, mtime=0)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, file_path)
+        if not known:
+            db.execute("INSERT INTO objects (sha, size) VALUES (?, ?)", (sha, len(compressed)))
+            db.execute("UPDATE meta SET value = value + ? WHERE name = 'total_bytes'", (len(compressed),))
+        return sha
+
+    def _write(self, operation):
+        """
+        Runs operation(db) in a write transaction, then evicts if the store is over budget.
+        """
+        db = self._open()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = operation(db)
+            total = db.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(db, total)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return result
+
+    def _collect(self, db: sqlite3.Connection) -> int:
+        """
+        Deletes the extractions of pages that are gone and the objects nothing refers to.
+
+        Returns:
+            int: Bytes freed.
+        """
+        db.execute("""DELETE FROM extractions WHERE html_sha NOT IN (SELECT html_sha FROM pages)""")
+        orphans = db.execute("""SELECT sha, size FROM objects
+            WHERE sha NOT IN (SELECT html_sha FROM pages)
+            AND sha NOT IN (SELECT text_sha FROM extractions WHERE text_sha IS NOT NULL)""").fetchall()
+        db.executemany("DELETE FROM objects WHERE sha = ?", [(sha,) for sha, _ in orphans])
+        # inside the transaction: a writer re-adding one of these objects waits for it
+        for sha, _ in orphans:
+            try:
+                os.remove(self._object_path(sha))
+            except FileNotFoundError:
+                pass
+        freed = sum(size for _, size in orphans)
+        db.execute("UPDATE meta SET value = value - ? WHERE name = 'total_bytes'", (freed,))
+        return freed
+
+    def _evict(self, db: sqlite3.Connection, total: int):
+        target = int(self.max_bytes * _EVICT_TO)
+        evicted = 0
+        while total > target:
+            pages = db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            # about as many pages as should free the excess, at their average size
+            batch = 1 if not pages else max(1, math.ceil((total - target) * pages / total))
+            victims = db.execute("SELECT id FROM pages ORDER BY last_used LIMIT ?",
+                                 (batch,)).fetchall()
+            if not victims:
+                break
+            db.executemany("DELETE FROM pages WHERE id = ?", victims)
+            evicted += len(victims)
+            total -= self._collect(db)
+        logger.info("Artifact store evicted %d pages, %d bytes left", evicted, total)
+
+    # ----- public API -----
+
+    def is_fresh(self, artifact: PageArtifact) -> bool:
+        """
+        Whether a page was validated recently enough to be used without a request.
+        """
+        return time.time() - artifact.validated_at < self.fresh_for
+
+    def get(self, identifier: str) -> Optional[PageArtifact]:
+        """
+        Looks a page up by URL identifier.
+
+        Returns:
+            Optional[PageArtifact]: The page with its HTML, or None if it is not stored.
+        """
+        with self._lock:
+            try:
+                db = self._open()
+                row = db.execute("""SELECT url, html_sha, etag, last_modified, validated_at
+                    FROM pages WHERE id = ?""", (identifier,)).fetchone()
+                if row is None:
+                    return None
+                html = self._read_object(row[1])
+                if html is None:
+                    self._write(lambda db: self._discard(db, identifier))
+                    return None
+                db.execute("UPDATE pages SET last_used = ? WHERE id = ?", (time.time(), identifier))
+            except sqlite3.Error as e:
+                logger.warning("Artifact store lookup failed: %s", e)
+                return None
+        return PageArtifact(identifier, *row, html=html)
+
+    def put_page(self, identifier: str, url: str, html: bytes, headers=None) -> Optional[PageArtifact]:
+        """
+        Stores a freshly fetched page.
+
+        Args:
+            identifier (str): URL identifier.
+            url (str): Final URL of the page.
+            html (bytes): Raw page.
+            headers (Optional[Mapping]): Response headers, for the ETag / Last-Modified validators.
+
+        Returns:
+            Optional[PageArtifact]: The stored page, or None if it could not be written (logged).
+        """
+        headers = headers or {}
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        now = time.time()
+
+        def put(db):
+            previous = db.execute("SELECT html_sha FROM pages WHERE id = ?", (identifier,)).fetchone()
+            html_sha = self._write_object(db, html)
+            db.execute("""INSERT OR REPLACE INTO pages
+                (id, url, html_sha, etag, last_modified, validated_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                       (identifier, url, html_sha, etag, last_modified, now, now))
+            if previous is not None and previous[0] != html_sha:
+                self._collect(db)  # the page changed, drop the old version
+            return html_sha
+        with self._lock:
+            try:
+                html_sha = self._write(put)
+            except (sqlite3.Error, OSError) as e:
+                logger.warning("Artifact store write failed: %s", e)
+                return None
+        return PageArtifact(identifier, url, html_sha, etag, last_modified, now, html)
+
+    def revalidated(self, artifact: PageArtifact, headers=None):
+        """
+        Records that the origin answered 304 for a page, with the validators it sent along.
+        """
+        headers = headers or {}
+        artifact.etag = headers.get("ETag") or artifact.etag
+        artifact.last_modified = headers.get("Last-Modified") or artifact.last_modified
+        artifact.validated_at = time.time()
+        with self._lock:
+            try:
+                self._open().execute(
+                    "UPDATE pages SET etag = ?, last_modified = ?, validated_at = ? WHERE id = ?",
+                    (artifact.etag, artifact.last_modified, artifact.validated_at, artifact.identifier))
+            except sqlite3.Error as e:
+                logger.warning("Artifact store write failed: %s", e)
+
+    def _discard(self, db: sqlite3.Connection, identifier: str):
+        db.execute("DELETE FROM pages WHERE id = ?", (identifier,))
+        self._collect(db)
+
+    def discard(self, identifier: str):
+        """
+        Forgets a page, e.g. one that no longer passes verification.
+        """
+        with self._lock:
+            try:
+                self._write(lambda db: self._discard(db, identifier))
+            except (sqlite3.Error, OSError) as e:
+                logger.warning("Artifact store write failed: %s", e)
+
+    def get_extraction(self, html_sha: str, extractor: str) -> Optional[Extraction]:
+        """
+        Returns what an extraction backend (ScraperMod.extractor.key) got out of a page, or
+        None if nothing is stored.
+        """
+        with self._lock:
+            try:
+                row = self._open().execute(
+                    "SELECT text_sha, title_image FROM extractions WHERE html_sha = ? AND extractor = ?",
+                    (html_sha, extractor)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("Artifact store lookup failed: %s", e)
+                return None
+        if row is None:
+            return None
+        text_sha, title_image = row
+        text = None
+        if text_sha is not None:
+            data = self._read_object(text_sha)
+            text = data.decode('utf-8') if data is not None else None
+        return Extraction(text=text, title_image=title_image)
+
+    def put_extraction(self, html_sha: str, extractor: str, text: Optional[str] = None,
+                       title_image: Optional[str] = None):
+        """
+        Stores the cleaned text and / or the title image of a page; None leaves a stored
+        value as it is.
+        """
+        def put(db):
+            if db.execute("SELECT 1 FROM pages WHERE html_sha = ?", (html_sha,)).fetchone() is None:
+                return  # the page was evicted since it was read
+            text_sha = None if text is None else self._write_object(db, text.encode('utf-8'))
+            db.execute("""INSERT INTO extractions (html_sha, extractor, text_sha, title_image)
+                VALUES (?, ?, ?, ?) ON CONFLICT (html_sha, extractor) DO UPDATE SET
+                text_sha = COALESCE(excluded.text_sha, text_sha),
+                title_image = COALESCE(excluded.title_image, title_image)""",
+                       (html_sha, extractor, text_sha, title_image))
+        with self._lock:
+            try:
+                self._write(put)
+            except (sqlite3.Error, OSError) as e:
+                logger.warning("Artifact store write failed: %s", e)
+
+    def stats(self) -> dict:
+        """
+        Returns the number of pages, extractions and objects and the stored size.
+        """
+        with self._lock:
+            db = self._open()
+            return {
+                "pages": db.execute("SELECT COUNT(*) FROM pages").fetchone()[0],
+                "extractions": db.execute("SELECT COUNT(*) FROM extractions").fetchone()[0],
+                "objects": db.execute("SELECT COUNT(*) FROM objects").fetchone()[0],
+                "bytes": db.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0],
+                "max_bytes": self.max_bytes,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[ArtifactStore]:
+    """
+    Returns the process-wide store, or None when it is disabled.
+    """
+    global _store
+    if not STORE_ENABLED:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ArtifactStore()
+    return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the article artifact store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Pages, objects and size of the store.")
+    show = subparsers.add_parser("show", help="Print what is stored for a URL.")
+    show.add_argument("url")
+    show.add_argument("--extractor", default="lxml-tokens", help="Extraction backend key.")
+    args = parser.parse_args()
+
+    store = ArtifactStore()
+    if args.command == "stats":
+        for name, value in store.stats().items():
+            print(f"{name}: {value}")
+        return
+    artifact = store.get(url_identifier(args.url))
+    if artifact is None:
+        raise SystemExit(f"{args.url} is not stored")
+    age = time.time() - artifact.validated_at
+    print(f"url: {artifact.url}\nhtml: {artifact.html_sha} ({len(artifact.html)} bytes)\n"
+          f"etag: {artifact.etag}\nlast-modified: {artifact.last_modified}\nvalidated: {age:.0f}s ago")
+    extraction = store.get_extraction(artifact.html_sha, args.extractor)
+    if extraction is not None:
+        print(f"title image: {extraction.title_image}\n\n{extraction.text or ''}")
+
+
+if __name__ == "__main__":
+    main()
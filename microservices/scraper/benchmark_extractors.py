@@ -0,0 +1,109 @@
+"""
+benchmark_extractors.py
+
+Compares the article extraction backends of scraper/extractors.py on the saved pages in
+scraper/fixtures/ (and on a large page assembled from them):
+
+- output: the cleaned text, verification code and title image of each backend. The lxml
+  backend with substring matching must reproduce the soup backend exactly, which checks
+  the single traversal; with word matching (the default) the lines it keeps or drops
+  differently are listed.
+- speed: parse + extraction time per page and backend.
+
+Usage:
+------
+    python -m scraper.benchmark_extractors
+    python -m scraper.benchmark_extractors --repeat 20 --large-copies 60 --show-diff
+"""
+
+import argparse
+import difflib
+import glob
+import logging
+import os
+import time
+import warnings
+
+from bs4 import XMLParsedAsHTMLWarning
+from scraper.extractors import LxmlExtractor, SoupExtractor
+from scraper.scraper_mod import ScraperMod
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_fixtures(large_copies: int) -> dict:
+    """
+    The saved pages, plus "large_news_page": the news article with its body repeated
+    large_copies times, the size of a long news page with comments.
+    """
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.html"))):
+        with open(path, "rb") as f:
+            pages[os.path.basename(path)] = f.read()
+    news = pages.get("news_article.html")
+    if news and large_copies:
+        start, end = news.index(b"<main"), news.index(b"</main>") + len(b"</main>")
+        pages["large_news_page"] = news[:start] + news[start:end] * large_copies + news[end:]
+    return pages
+
+
+def extract(extractor, content: bytes) -> dict:
+    """
+    What ScraperMod gets out of a page with one backend.
+    """
+    scraper = ScraperMod("https://fixture.example/", verification_code="", promoter_id="")
+    scraper.extractor = extractor
+    page = scraper.parse_html(content)
+    text = scraper.scrape_and_clean_article(page)
+    return {"text": text, "code": extractor.verification_code(page),
+            "image": scraper.get_title_image(page)}
+
+
+def time_extract(extractor, content: bytes, repeat: int) -> float:
+    """
+    Best of repeat runs, in milliseconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract(extractor, content)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the article extraction backends.")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs per page and backend.")
+    parser.add_argument("--large-copies", type=int, default=40,
+                        help="Copies of the news article body in the large page.")
+    parser.add_argument("--show-diff", action="store_true", help="Print the differing lines.")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    # xhtml_declaration.html: the soup backend parses XHTML as HTML on purpose
+    warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
+
+    soup, legacy, lxml = SoupExtractor(), LxmlExtractor(match="substring"), LxmlExtractor(match="tokens")
+    mismatches = 0
+    print(f"{'page':<24} {'KiB':>6} {'soup ms':>8} {'lxml ms':>8} {'speedup':>8}  legacy match  word-match diff")
+    for name, content in load_fixtures(args.large_copies).items():
+        expected = extract(soup, content)
+        same = extract(legacy, content) == expected
+        mismatches += not same
+        current = extract(lxml, content)
+        diff = [line for line in difflib.ndiff(expected["text"].splitlines(), current["text"].splitlines())
+                if line[:1] in "+-"]
+        extras = [key for key in ("code", "image") if current[key] != expected[key]]
+        soup_ms, lxml_ms = time_extract(soup, content, args.repeat), time_extract(lxml, content, args.repeat)
+        print(f"{name:<24} {len(content) / 1024:>6.0f} {soup_ms:>8.1f} {lxml_ms:>8.1f} {soup_ms / lxml_ms:>7.1f}x"
+              f"  {'identical' if same else 'DIFFERENT':<12}  "
+              f"+{sum(d[0] == '+' for d in diff)} -{sum(d[0] == '-' for d in diff)} lines"
+              + (f", {' and '.join(extras)} differ" if extras else ""))
+        if args.show_diff:
+            for line in diff:
+                print(f"      {line}")
+    if mismatches:
+        raise SystemExit(f"{mismatches} page(s) where the lxml traversal does not reproduce the soup output")
+
+
+if __name__ == "__main__":
+    main()
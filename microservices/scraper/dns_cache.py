@@ -0,0 +1,143 @@
+"""
+dns_cache.py
+
+DNS cache of the shared fetcher (scraper/fetcher.py).
+
+httpx resolves the host of every new connection with getaddrinfo in the event loop's thread
+pool, so with many hosts and short-lived keep-alives the lookups of a batch queue up behind
+each other. CachingBackend is an httpcore network backend that resolves each host once per
+SCRAPER_DNS_TTL seconds (getaddrinfo does not report record TTLs), shares one lookup between
+the connections waiting for it and then connects to the cached addresses in turn. TLS still
+verifies and sends SNI for the host name; only the TCP connection is opened to the address.
+
+Set SCRAPER_DNS_TTL=0 to disable the cache. It is not used when a proxy is configured in the
+environment, since the proxy resolves the hosts then.
+"""
+
+import asyncio
+import ipaddress
+import logging
+import os
+import socket
+import urllib.request
+
+import httpcore
+import httpx
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DNS_TTL = float(os.getenv("SCRAPER_DNS_TTL", "300"))  # seconds
+
+# expired entries are dropped once there are more than this many
+_PRUNE_AT = 4096
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+    except ValueError:
+        return False
+    return True
+
+
+class CachingBackend(httpcore.AsyncNetworkBackend):
+    """
+    Wraps httpcore's default backend with a per-host DNS cache. Must be used from a single
+    event loop.
+
+    Args:
+        ttl (float): Seconds a resolution is reused.
+        backend (Optional[httpcore.AsyncNetworkBackend]): The backend opening the connections.
+    """
+
+    def __init__(self, ttl: float = DNS_TTL, backend=None):
+        self.ttl = ttl
+        self._backend = backend or httpcore.AnyIOBackend()
+        self._cache = {}  # (host, port) -> (expiry loop time, addresses)
+        self._pending = {}  # (host, port) -> task of a lookup in progress
+        self.hits = 0
+        self.misses = 0
+
+    async def _lookup(self, host: str, port: int) -> list:
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            raise httpcore.ConnectError(f"Cannot resolve {host}: {e}") from e
+        # one entry per address, in the resolver's order
+        return list(dict.fromkeys(info[4][0] for info in infos))
+
+    async def resolve(self, host: str, port: int) -> list:
+        """
+        Returns the addresses of host, from the cache while they are fresh.
+
+        Raises:
+            httpcore.ConnectError: If the host cannot be resolved.
+        """
+        key = (host, port)
+        loop = asyncio.get_running_loop()
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > loop.time():
+            self.hits += 1
+            return cached[1]
+        lookup = self._pending.get(key)
+        if lookup is None:
+            self.misses += 1
+            lookup = self._pending[key] = loop.create_task(self._lookup(host, port))
+            lookup.add_done_callback(lambda task: self._resolved(key, task))
+        else:
+            self.hits += 1
+        # a cancelled request does not cancel the lookup the others wait for
+        return await asyncio.shield(lookup)
+
+    def _resolved(self, key, task: asyncio.Task):
+        del self._pending[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        now = asyncio.get_running_loop().time()
+        if len(self._cache) >= _PRUNE_AT:
+            self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+        self._cache[key] = (now + self.ttl, task.result())
+
+    def forget(self, host: str, port: int):
+        self._cache.pop((host, port), None)
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        if _is_ip(host):
+            return await self._backend.connect_tcp(host, port, timeout, local_address, socket_options)
+        addresses = await self.resolve(host, port)
+        error = None
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        # the host may have moved: resolve it again next time
+        self.forget(host, port)
+        raise error or httpcore.ConnectError(f"No address for {host}")
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
+
+
+def caching_transport(ttl: float = DNS_TTL, **kwargs):
+    """
+    Returns an httpx transport resolving hosts through a CachingBackend, or None when the
+    cache is disabled or a proxy is configured in the environment (use httpx's default).
+
+    Args:
+        ttl (float): Seconds a resolution is reused.
+        **kwargs: Arguments of httpx.AsyncHTTPTransport (limits, ...).
+    """
+    if ttl <= 0 or urllib.request.getproxies():
+        return None
+    transport = httpx.AsyncHTTPTransport(**kwargs)
+    # httpx has no argument for it; the pool picks the backend up on its next connection
+    transport._pool._network_backend = CachingBackend(ttl)
+    return transport
@@ -0,0 +1,285 @@
+"""
+extractors.py
+
+Article extraction backends of ScraperMod, selected with SCRAPER_EXTRACTOR.
+
+- "lxml" (default): the page is parsed straight into an lxml tree and the article text is
+  assembled in one traversal (etree.iterwalk) that skips boilerplate subtrees as it meets
+  them, instead of decomposing them in separate passes over a BeautifulSoup tree.
+  Boilerplate class and id values are matched by word ("ad", "ad-slot", "adContainer",
+  "share-bar", ...), so "header", "shadow", "loading" or "badge" are no longer removed as
+  ads. SCRAPER_BOILERPLATE_MATCH=substring reproduces the old substring selector.
+- "soup": the original BeautifulSoup implementation.
+
+Each backend parses the page and answers the questions ScraperMod asks of it: the
+verification code, the title image and the cleaned text. Compare their output and speed on
+the saved pages in scraper/fixtures/ with:
+
+    python -m scraper.benchmark_extractors
+"""
+
+import functools
+import logging
+import os
+import re
+from typing import Optional
+
+from bs4 import BeautifulSoup, FeatureNotFound
+from dotenv import load_dotenv
+from lxml import etree
+from lxml import html as lxml_html
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+EXTRACTOR = os.getenv("SCRAPER_EXTRACTOR", "lxml")
+BOILERPLATE_MATCH = os.getenv("SCRAPER_BOILERPLATE_MATCH", "tokens")
+
+# tags that never hold article text
+REMOVED_TAGS = frozenset(('script', 'style', 'nav', 'footer', 'header', 'aside', 'form', 'iframe', 'noscript'))
+# tags ending a line of text
+BLOCK_TAGS = frozenset(('p', 'div', 'br', 'h1', 'h2', 'h3', 'h4'))
+# the old selector: '[id*="comments"], [class*="ad"], [id*="ad"], [class*="promo"], ...'
+CLASS_SUBSTRINGS = ('ad', 'promo', 'subscribe', 'banner', 'cookie', 'social', 'share', 'popup', 'sidebar')
+ID_SUBSTRINGS = ('comments', 'ad')
+# words of a class or id value marking boilerplate
+BOILERPLATE_WORDS = frozenset((
+    'ad', 'ads', 'adsbygoogle', 'adslot', 'adunit', 'advert', 'adverts', 'advertisement', 'advertising',
+    'sponsored', 'promo', 'promos', 'promoted', 'promotion', 'subscribe', 'subscription', 'newsletter',
+    'banner', 'cookie', 'cookies', 'consent', 'social', 'share', 'sharing', 'popup', 'modal', 'sidebar',
+))
+ID_WORDS = BOILERPLATE_WORDS | {'comment', 'comments'}
+_HTML_PARSER = lxml_html.HTMLParser()
+_UTF8_HTML_PARSER = lxml_html.HTMLParser(encoding='utf-8')
+# "ad-slot" -> ad, slot; "adContainer" -> ad, container; "AD_TOP" -> ad, top
+_WORD_RE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+@functools.lru_cache(maxsize=4096)
+def _words(value: str) -> frozenset:
+    return frozenset(word.lower() for word in _WORD_RE.findall(value))
+
+
+def is_boilerplate(element, match: str = BOILERPLATE_MATCH) -> bool:
+    """
+    Whether an lxml element is navigation, ads or other page furniture, by tag, class and id.
+    """
+    if element.tag in REMOVED_TAGS:
+        return True
+    classes = element.get('class')
+    element_id = element.get('id')
+    if match == 'substring':
+        return bool(classes and any(s in classes for s in CLASS_SUBSTRINGS)
+                    or element_id and any(s in element_id for s in ID_SUBSTRINGS))
+    return bool(classes and not _words(classes).isdisjoint(BOILERPLATE_WORDS)
+                or element_id and not _words(element_id).isdisjoint(ID_WORDS))
+
+
+class LxmlPage:
+    """
+    A page parsed by LxmlExtractor, with the extractor that parsed it.
+    """
+
+    def __init__(self, root, extractor: "LxmlExtractor"):
+        self.root = root
+        self.extractor = extractor
+
+
+class SoupExtractor:
+    """
+    The original BeautifulSoup implementation.
+    """
+    name = "soup"
+    key = "soup"  # identifies its output, e.g. in the artifact store
+
+    def parse(self, content: bytes) -> BeautifulSoup:
+        """
+        Parses a page with lxml, or html.parser if lxml is not installed.
+        """
+        try:
+            return BeautifulSoup(content, 'lxml')
+        except FeatureNotFound:
+            logger.warning(
+                "lxml parser not found. Falling back to html.parser")
+            return BeautifulSoup(content, 'html.parser')
+
+    def verification_code(self, soup: BeautifulSoup) -> Optional[str]:
+        meta = soup.find('meta', attrs={'name': 'credx-verification'})
+        return meta.get('content') if meta else None
+
+    def title_image(self, soup: BeautifulSoup) -> str:
+        # 1. Try <meta property="og:image"> (Open Graph)
+        meta_og = soup.find('meta', property='og:image')
+        if meta_og and meta_og.get('content'):
+            logger.info("Found og:image meta tag for article image.")
+            return meta_og['content'].strip()
+
+        # 2. Try <meta name="twitter:image">
+        meta_twitter = soup.find('meta', attrs={'name': 'twitter:image'})
+        if meta_twitter and meta_twitter.get('content'):
+            logger.info("Found twitter:image meta tag for article image.")
+            return meta_twitter['content'].strip()
+
+        # 3. Try <link rel="image_src">
+        link_image_src = soup.find('link', rel='image_src')
+        if link_image_src and link_image_src.get('href'):
+            logger.info("Found image_src link tag for article image.")
+            return link_image_src['href'].strip()
+
+        # 4. Fallback: first <img> in <body>
+        body = soup.body
+        if body:
+            first_img = body.find('img', src=True)
+            if first_img and first_img['src']:
+                logger.info("Found first <img> tag in article body for image.")
+                return first_img['src'].strip()
+        return ''
+
+    def article_text(self, soup: BeautifulSoup) -> str:
+        # Remove unwanted tags like scripts, styles, navs, etc.
+        for tag in soup(list(REMOVED_TAGS)):
+            tag.decompose()
+
+        # Remove comments
+        for comment in soup.find_all(string=lambda text: isinstance(text, str) and '<!--' in text):
+            comment.extract()
+
+        # Remove elements with common ad or irrelevant classes/ids
+        for bad_selector in soup.select('[id*="comments"], [class*="ad"], [id*="ad"], [class*="promo"], [class*="subscribe"], [class*="banner"], [class*="cookie"], [class*="social"], [class*="share"], [class*="popup"], [class*="sidebar"]'):
+            bad_selector.decompose()
+
+        # Prefer <article>, fallback to main content containers
+        main_content = soup.find('article') or soup.find('main') or soup.body
+        if not main_content:
+            return ''
+
+        # For better readability, replace block tags with newlines before getting text
+        for tag in main_content.find_all(list(BLOCK_TAGS)):
+            tag.append('\n')
+
+        return main_content.get_text()
+
+
+class LxmlExtractor:
+    """
+    Single-traversal extraction on an lxml tree.
+
+    Args:
+        match (str): "tokens" or "substring" matching of boilerplate class / id values
+            (see is_boilerplate).
+    """
+    name = "lxml"
+
+    def __init__(self, match: str = BOILERPLATE_MATCH):
+        self.match = match
+        self.key = f"lxml-{match}"
+
+    def parse(self, content: bytes) -> LxmlPage:
+        """
+        Parses a page, as UTF-8 when it decodes as such, else in the encoding it declares.
+        The bytes go to the parser as they are: lxml refuses str input with an XML
+        declaration (<?xml ... encoding="UTF-8"?>), as XHTML pages start.
+        """
+        try:
+            content.decode('utf-8')
+        except UnicodeDecodeError:
+            parser = _HTML_PARSER
+        else:
+            parser = _UTF8_HTML_PARSER
+        return LxmlPage(lxml_html.document_fromstring(content, parser=parser), self)
+
+    def verification_code(self, page: LxmlPage) -> Optional[str]:
+        for meta in page.root.iter('meta'):
+            if meta.get('name') == 'credx-verification':
+                return meta.get('content')
+        return None
+
+    def title_image(self, page: LxmlPage) -> str:
+        root = page.root
+        # the first matching tag decides, as with soup.find
+        meta_og = next((m for m in root.iter('meta') if m.get('property') == 'og:image'), None)
+        if meta_og is not None and meta_og.get('content'):
+            logger.info("Found og:image meta tag for article image.")
+            return meta_og.get('content').strip()
+        meta_twitter = next((m for m in root.iter('meta') if m.get('name') == 'twitter:image'), None)
+        if meta_twitter is not None and meta_twitter.get('content'):
+            logger.info("Found twitter:image meta tag for article image.")
+            return meta_twitter.get('content').strip()
+        link = next((lk for lk in root.iter('link') if 'image_src' in (lk.get('rel') or '').split()), None)
+        if link is not None and link.get('href'):
+            logger.info("Found image_src link tag for article image.")
+            return link.get('href').strip()
+        body = root.find('body')
+        if body is not None:
+            # ScraperMod calls this after article_text, which on the soup path has removed the
+            # boilerplate from the tree; skip the images inside it here too
+            first_img = next((img for img in body.iter('img')
+                              if img.get('src') is not None and not self._removed(img)), None)
+            if first_img is not None and first_img.get('src'):
+                logger.info("Found first <img> tag in article body for image.")
+                return first_img.get('src').strip()
+        return ''
+
+    def _removed(self, element) -> bool:
+        """
+        Whether the element or one of its ancestors is boilerplate.
+        """
+        if is_boilerplate(element, self.match):
+            return True
+        return any(is_boilerplate(ancestor, self.match) for ancestor in element.iterancestors())
+
+    def _main_content(self, root):
+        for tag in ('article', 'main', 'body'):
+            for element in root.iter(tag):
+                if not self._removed(element):
+                    return element
+                if tag == 'body':
+                    return None  # the old path looked at soup.body only
+        return None
+
+    def article_text(self, page: LxmlPage) -> str:
+        main_content = self._main_content(page.root)
+        if main_content is None:
+            return ''
+        parts = []
+        skipped = set()
+        match = self.match
+        walker = etree.iterwalk(main_content, events=('start', 'end', 'comment', 'pi'))
+        for event, element in walker:
+            if event == 'start':
+                if element is not main_content and is_boilerplate(element, match):
+                    # its 'end' event still comes, and adds the tail: the text after it
+                    walker.skip_subtree()
+                    skipped.add(element)
+                    continue
+                if element.text:
+                    parts.append(element.text)
+            elif event == 'end':
+                if element.tag in BLOCK_TAGS and element not in skipped:
+                    parts.append('\n')
+                if element.tail and element is not main_content:
+                    parts.append(element.tail)
+            elif element.tail:  # comments and processing instructions: only their tail is text
+                parts.append(element.tail)
+        return ''.join(parts)
+
+
+EXTRACTORS = {"lxml": LxmlExtractor, "soup": SoupExtractor}
+
+
+def get_extractor(name: str = EXTRACTOR):
+    """
+    Raises:
+        ValueError: If the name is not a known backend.
+    """
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown SCRAPER_EXTRACTOR {name!r}, expected one of {sorted(EXTRACTORS)}")
+    return EXTRACTORS[name]()
+
+
+def extractor_for(page):
+    """
+    The backend that parsed a page.
+    """
+    return page.extractor if isinstance(page, LxmlPage) else SoupExtractor()
@@ -0,0 +1,443 @@
+"""
+fetcher.py
+
+Process-wide asynchronous HTTP fetcher shared by every ScraperMod.
+
+Building a requests.Session per queue item meant a fresh DNS lookup, TCP and TLS handshake
+for every article. The fetcher keeps one long-lived httpx.AsyncClient instead:
+
+- connections are kept alive and reused per host (SCRAPER_MAX_CONNECTIONS in total);
+- at most SCRAPER_CONCURRENCY requests are in flight at once, across all callers, and each
+  host gets at most SCRAPER_HOST_CONCURRENCY of them, started at SCRAPER_HOST_RATE per second
+  at most (scraper/host_scheduler.py), so that many articles from one blog are fetched
+  politely while the other hosts interleave;
+- host names are resolved once per SCRAPER_DNS_TTL seconds (scraper/dns_cache.py);
+- fetch_verified streams a page through an incremental HTML parser and stops reading as soon
+  as its <head> is known to lack the credx-verification meta tag of the promoter, so spam and
+  unverified pages cost a few kilobytes instead of a download and a full parse. Only HTML
+  (text/html, application/xhtml+xml) up to SCRAPER_MAX_BYTES is accepted;
+- failed requests are retried like the urllib3 Retry the scraper used: SCRAPER_RETRIES
+  retries on connection errors, timeouts and 429/500/502/503/504 responses, sleeping
+  backoff_factor * 2 ** (retry - 1) seconds from the second retry on (0, 2, 4 s by
+  default) or what a 413/429/503 response's Retry-After asks for. A 429 or 503 pauses every
+  request to its host for that long;
+- requests can carry conditional headers (If-None-Match / If-Modified-Since, see
+  scraper/artifact_store.py); a 304 answer comes back as a FetchResult with no content.
+
+The client lives on an event loop in a background thread, so the threaded workers call
+fetch() and block only themselves, while asyncio code awaits fetch_async() or fetch_many()
+on the same pool. The thread starts on the first fetch (after a supervisor fork).
+
+Usage:
+------
+from scraper.fetcher import fetch, fetch_many
+result = fetch("https://example.com/article")            # FetchResult or None
+results = fetch_many(["https://a.example/1", "https://b.example/2"])
+result = fetch_verified("https://example.com/article", code)   # result.verified: head check
+
+python -m scraper.fetcher https://example.com/a https://example.com/b   # time concurrent fetches
+"""
+
+import argparse
+import asyncio
+import email.utils
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+import httpx
+from dotenv import load_dotenv
+from lxml import etree
+from scraper.dns_cache import caching_transport
+from scraper.host_scheduler import HostBlocked, HostScheduler, host_key
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+CONCURRENCY = int(os.getenv("SCRAPER_CONCURRENCY", "32"))
+MAX_CONNECTIONS = int(os.getenv("SCRAPER_MAX_CONNECTIONS", "64"))
+KEEPALIVE_EXPIRY = float(os.getenv("SCRAPER_KEEPALIVE_EXPIRY", "60"))  # seconds
+TIMEOUT = float(os.getenv("SCRAPER_TIMEOUT", "15"))  # seconds, per connect / read
+RETRIES = int(os.getenv("SCRAPER_RETRIES", "3"))
+BACKOFF_FACTOR = float(os.getenv("SCRAPER_BACKOFF_FACTOR", "1"))
+MAX_BYTES = int(os.getenv("SCRAPER_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# same as the urllib3 Retry of the old per-article session
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+RETRY_AFTER_STATUSES = frozenset((413, 429, 503))
+# responses asking to slow down, which pause the whole host
+THROTTLE_STATUSES = frozenset((429, 503))
+HTML_MEDIA_TYPES = frozenset(("text/html", "application/xhtml+xml"))
+NOT_MODIFIED = 304
+_MAX_BACKOFF = 120  # seconds, urllib3's backoff_max
+
+
+class FetchResult(NamedTuple):
+    """
+    A successful (2xx) response, or a 304 to a conditional request (empty content).
+    """
+    url: str  # final URL, after redirects
+    status: int
+    headers: httpx.Headers
+    content: bytes
+    verified: Optional[bool] = None  # outcome of the head check of fetch_verified
+
+
+class PageRejected(Exception):
+    """
+    The page is not fetched further: wrong content type or too large.
+    """
+
+
+class HeadVerifier:
+    """
+    Incrementally parses the start of an HTML page until its credx-verification meta tag
+    settles whether the page is verified.
+
+    Args:
+        verification_code (str): Expected content of the meta tag.
+    """
+
+    def __init__(self, verification_code: str):
+        self.verification_code = verification_code
+        self._parser = etree.HTMLPullParser(events=("start",))
+
+    def _check(self) -> Optional[bool]:
+        for _, element in self._parser.read_events():
+            if element.tag == "meta" and element.get("name") == "credx-verification":
+                # like soup.find, the first such tag decides
+                return element.get("content") == self.verification_code
+            if element.tag == "body":
+                return False  # the head ended without it (the parser opens <body> implicitly)
+        return None
+
+    def feed(self, chunk: bytes) -> Optional[bool]:
+        """
+        Returns:
+            Optional[bool]: True / False once decided, None while the head is still open.
+        """
+        self._parser.feed(chunk)
+        return self._check()
+
+    def close(self) -> bool:
+        """
+        Decides at the end of the page.
+        """
+        try:
+            self._parser.close()
+        except etree.LxmlError:
+            pass
+        return bool(self._check())
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """
+    Seconds the Retry-After header of a response asks to wait, if it has a valid one.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def backoff_time(consecutive_errors: int, backoff_factor: float = BACKOFF_FACTOR) -> float:
+    """
+    urllib3's backoff: nothing before the first retry, then backoff_factor * 2 ** (n - 1).
+    """
+    if consecutive_errors <= 1:
+        return 0.0
+    return min(_MAX_BACKOFF, backoff_factor * 2 ** (consecutive_errors - 1))
+
+
+class AsyncFetcher:
+    """
+    One pooled httpx.AsyncClient with a global concurrency limit, per-host politeness
+    (scraper/host_scheduler.py), a DNS cache (scraper/dns_cache.py) and urllib3-style retries.
+    Must be used from a single event loop.
+
+    Args:
+        concurrency (int): Requests in flight at once.
+        max_connections (int): Open connections in the pool, over all hosts.
+        timeout (float): Connect / read / write timeout in seconds.
+        retries (int): Retries after the first attempt.
+        backoff_factor (float): Backoff between retries (see backoff_time).
+    """
+
+    def __init__(self, concurrency: int = CONCURRENCY, max_connections: int = MAX_CONNECTIONS,
+                 timeout: float = TIMEOUT, retries: int = RETRIES,
+                 backoff_factor: float = BACKOFF_FACTOR):
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.hosts = HostScheduler()
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_connections,
+                              keepalive_expiry=KEEPALIVE_EXPIRY)
+        self.client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            follow_redirects=True,
+            timeout=httpx.Timeout(timeout),
+            limits=limits,
+            transport=caching_transport(limits=limits),
+        )
+
+    async def _request(self, url: str, read, headers: Optional[dict] = None):
+        """
+        Streams a GET with retries and returns read(response) of the first response that
+        is not retried. The body is only downloaded by read; a 304 is returned as an empty
+        FetchResult without calling it.
+
+        Raises:
+            httpx.HTTPError: On the last failed attempt (transport error or error status).
+            HostBlocked: If the host asked to wait longer than SCRAPER_MAX_RETRY_AFTER.
+        """
+        host = host_key(url)
+        errors = 0
+        while True:
+            wait = None
+            throttled = False
+            try:
+                async with self.hosts.slot(host), self._semaphore:
+                    async with self.client.stream("GET", url, headers=headers) as response:
+                        status = response.status_code
+                        if status == NOT_MODIFIED:
+                            return FetchResult(url=str(response.url), status=NOT_MODIFIED,
+                                               headers=response.headers, content=b"")
+                        if status in RETRY_AFTER_STATUSES:
+                            wait = retry_after(response)
+                        if status in THROTTLE_STATUSES:
+                            # the host asks us to slow down: pause all requests to it, not only this one
+                            throttled = True
+                            self.hosts.back_off(host, backoff_time(errors + 1, self.backoff_factor)
+                                                if wait is None else wait)
+                        if status not in RETRY_STATUSES or errors >= self.retries:
+                            response.raise_for_status()
+                            return await read(response)
+                        logger.debug("Retrying %s after status %d", url, status)
+            except httpx.TransportError:
+                if errors >= self.retries:
+                    raise
+            errors += 1
+            wait = backoff_time(errors, self.backoff_factor) if wait is None else wait
+            if wait and not throttled:  # else the host slot waits
+                await asyncio.sleep(wait)
+
+    async def fetch(self, url: str, headers: Optional[dict] = None) -> Optional[FetchResult]:
+        """
+        Fetches a URL.
+
+        Args:
+            url (str): URL to fetch.
+            headers (Optional[dict]): Extra request headers, e.g. conditional ones.
+
+        Returns:
+            Optional[FetchResult]: The response, or None if it failed after the retries
+                or answered with an error status (the error is logged).
+        """
+        async def read(response):
+            await response.aread()
+            return FetchResult(url=str(response.url), status=response.status_code,
+                               headers=response.headers, content=response.content)
+        try:
+            return await self._request(url, read, headers)
+        except (httpx.HTTPError, HostBlocked) as e:
+            logger.error(f"Failed to fetch {url}. Reason: {e}")
+            return None
+
+    async def fetch_verified(self, url: str, verification_code: str, max_bytes: int = MAX_BYTES,
+                             headers: Optional[dict] = None) -> Optional[FetchResult]:
+        """
+        Fetches an HTML page, streaming it through an incremental parser so that a page
+        without the right credx-verification meta tag in its <head> is dropped as soon as
+        its head has been read, before the body is downloaded.
+
+        Args:
+            url (str): Page URL.
+            verification_code (str): Expected content of the credx-verification meta tag.
+            max_bytes (int): Largest (decompressed) page accepted.
+            headers (Optional[dict]): Extra request headers, e.g. conditional ones.
+
+        Returns:
+            Optional[FetchResult]: The page with verified=True; for a page that failed the
+                check, verified=False and the bytes read until then; a 304 (verified None)
+                if a conditional request found the page unchanged; None if the fetch failed
+                or the page is not HTML or too large (logged).
+        """
+        async def read(response):
+            content_type = response.headers.get("Content-Type", "")
+            media_type = content_type.split(";", 1)[0].strip().lower()
+            if media_type and media_type not in HTML_MEDIA_TYPES:
+                raise PageRejected(f"content type {content_type!r} is not HTML")
+            length = response.headers.get("Content-Length", "")
+            if length.isdigit() and int(length) > max_bytes and "Content-Encoding" not in response.headers:
+                raise PageRejected(f"Content-Length {length} is over {max_bytes} bytes")
+
+            head = HeadVerifier(verification_code)
+            verified = None
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > max_bytes:
+                    raise PageRejected(f"page is over {max_bytes} bytes")
+                if verified is None:
+                    verified = head.feed(chunk)
+                    if verified is False:
+                        break  # leaving the stream closes the connection
+            if verified is None:
+                verified = head.close()
+            return FetchResult(url=str(response.url), status=response.status_code,
+                               headers=response.headers, content=b"".join(chunks), verified=verified)
+        try:
+            result = await self._request(url, read, headers)
+        except PageRejected as e:
+            logger.warning(f"Rejected {url}: {e}")
+            return None
+        except (httpx.HTTPError, HostBlocked) as e:
+            logger.error(f"Failed to fetch {url}. Reason: {e}")
+            return None
+        if result.verified is False:
+            logger.info(f"Dropped {url} after {len(result.content)} bytes: no valid credx-verification in <head>")
+        return result
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class _LoopThread:
+    """
+    An event loop running in a daemon thread, with the AsyncFetcher that lives on it.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="scraper-fetcher", daemon=True)
+        self.thread.start()
+        self.fetcher = self.run(self._make_fetcher())
+
+    @staticmethod
+    async def _make_fetcher() -> AsyncFetcher:
+        return AsyncFetcher()  # the semaphore and the client bind to the running loop
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # the loop thread does not exist in a forked child; start a new one on first use
+    global _loop_thread, _loop_lock
+    _loop_thread = None
+    _loop_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_loop_thread() -> _LoopThread:
+    global _loop_thread
+    if _loop_thread is None:
+        with _loop_lock:
+            if _loop_thread is None:
+                _loop_thread = _LoopThread()
+    return _loop_thread
+
+
+async def fetch_async(url: str, headers: Optional[dict] = None) -> Optional[FetchResult]:
+    """
+    Fetches a URL on the shared pool from any event loop (see AsyncFetcher.fetch).
+    """
+    loop_thread = _get_loop_thread()
+    if asyncio.get_running_loop() is loop_thread.loop:
+        return await loop_thread.fetcher.fetch(url, headers)
+    future = asyncio.run_coroutine_threadsafe(loop_thread.fetcher.fetch(url, headers), loop_thread.loop)
+    return await asyncio.wrap_future(future)
+
+
+def fetch(url: str, headers: Optional[dict] = None) -> Optional[FetchResult]:
+    """
+    Fetches a URL on the shared pool, blocking the calling thread (see AsyncFetcher.fetch).
+    """
+    loop_thread = _get_loop_thread()
+    return loop_thread.run(loop_thread.fetcher.fetch(url, headers))
+
+
+async def fetch_verified_async(url: str, verification_code: str,
+                               headers: Optional[dict] = None) -> Optional[FetchResult]:
+    """
+    Fetches a page on the shared pool from any event loop (see AsyncFetcher.fetch_verified).
+    """
+    loop_thread = _get_loop_thread()
+    coroutine = loop_thread.fetcher.fetch_verified(url, verification_code, headers=headers)
+    if asyncio.get_running_loop() is loop_thread.loop:
+        return await coroutine
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop_thread.loop))
+
+
+def fetch_verified(url: str, verification_code: str,
+                   headers: Optional[dict] = None) -> Optional[FetchResult]:
+    """
+    Fetches a page on the shared pool, blocking the calling thread (see
+    AsyncFetcher.fetch_verified).
+    """
+    loop_thread = _get_loop_thread()
+    return loop_thread.run(loop_thread.fetcher.fetch_verified(url, verification_code, headers=headers))
+
+
+def fetch_many(urls) -> list:
+    """
+    Fetches URLs concurrently (up to SCRAPER_CONCURRENCY at once), blocking until all are done.
+
+    Returns:
+        list of Optional[FetchResult]: One result per URL, in order.
+    """
+    loop_thread = _get_loop_thread()
+
+    async def gather():
+        return await asyncio.gather(*(loop_thread.fetcher.fetch(url) for url in urls))
+    return loop_thread.run(gather())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch URLs concurrently through the shared pool.")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--verify", metavar="CODE",
+                        help="Stream the pages and check their credx-verification meta tag.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.verify:
+        loop_thread = _get_loop_thread()
+
+        async def gather():
+            return await asyncio.gather(*(loop_thread.fetcher.fetch_verified(url, args.verify)
+                                          for url in args.urls))
+        results = loop_thread.run(gather())
+    else:
+        results = fetch_many(args.urls)
+    elapsed = time.perf_counter() - start
+    for url, result in zip(args.urls, results):
+        print(f"{url}: " + (f"{result.status}, {len(result.content)} bytes"
+                            + ("" if result.verified is None else f", verified {result.verified}")
+                            if result else "failed"))
+    print(f"{len(args.urls)} URLs in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,149 @@
+"""
+host_scheduler.py
+
+Per-host politeness for the shared fetcher (scraper/fetcher.py).
+
+Many promoters submit articles from the same few blogs, so a batch of concurrent fetches
+easily lands on one host at once and gets rate limited. HostScheduler hands out request slots
+per host (scheme, host and port of the URL):
+
+- at most SCRAPER_HOST_CONCURRENCY requests to a host are in flight at once;
+- requests to a host start at most SCRAPER_HOST_RATE per second;
+- a 429 / 503 with Retry-After (or the retry backoff without one) pauses the whole host, not
+  only the request that got it. A host paused for longer than SCRAPER_MAX_RETRY_AFTER seconds
+  fails its requests at once with HostBlocked instead of holding them.
+
+The fetcher takes a host slot before one of its SCRAPER_CONCURRENCY global slots, so requests
+waiting on a busy, slow or paused host do not hold global slots: every host gets at most its
+own few, and the other hosts interleave in the rest.
+
+Usage:
+------
+scheduler = HostScheduler()
+async with scheduler.slot(host_key(url)):
+    ...                                       # the request
+scheduler.back_off(host_key(url), seconds)    # after a 429
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+
+import httpx
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+HOST_CONCURRENCY = int(os.getenv("SCRAPER_HOST_CONCURRENCY", "4"))
+HOST_RATE = float(os.getenv("SCRAPER_HOST_RATE", "2"))  # request starts per second, 0 = no limit
+MAX_RETRY_AFTER = float(os.getenv("SCRAPER_MAX_RETRY_AFTER", "300"))  # seconds
+
+# idle host states are dropped once there are more than this many
+_PRUNE_AT = 1024
+
+
+class HostBlocked(Exception):
+    """
+    The host asked to be left alone for longer than SCRAPER_MAX_RETRY_AFTER.
+    """
+
+
+def host_key(url: str) -> str:
+    """
+    Returns the scheme, host and port a URL is fetched from.
+    """
+    parsed = httpx.URL(url)
+    port = f":{parsed.port}" if parsed.port else ""  # None for the scheme's default port
+    return f"{parsed.scheme}://{parsed.host}{port}"
+
+
+class _HostState:
+    __slots__ = ("semaphore", "users", "next_start", "blocked_until")
+
+    def __init__(self, concurrency: int):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.users = 0  # requests holding or waiting for a slot
+        self.next_start = 0.0  # loop time before which no new request may start
+        self.blocked_until = 0.0  # loop time until which the host asked to be left alone
+
+    def idle(self, now: float) -> bool:
+        return self.users == 0 and self.next_start <= now and self.blocked_until <= now
+
+
+class HostScheduler:
+    """
+    Per-host concurrency limit, request rate and Retry-After pauses. Must be used from a
+    single event loop.
+
+    Args:
+        concurrency (int): Requests in flight at once per host.
+        rate (float): Request starts per second per host, 0 for no limit.
+        max_wait (float): Longest pause of a host that requests wait out.
+    """
+
+    def __init__(self, concurrency: int = HOST_CONCURRENCY, rate: float = HOST_RATE,
+                 max_wait: float = MAX_RETRY_AFTER):
+        self.concurrency = max(1, concurrency)
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.max_wait = max_wait
+        self._hosts = {}
+
+    def _state(self, host: str) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            if len(self._hosts) >= _PRUNE_AT:
+                now = asyncio.get_running_loop().time()
+                self._hosts = {h: s for h, s in self._hosts.items() if not s.idle(now)}
+            state = self._hosts[host] = _HostState(self.concurrency)
+        return state
+
+    async def _wait_turn(self, host: str, state: _HostState):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if state.blocked_until - now > self.max_wait:
+                raise HostBlocked(f"{host} asked to wait {state.blocked_until - now:.0f}s")
+            start = max(now, state.next_start, state.blocked_until)
+            if start <= now:
+                state.next_start = now + self.interval
+                return
+            # check again afterwards: the host may have been paused in the meantime
+            await asyncio.sleep(start - now)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, host: str):
+        """
+        Waits until a request to host may start and holds one of its slots meanwhile.
+
+        Raises:
+            HostBlocked: If the host is paused for longer than max_wait.
+        """
+        state = self._state(host)
+        state.users += 1
+        try:
+            async with state.semaphore:
+                await self._wait_turn(host, state)
+                yield
+        finally:
+            state.users -= 1
+
+    def back_off(self, host: str, seconds: float):
+        """
+        Pauses all requests to host for seconds (e.g. its Retry-After).
+        """
+        if seconds <= 0:
+            return
+        state = self._state(host)
+        until = asyncio.get_running_loop().time() + seconds
+        if until > state.blocked_until:
+            state.blocked_until = until
+            logger.info("Pausing requests to %s for %.1fs", host, seconds)
+
+    def stats(self) -> dict:
+        """
+        Returns the hosts with requests in flight or waiting, and how many.
+        """
+        return {host: state.users for host, state in self._hosts.items() if state.users}
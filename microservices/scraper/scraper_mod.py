@@ -2,23 +2,32 @@
 scraper_mod.py
 
 Provides the ScraperMod class for robustly scraping, cleaning, and uploading a single article.
+Pages are downloaded through the shared connection pool of scraper/fetcher.py and kept,
+with their cleaned text and title image, in the artifact store of scraper/artifact_store.py.
 """
 
-import hashlib
 import logging
-from typing import Optional
+import os
+from typing import Optional, Union
 
-import requests
-from bs4 import BeautifulSoup, FeatureNotFound
+from bs4 import BeautifulSoup
 from controller.db_controller import execute_query
 from dotenv import load_dotenv
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from scraper.artifact_store import (Extraction, PageArtifact, get_store,
+                                    url_identifier)
+from scraper.extractors import LxmlPage, extractor_for, get_extractor
+from scraper.fetcher import (NOT_MODIFIED, FetchResult, fetch, fetch_async,
+                             fetch_verified, fetch_verified_async)
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# stream pages and stop at the <head> of unverified ones (see fetcher.fetch_verified)
+STREAM_VERIFY = os.getenv("SCRAPER_STREAM_VERIFY", "1") != "0"
+
+Page = Union[BeautifulSoup, LxmlPage]
+
 
 class ScraperMod:
     """
@@ -33,58 +42,115 @@ class ScraperMod:
         self.article_url = article_url
         self.verification_code = verification_code
         self.promoter_id = promoter_id
-        self.session = self._create_session()
-
-    def _create_session(self) -> requests.Session:
+        # outcome of the streaming head check, None when the page was fetched whole
+        self.head_verified = None
+        self.extractor = get_extractor()
+        self.store = get_store()
+        # the stored copy of the page being processed, once fetched
+        self.artifact: Optional[PageArtifact] = None
+
+    def parse_html(self, content: bytes):
         """
-        Creates a requests.Session with a User-Agent and a retry strategy.
+        Parses a page with the SCRAPER_EXTRACTOR backend (see scraper/extractors.py).
 
         Returns:
-            requests.Session: Configured session object.
+            BeautifulSoup | LxmlPage: The parsed page, to pass to the other methods.
         """
-        session = requests.Session()
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        session.headers.update(headers)
+        return self.extractor.parse(content)
 
-        retry_strategy = Retry(
-            total=3,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET", "OPTIONS"],
-            backoff_factor=1
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("https://", adapter)
-        session.mount("http://", adapter)
-        return session
+    def _stream_verify(self) -> bool:
+        return STREAM_VERIFY and bool(self.verification_code)
 
-    def fetch_article_html(self) -> Optional[BeautifulSoup]:
-        """
-        Fetches the HTML content of the article URL with timeouts and retries.
+    def _stored_page(self) -> Optional[PageArtifact]:
+        if self.store is None:
+            return None
+        return self.store.get(self.generate_unique_identifier())
 
-        Returns:
-            Optional[BeautifulSoup]: Parsed HTML content, or None if fetch fails.
-        """
-        url = self.article_url
+    def _request_headers(self, stored: Optional[PageArtifact]) -> Optional[dict]:
+        return stored.conditional_headers() if stored is not None else None
+
+    def _parse(self, content: bytes) -> Optional[Page]:
         try:
-            resp = self.session.get(url, timeout=15)
-            resp.raise_for_status()
-            try:
-                soup = BeautifulSoup(resp.content, 'lxml')
-            except FeatureNotFound:
-                logger.warning(
-                    "lxml parser not found. Falling back to html.parser")
-                soup = BeautifulSoup(resp.content, 'html.parser')
-            logger.info(f"Fetched HTML for URL: {url}")
-            return soup
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to fetch {url}. Reason: {e}")
-            return None
+            return self.parse_html(content)
         except Exception as e:
             logger.error(
-                f"An unexpected error occurred while fetching {url}: {e}")
+                f"An unexpected error occurred while parsing {self.article_url}: {e}")
+            return None
+
+    def _stored_extraction(self, extractor) -> Optional[Extraction]:
+        if self.artifact is None:
             return None
+        return self.store.get_extraction(self.artifact.html_sha, extractor.key)
+
+    def _parse_stored(self, stored: PageArtifact) -> Optional[Page]:
+        # a stored page was checked as a whole, like SCRAPER_STREAM_VERIFY=0
+        self.head_verified = None
+        self.artifact = stored
+        return self._parse(stored.html)
+
+    def _parse_result(self, result: Optional[FetchResult], stored: Optional[PageArtifact]) -> Optional[Page]:
+        if result is None:
+            return None
+        if result.status == NOT_MODIFIED and stored is not None:
+            self.store.revalidated(stored, result.headers)
+            logger.info(f"Article unchanged since it was stored: {self.article_url}")
+            return self._parse_stored(stored)
+        self.head_verified = result.verified
+        if self.store is not None:
+            if result.verified is False:
+                # only the head was read; a stored copy of the page no longer passes either
+                if stored is not None:
+                    self.store.discard(stored.identifier)
+            else:
+                self.artifact = self.store.put_page(self.generate_unique_identifier(), result.url,
+                                                    result.content, result.headers)
+        soup = self._parse(result.content)
+        if soup is not None:
+            logger.info(f"Fetched HTML for URL: {self.article_url}")
+        return soup
+
+    def fetch_article_html(self) -> Optional[Page]:
+        """
+        Fetches the HTML content of the article URL with timeouts and retries, over the
+        process-wide connection pool (scraper/fetcher.py).
+
+        With SCRAPER_STREAM_VERIFY (the default), the page is streamed and the download
+        stops after its <head> when that lacks the verification meta tag; the soup then
+        only holds the part read and has_credx_verification returns False.
+
+        A page found in the artifact store is used without a request when it was validated
+        less than ARTIFACT_STORE_FRESH_FOR seconds ago, and revalidated with a conditional
+        GET otherwise.
+
+        Returns:
+            Optional[Page]: Parsed HTML content (a BeautifulSoup with SCRAPER_EXTRACTOR=soup),
+                or None if fetch fails.
+        """
+        stored = self._stored_page()
+        if stored is not None and self.store.is_fresh(stored):
+            logger.info(f"Using stored HTML for URL: {self.article_url}")
+            return self._parse_stored(stored)
+        headers = self._request_headers(stored)
+        if self._stream_verify():
+            result = fetch_verified(self.article_url, self.verification_code, headers=headers)
+        else:
+            result = fetch(self.article_url, headers=headers)
+        return self._parse_result(result, stored)
+
+    async def fetch_article_html_async(self) -> Optional[Page]:
+        """
+        Same as fetch_article_html, for asyncio callers fetching many articles at once.
+        """
+        stored = self._stored_page()
+        if stored is not None and self.store.is_fresh(stored):
+            logger.info(f"Using stored HTML for URL: {self.article_url}")
+            return self._parse_stored(stored)
+        headers = self._request_headers(stored)
+        if self._stream_verify():
+            result = await fetch_verified_async(self.article_url, self.verification_code, headers=headers)
+        else:
+            result = await fetch_async(self.article_url, headers=headers)
+        return self._parse_result(result, stored)
 
     def website_status(self, website_id: str, cursor) -> bool:
         """
@@ -105,12 +171,12 @@ class ScraperMod:
             logger.info(f"Website ID {website_id} is not active.")
             return False
 
-    def has_credx_verification(self, soup: Optional[BeautifulSoup]) -> bool:
+    def has_credx_verification(self, soup: Optional[Page]) -> bool:
         """
         Checks for the presence of a 'credx-verification' meta tag.
 
         Args:
-            soup (Optional[BeautifulSoup]): Parsed HTML content.
+            soup (Optional[Page]): Parsed HTML content.
 
         Returns:
             bool: True if verification meta tag is present and correct, else False.
@@ -118,14 +184,18 @@ class ScraperMod:
         if soup is None:
             logger.warning("No soup object provided for verification.")
             return False
+        if self.head_verified is False:
+            # the streaming fetch already found no valid tag in the <head>
+            logger.info("Article verification failed.")
+            return False
 
-        meta = soup.find('meta', attrs={'name': 'credx-verification'})
-        if not meta or meta.get('content') != self.verification_code:
+        code = extractor_for(soup).verification_code(soup)
+        if code is None or code != self.verification_code:
             logger.info("Article verification failed.")
             return False
 
         logger.info("Article verification succeeded.")
-        return meta is not None
+        return True
 
     def check_budget(self, entered_budget: float, cursor) -> bool:
         """
@@ -152,12 +222,14 @@ class ScraperMod:
             logger.warning("Insufficient budget.")
             return False
 
-    def scrape_and_clean_article(self, soup: Optional[BeautifulSoup]) -> str:
+    def scrape_and_clean_article(self, soup: Optional[Page]) -> str:
         """
-        Scrapes and cleans the article content from the BeautifulSoup object.
+        Scrapes and cleans the article content: drops scripts, navigation, ads and other
+        boilerplate, keeps the <article> (else <main>, else <body>) text with one line per
+        block.
 
         Args:
-            soup (Optional[BeautifulSoup]): Parsed HTML content.
+            soup (Optional[Page]): Parsed HTML content.
 
         Returns:
             str: Cleaned article text.
@@ -166,32 +238,23 @@ class ScraperMod:
             logger.warning("No soup object provided for cleaning.")
             return ''
 
-        # Remove unwanted tags like scripts, styles, navs, etc.
-        for tag in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 'form', 'iframe', 'noscript']):
-            tag.decompose()
+        extractor = extractor_for(soup)
+        stored = self._stored_extraction(extractor)
+        if stored is not None and stored.text is not None:
+            logger.info("Using stored article content.")
+            return stored.text
 
-        # Remove comments
-        for comment in soup.find_all(string=lambda text: isinstance(text, str) and '<!--' in text):
-            comment.extract()
-
-        # Remove elements with common ad or irrelevant classes/ids
-        for bad_selector in soup.select('[id*="comments"], [class*="ad"], [id*="ad"], [class*="promo"], [class*="subscribe"], [class*="banner"], [class*="cookie"], [class*="social"], [class*="share"], [class*="popup"], [class*="sidebar"]'):
-            bad_selector.decompose()
-
-        # Prefer <article>, fallback to main content containers
-        main_content = soup.find('article') or soup.find('main') or soup.body
-        if not main_content:
+        raw_text = extractor.article_text(soup)
+        if not raw_text:
             logger.warning("No main content found in article.")
             return ''
 
-        # For better readability, replace block tags with newlines before getting text
-        for tag in main_content.find_all(['p', 'div', 'br', 'h1', 'h2', 'h3', 'h4']):
-            tag.append('\n')
-
         # Get cleaned text, strip leading/trailing whitespace from each line
-        lines = (line.strip() for line in main_content.get_text().splitlines())
+        lines = (line.strip() for line in raw_text.splitlines())
         text = '\n'.join(line for line in lines if line)
         logger.info("Article content cleaned successfully.")
+        if self.artifact is not None:
+            self.store.put_extraction(self.artifact.html_sha, extractor.key, text=text)
         return text
 
     def generate_unique_identifier(self) -> str:
@@ -201,18 +264,17 @@ class ScraperMod:
         Returns:
             str: SHA-256 hash of the URL.
         """
-        url_bytes = self.article_url.encode('utf-8')
-        sha256_hash = hashlib.sha256(url_bytes)
-        identifier = sha256_hash.hexdigest()
+        identifier = url_identifier(self.article_url)
         logger.debug(f"Generated unique identifier for URL: {identifier}")
         return identifier
 
-    def get_title_image(self, soup: Optional[BeautifulSoup]) -> str:
+    def get_title_image(self, soup: Optional[Page]) -> str:
         """
-        Extracts the main thumbnail image of the article.
+        Extracts the main thumbnail image of the article: og:image, twitter:image,
+        <link rel="image_src">, else the first <img> of the body.
 
         Args:
-            soup (Optional[BeautifulSoup]): Parsed HTML content.
+            soup (Optional[Page]): Parsed HTML content.
 
         Returns:
             str: Image URL or empty string if not found.
@@ -221,31 +283,14 @@ class ScraperMod:
             logger.info("No soup object provided for image extraction.")
             return ''
 
-        # 1. Try <meta property="og:image"> (Open Graph)
-        meta_og = soup.find('meta', property='og:image')
-        if meta_og and meta_og.get('content'):
-            logger.info("Found og:image meta tag for article image.")
-            return meta_og['content'].strip()
-
-        # 2. Try <meta name="twitter:image">
-        meta_twitter = soup.find('meta', attrs={'name': 'twitter:image'})
-        if meta_twitter and meta_twitter.get('content'):
-            logger.info("Found twitter:image meta tag for article image.")
-            return meta_twitter['content'].strip()
-
-        # 3. Try <link rel="image_src">
-        link_image_src = soup.find('link', rel='image_src')
-        if link_image_src and link_image_src.get('href'):
-            logger.info("Found image_src link tag for article image.")
-            return link_image_src['href'].strip()
-
-        # 4. Fallback: first <img> in <body>
-        body = soup.body
-        if body:
-            first_img = body.find('img', src=True)
-            if first_img and first_img['src']:
-                logger.info("Found first <img> tag in article body for image.")
-                return first_img['src'].strip()
-
-        logger.info("No article image found.")
-        return ''
+        extractor = extractor_for(soup)
+        stored = self._stored_extraction(extractor)
+        if stored is not None and stored.title_image is not None:
+            return stored.title_image
+
+        image = extractor.title_image(soup)
+        if not image:
+            logger.info("No article image found.")
+        if self.artifact is not None:
+            self.store.put_extraction(self.artifact.html_sha, extractor.key, title_image=image)
+        return image
@@ -0,0 +1,100 @@
+"""
+startup_report.py
+
+Reports how long importing the service modules takes, like `python -X importtime` but summarized.
+
+Every module is imported in a fresh interpreter with -X importtime. The report lists the wall
+time of the import, the slowest top-level packages (cumulative time) and any heavy library
+(torch, sklearn, pandas, nltk, ...) that got imported although it should only load on first
+use, through the warmup() functions.
+
+Usage:
+------
+    python startup_report.py                          # main, supervisor, test tooling modules
+    python startup_report.py classifier.model_service --top 15
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+DEFAULT_MODULES = [
+    "main",
+    "supervisor",
+    "classifier.model_service",
+    "classifier.utils",
+    "classifier.inference_client",
+    "tag_extraction.get_tags",
+]
+
+_MARKER = "--- startup_report ---"
+# libraries that take from a few hundred milliseconds to seconds to import
+HEAVY_PACKAGES = ("torch", "sentence_transformers", "transformers", "sklearn", "scipy",
+                  "pandas", "nltk", "google.genai", "onnxruntime", "optimum")
+
+
+def import_profile(module: str) -> dict:
+    """
+    Imports module in a fresh interpreter and parses its -X importtime output.
+
+    Returns:
+        dict: wall_ms (total import time), packages ({top-level package: ms spent importing
+            it}) and modules (names of all imported modules).
+    """
+    code = ("import sys, time; sys.stderr.write('{1}\\n'); start = time.perf_counter(); "
+            "import {0}; print((time.perf_counter() - start) * 1000)").format(module, _MARKER)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    entries = []  # (depth, name, cumulative ms), children listed before their parent
+    lines = result.stderr.split(_MARKER, 1)[-1].splitlines()
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative) / 1000))
+
+    # charge each package the cumulative time of its outermost imports, i.e. those not
+    # imported from inside the same package
+    packages = defaultdict(float)
+    stack = []  # (depth, package) of the enclosing imports
+    for depth, name, cumulative in reversed(entries):
+        package = name.split(".")[0]
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        if not stack or stack[-1][1] != package:
+            packages[package] += cumulative
+        stack.append((depth, package))
+    return {"wall_ms": float(result.stdout.strip().splitlines()[-1]),
+            "packages": dict(packages), "modules": {name for _, name, _ in entries}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the import time of service modules.")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=8, help="Slowest packages to list per module.")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        profile = import_profile(module)
+        heavy = sorted(p for p in HEAVY_PACKAGES if p in profile["modules"])
+        print(f"{module}: {profile['wall_ms']:.0f} ms"
+              + (f"  (heavy imports: {', '.join(heavy)})" if heavy else ""))
+        # the module's own package covers the whole import, the wall time already shows it
+        own = module.split(".")[0]
+        slowest = sorted(((p, ms) for p, ms in profile["packages"].items() if p != own),
+                         key=lambda item: -item[1])[:args.top]
+        for package, ms in slowest:
+            print(f"    {package:<28} {ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+supervisor.py
+
+Multi-process worker mode: loads the models once, then forks worker processes that share them.
+
+The supervisor loads the embedder, the classifier of classifier/model_service.py and the tag
+extraction resources with main.warmup(), freezes the garbage collector so the loaded objects are never
+written to again, and forks WORKER_PROCESSES children that each run main.main(). The model
+weights stay in copy-on-write pages shared by all children, so adding a worker adds its
+working memory, not another copy of the models.
+
+- Each child gets cpu_count // WORKER_PROCESSES torch threads (WORKER_TORCH_THREADS), and
+  in pipeline mode as many compute slots unless PIPELINE_COMPUTE_WORKERS is set, so the
+  workers together do not oversubscribe the cores.
+- Children that exit are respawned; one that keeps dying shortly after start is respawned
+  with an exponential backoff.
+- SIGTERM / SIGINT stop the children and then the supervisor. A child stops its worker loop,
+  merges its pending tag IDF counts (tag_extraction/idf_model.py) and exits.
+- Every MEMORY_REPORT_INTERVAL seconds the RSS and PSS (proportional set size, shared pages
+  split between the processes sharing them) of the workers are logged.
+
+The workers consume the same queue concurrently, which needs QUEUE_BACKEND=postgres.
+
+Usage:
+------
+    QUEUE_BACKEND=postgres python supervisor.py --workers 4
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import sys
+import time
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 1)))
+WORKER_TORCH_THREADS = int(os.getenv("WORKER_TORCH_THREADS", "0"))  # 0: cores / workers
+MEMORY_REPORT_INTERVAL = float(os.getenv("MEMORY_REPORT_INTERVAL", "300"))  # seconds
+
+# a child that exits sooner than this after starting counts as a crash loop
+_MIN_UPTIME = 30
+_MAX_BACKOFF = 60
+
+
+def memory_usage(pid: int):
+    """
+    Resident and proportional set size of a process in MiB (Linux only).
+
+    Returns:
+        Optional[tuple]: (rss, pss), or None if /proc is not available.
+    """
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in ("Rss", "Pss"):
+                    values[name] = int(rest.split()[0]) / 1024
+    except OSError:
+        return None
+    return values.get("Rss", 0.0), values.get("Pss", 0.0)
+
+
+def _exit_on_signal(signum, frame):
+    raise SystemExit(0)
+
+
+def run_worker(torch_threads: int):
+    """
+    Body of a forked child: limits its threads and runs the normal worker loop.
+    """
+    import torch
+    from pipeline import staged_worker
+
+    import main
+
+    # unwinds main.main() so the connection is closed and spawn() gets to flush
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+    # Ctrl-C reaches the whole process group; the supervisor stops the children itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    torch.set_num_threads(torch_threads)
+    if "PIPELINE_COMPUTE_WORKERS" not in os.environ:
+        staged_worker.COMPUTE_WORKERS = torch_threads
+    logger.info("Worker %d started (%d torch threads)", os.getpid(), torch_threads)
+    main.main()
+
+
+class Supervisor:
+    """
+    Forks and respawns the worker processes.
+
+    Args:
+        workers (int): Number of worker processes.
+        torch_threads (int): Torch threads per worker.
+    """
+
+    def __init__(self, workers: int, torch_threads: int):
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self.children = {}  # pid -> start time
+        self.failures = 0
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.torch_threads)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                logger.exception("Worker %d failed", os.getpid())
+                code = 1
+            finally:
+                # os._exit skips atexit, where the IDF model would otherwise flush
+                try:
+                    from tag_extraction.idf_model import flush_shared_model
+                    flush_shared_model()
+                except Exception:
+                    logger.exception("Worker %d could not flush the tag IDF model", os.getpid())
+                logging.shutdown()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report_memory(self):
+        usage = {pid: memory_usage(pid) for pid in self.children}
+        usage = {pid: u for pid, u in usage.items() if u}
+        if not usage:
+            return
+        supervisor = memory_usage(os.getpid())
+        total_pss = sum(pss for _, pss in usage.values()) + (supervisor[1] if supervisor else 0)
+        logger.info("Worker memory (MiB): %s; total PSS incl. supervisor %.0f",
+                    ", ".join(f"{pid}: rss {rss:.0f} pss {pss:.0f}" for pid, (rss, pss) in usage.items()),
+                    total_pss)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        next_report = time.monotonic() + min(MEMORY_REPORT_INTERVAL, 60)
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                if time.monotonic() >= next_report:
+                    self.report_memory()
+                    next_report = time.monotonic() + MEMORY_REPORT_INTERVAL
+                time.sleep(0.5)
+                continue
+            uptime = time.monotonic() - self.children.pop(pid)
+            if self.stopping:
+                continue
+            logger.warning("Worker %d exited with status %d after %.0f s, respawning",
+                           pid, os.waitstatus_to_exitcode(status), uptime)
+            self.failures = self.failures + 1 if uptime < _MIN_UPTIME else 0
+            if self.failures:
+                delay = min(_MAX_BACKOFF, 2 ** self.failures)
+                logger.warning("Workers keep exiting right after start, waiting %d s", delay)
+                time.sleep(delay)
+                if self.stopping:
+                    continue
+            self.spawn()
+        logger.info("All workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run worker processes that share the loaded models.")
+    parser.add_argument("--workers", type=int, default=WORKER_PROCESSES)
+    parser.add_argument("--torch-threads", type=int, default=WORKER_TORCH_THREADS,
+                        help="Torch threads per worker (default: cores / workers).")
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+    torch_threads = args.torch_threads or max(1, (os.cpu_count() or 1) // workers)
+
+    from controller.work_queue import QUEUE_BACKEND
+    if QUEUE_BACKEND != "postgres" and workers > 1:
+        logger.critical("QUEUE_BACKEND=%s only supports a single worker; set QUEUE_BACKEND=postgres "
+                        "to run %d workers", QUEUE_BACKEND, workers)
+        sys.exit(1)
+
+    # tokenizers would otherwise warn and disable its thread pool in every child
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    # loads the embedder and the classifier (or only checks the server, with INFERENCE_SERVER_URL);
+    # nothing is encoded before the fork, so no thread pool is running when it happens
+    import main as worker_main
+    worker_main.warmup()
+
+    # move everything loaded so far out of the collector's reach: collections in the
+    # children would otherwise write to every object header and un-share their pages
+    gc.collect()
+    gc.freeze()
+    logger.info("Models loaded, starting %d workers with %d torch threads each", workers, torch_threads)
+    Supervisor(workers, torch_threads).run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(process)d - %(message)s')
+    main()
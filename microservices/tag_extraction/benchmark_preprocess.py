@@ -0,0 +1,112 @@
+"""
+benchmark_preprocess.py
+=======================
+
+Checks the fast tag preprocessing against the original nltk implementation and times both.
+
+- golden output: preprocess and preprocess_document must return exactly what
+  preprocess_reference returns, on every text of classifier/data/train.csv, on articles
+  assembled from it and on edge cases (urls, punctuation, contractions, unicode).
+- speed: both implementations on articles of typical lengths (about 300, 1000 and 3000
+  words, title included), with a cold and a warm lemma cache.
+
+Usage:
+------
+python -m tag_extraction.benchmark_preprocess
+python -m tag_extraction.benchmark_preprocess --articles 50
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from tag_extraction import get_tags
+from tag_extraction.get_tags import (preprocess, preprocess_document,
+                                     preprocess_reference)
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "classifier", "data", "train.csv")
+
+EDGE_CASES = [
+    "",
+    "   ",
+    "Visit https://example.com/a?b=c or www.example.org/page for MORE details!",
+    "They cannot stop, we're gonna win, gotta go, gimme that, lemme see, wanna",
+    "wanna",
+    "Don't can't won't shouldn't; 'twas the night, d'ye more'n enough",
+    "E-mail co-operation state-of-the-art x2y 3D 2024 $3.88 (roughly) [brackets] {braces}",
+    "Café naïve résumé ÜBER straße İstanbul",
+    "line\nbreaks\tand non breaking　spaces",
+    "ends with http",
+    "xhttp://mid.word urlhttps://a wwwgarbage",
+    "Running runners ran quickly; the geese and mice were dancing... churches, abaci",
+    "``quoted'' \"double\" 'single' -- dashes --- and ... ellipsis",
+]
+
+
+def make_articles(texts, words, count, rng):
+    """
+    Articles of about `words` words, assembled from random training texts.
+    """
+    articles = []
+    for _ in range(count):
+        parts, length = [], 0
+        while length < words:
+            text = texts[rng.integers(len(texts))]
+            parts.append(text)
+            length += len(text.split())
+        title = " ".join(parts[0].split()[:12])
+        articles.append((title, " ".join(parts)))
+    return articles
+
+
+def check_golden(texts, articles):
+    """
+    Raises:
+        AssertionError: On the first text the fast path processes differently.
+    """
+    for text in EDGE_CASES + texts:
+        expected = preprocess_reference(text)
+        assert preprocess(text) == expected, f"preprocess differs on {text[:80]!r}"
+    for title, content in articles + [(a, b) for a in EDGE_CASES[:4] for b in EDGE_CASES[-4:]]:
+        expected = preprocess_reference((title + " ") * 3 + content)
+        assert preprocess_document(title, content) == expected, \
+            f"preprocess_document differs on {title[:80]!r}"
+
+
+def time_calls(function, articles) -> float:
+    start = time.perf_counter()
+    for title, content in articles:
+        function(title, content)
+    return (time.perf_counter() - start) / len(articles) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the fast and the nltk tag preprocessing.")
+    parser.add_argument("--articles", type=int, default=30, help="Articles per length.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    texts = pd.read_csv(DATA_PATH)["text"].dropna().astype(str).tolist()
+    get_tags.warmup()
+
+    articles = {words: make_articles(texts, words, args.articles, rng) for words in (300, 1000, 3000)}
+    check_golden(texts, [a for group in articles.values() for a in group[:10]])
+    print(f"Golden output: identical on {len(EDGE_CASES) + len(texts)} texts and "
+          f"{sum(min(10, len(group)) for group in articles.values())} articles")
+
+    def reference(title, content):
+        return preprocess_reference((title + " ") * 3 + content)
+
+    print(f"{'words':>6} {'nltk ms':>9} {'fast cold ms':>13} {'fast warm ms':>13} {'speedup':>8}")
+    for words, group in articles.items():
+        nltk_ms = time_calls(reference, group)
+        get_tags._lemmatize.cache_clear()
+        cold_ms = time_calls(preprocess_document, group)
+        warm_ms = time_calls(preprocess_document, group)
+        print(f"{words:>6} {nltk_ms:>9.2f} {cold_ms:>13.2f} {warm_ms:>13.2f} {nltk_ms / warm_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
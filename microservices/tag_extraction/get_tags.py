@@ -1,38 +1,115 @@
+import functools
 import logging
 import os
 import re
+import threading
 
-import nltk
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from sklearn.feature_extraction.text import TfidfVectorizer
+import numpy as np
+from tag_extraction.idf_model import IdfModel, get_idf_model
 
 logger = logging.getLogger(__name__)
 
-# Ensure NLTK resources are downloaded to the current directory
+# NLTK resources are downloaded to this directory on first use
 nltk_data_dir = os.path.join(os.path.dirname(__file__), 'nltk_data')
-os.makedirs(nltk_data_dir, exist_ok=True)
 
-# Set NLTK data path to local directory before checking for resources
-nltk.data.path.insert(0, nltk_data_dir)
+# loaded by warmup(); nltk and sklearn are imported there too, they take seconds to import
+stop_words = None
+lemmatizer = None
+_warmup_lock = threading.Lock()
 
-for resource in [
-    ("tokenizers/punkt", "punkt"),
-    ("tokenizers/punkt_tab", "punkt_tab"),
-    ("corpora/stopwords", "stopwords"),
-    ("corpora/wordnet", "wordnet")
-]:
-    try:
-        nltk.data.find(resource[0])
-    except LookupError:
-        nltk.download(resource[1], download_dir=nltk_data_dir)
+LEMMA_CACHE_SIZE = int(os.getenv("TAG_LEMMA_CACHE_SIZE", "100000"))
+# "tfidf" ranks terms by TF-IDF, "semantic" reranks the best of them by similarity to the
+# article embedding (tag_extraction/semantic_tags.py)
+TAG_MODE = os.getenv("TAG_MODE", "tfidf")
+
+# urls and every character that is not a lowercase letter or whitespace, removed in one pass
+_CLEAN_RE = re.compile(r"http\S+|www\S+|https\S+|[^a-z\s]")
+# words nltk.word_tokenize splits in two (cannot -> can not, gonna -> gon na, ...); both
+# parts are 3 letters or less, so preprocess drops them
+_SPLIT_WORDS = frozenset(("cannot", "gimme", "gonna", "gotta", "lemme", "wanna"))
+
+
+def _ensure_nltk_resources(resources):
+    import nltk
 
-stop_words = set(stopwords.words("english"))
-lemmatizer = WordNetLemmatizer()
+    os.makedirs(nltk_data_dir, exist_ok=True)
+    # Set NLTK data path to local directory before checking for resources
+    if nltk_data_dir not in nltk.data.path:
+        nltk.data.path.insert(0, nltk_data_dir)
+    for path, name in resources:
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(name, download_dir=nltk_data_dir)
+
+
+def warmup():
+    """
+    Downloads the NLTK resources if missing and loads the stopwords and the lemmatizer.
+    Called by the first extract_tags; services call it at startup instead.
+    """
+    global stop_words, lemmatizer
+    if lemmatizer is not None:
+        return
+    with _warmup_lock:
+        if lemmatizer is not None:
+            return
+        from nltk.corpus import stopwords
+        from nltk.stem import WordNetLemmatizer
+
+        _ensure_nltk_resources([("corpora/stopwords", "stopwords"),
+                                ("corpora/wordnet", "wordnet")])
+        stop_words = frozenset(stopwords.words("english"))
+        wordnet_lemmatizer = WordNetLemmatizer()
+        wordnet_lemmatizer.lemmatize("warmup")  # WordNet itself loads on the first call
+        lemmatizer = wordnet_lemmatizer
+
+
+@functools.lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def _lemmatize(word: str) -> str:
+    return lemmatizer.lemmatize(word)
+
+
+def _tokens(text: str) -> list:
+    """
+    Lowercased, cleaned, stopword-filtered and lemmatized tokens of a text.
+    """
+    words = _CLEAN_RE.sub("", text.lower()).split()
+    return [_lemmatize(w) for w in words
+            if len(w) > 3 and w not in stop_words and w not in _SPLIT_WORDS]
 
 
 def preprocess(text: str) -> str:
-    """Clean and lemmatize text."""
+    """
+    Clean and lemmatize text.
+
+    Same output as preprocess_reference: urls and non-letters are removed with one
+    precompiled regex, the text is split on whitespace (all nltk.word_tokenize does with
+    letters-only text, apart from the few words in _SPLIT_WORDS) and lemmas are memoized.
+    """
+    warmup()
+    return " ".join(_tokens(text))
+
+
+def preprocess_document(title: str, content: str) -> str:
+    """
+    preprocess((title + " ") * 3 + content), processing the title once.
+    """
+    warmup()
+    title_tokens = _tokens(title)
+    return " ".join(title_tokens * 3 + _tokens(content))
+
+
+def preprocess_reference(text: str) -> str:
+    """
+    The original nltk implementation of preprocess, kept to check the fast one against
+    (see tag_extraction/benchmark_preprocess.py).
+    """
+    import nltk
+
+    warmup()
+    _ensure_nltk_resources([("tokenizers/punkt", "punkt"),
+                            ("tokenizers/punkt_tab", "punkt_tab")])
     text = text.lower()
     text = re.sub(r"http\S+|www\S+|https\S+", "", text)  # remove urls
     text = re.sub(r"[^a-z\s]", "", text)  # keep only letters
@@ -45,27 +122,105 @@ def preprocess(text: str) -> str:
     return " ".join(tokens)
 
 
-def extract_tags(title: str, content: str, top_k: int = 15):
-    """Extract top-k tags using TF-IDF with lemmatization and title weighting."""
-    # Weight title higher by repeating it 3x
-    weighted_text = (title + " ") * 3 + content
+@functools.lru_cache(maxsize=1)
+def _analyzer():
+    """
+    Splits preprocessed text into the unigrams and bigrams tags are chosen from.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
 
-    # Preprocess
-    processed = preprocess(weighted_text)
+    return CountVectorizer(ngram_range=(1, 2)).build_analyzer()
 
-    # TF-IDF on unigrams + bigrams
-    vectorizer = TfidfVectorizer(ngram_range=(1, 2), max_features=5000)
-    tfidf_matrix = vectorizer.fit_transform([processed])
-    scores = tfidf_matrix.toarray()[0]
-    feature_names = vectorizer.get_feature_names_out()
 
-    # Rank terms by TF-IDF score
-    ranked = sorted(
-        zip(feature_names, scores), key=lambda x: x[1], reverse=True
-    )
+def document_terms(text: str) -> set:
+    """
+    Distinct terms of a document, as counted by the IDF model.
+    """
+    return set(_analyzer()(preprocess(text)))
+
+
+def build_idf_model(texts) -> IdfModel:
+    """
+    Counts the document frequencies of a corpus (see tag_extraction/idf_model.py).
+    """
+    model = IdfModel()
+    model.add(document_terms(text) for text in texts)
+    return model
+
+
+def update_tag_idf(texts):
+    """
+    Adds new documents (e.g. the title and summary of a new promotion) to the IDF model.
+    """
+    get_idf_model().add([document_terms(text) for text in texts])
+
+
+def _top_k_columns(scores, columns, top_k):
+    """
+    Top-k entries of one sparse row, best first; ties go to the lower column, i.e. the
+    alphabetically first term. Only the k best are sorted.
+    """
+    if len(scores) > top_k:
+        kth = -np.partition(-scores, top_k - 1)[top_k - 1]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:top_k - len(above)]
+        keep = np.concatenate((above, ties))
+        scores, columns = scores[keep], columns[keep]
+    return columns[np.lexsort((columns, -scores))]
+
 
-    # Select top_k unique tags
-    tags = [term for term, score in ranked[:top_k]]
+def extract_tags_many(titles, contents, top_k: int = 15) -> list:
+    """
+    Extract the top-k tags of many documents with one sparse TF-IDF transform.
+
+    Terms are weighted by their IDF over the promotions corpus (tag_extraction/idf_model.py);
+    without a saved model every IDF is 1 and tags are ranked by term frequency.
+
+    Args:
+        titles (list of str): Document titles, weighted 3x.
+        contents (list of str): Document bodies.
+        top_k (int): Tags per document.
+
+    Returns:
+        list of list of str: Tags of each document, best first.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    # Weight title higher by repeating it 3x
+    processed = [preprocess_document(title, content) for title, content in zip(titles, contents)]
+    if not processed:
+        return []
+
+    # term counts of all documents, unigrams + bigrams
+    vectorizer = CountVectorizer(ngram_range=(1, 2))
+    try:
+        counts = vectorizer.fit_transform(processed)
+    except ValueError:  # no document has any term left
+        return [[] for _ in processed]
+    terms = vectorizer.get_feature_names_out()  # sorted, so column order is term order
+    scores = counts.tocsr().astype(np.float64)
+    scores.sort_indices()
+    scores.data *= get_idf_model().current().idf(terms)[scores.indices]
+
+    tags = []
+    for i in range(scores.shape[0]):
+        row = slice(scores.indptr[i], scores.indptr[i + 1])
+        columns = _top_k_columns(scores.data[row], scores.indices[row], top_k)
+        tags.append(terms[columns].tolist())
+    return tags
+
+
+def extract_tags(title: str, content: str, top_k: int = 15, doc_embedding=None):
+    """
+    Extract top-k tags using TF-IDF with lemmatization and title weighting; with
+    TAG_MODE=semantic, ranked by similarity to the article embedding (doc_embedding, the
+    embed_texts vector of content, if the caller has it).
+    """
+    if TAG_MODE == "semantic":
+        from tag_extraction.semantic_tags import extract_semantic_tags
+        tags = extract_semantic_tags(title, content, top_k=top_k, doc_embedding=doc_embedding)
+    else:
+        tags = extract_tags_many([title], [content], top_k=top_k)[0]
     logger.info(f"Extracted tags: {tags}")
     return tags
 
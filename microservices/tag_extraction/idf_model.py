@@ -0,0 +1,258 @@
+"""
+idf_model.py
+============
+
+Corpus-level document frequencies for tag extraction.
+
+extract_tags used to fit a TfidfVectorizer on the single article it tags, which makes every
+IDF equal: the scores were plain term frequencies. This module keeps the document frequency
+of every unigram and bigram over the promotions corpus (title + summary of each promotion),
+so terms that appear in most promotions ("new", "year", ...) rank below the ones specific
+to an article. IDF uses sklearn's smoothed formula, ln((1 + n) / (1 + df)) + 1; terms never
+seen get the highest weight.
+
+The model is a gzipped JSON file (TAG_IDF_PATH) and is updated incrementally:
+
+- store_promotion adds each new promotion through get_tags.update_tag_idf; the counts are
+  kept in memory and merged into the file every TAG_IDF_FLUSH_EVERY documents (and at exit, or
+  through flush_shared_model in supervisor workers)
+  under a file lock, so several worker processes can update it together.
+- processes reload the file at most every TAG_IDF_RELOAD_INTERVAL seconds when another
+  process changed it.
+- the vocabulary is capped at TAG_IDF_MAX_TERMS terms, dropping the rarest.
+
+Usage:
+------
+python -m tag_extraction.idf_model --from-db                       # rebuild from the promotions table
+python -m tag_extraction.idf_model --from-csv classifier/data/train.csv
+"""
+import argparse
+import atexit
+import fcntl
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IDF_MODEL_PATH = os.getenv("TAG_IDF_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "idf_model.json.gz"))
+MAX_TERMS = int(os.getenv("TAG_IDF_MAX_TERMS", "300000"))
+FLUSH_EVERY = int(os.getenv("TAG_IDF_FLUSH_EVERY", "50"))  # documents
+RELOAD_INTERVAL = float(os.getenv("TAG_IDF_RELOAD_INTERVAL", "300"))  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class IdfModel:
+    """
+    Document frequencies of terms over a corpus.
+
+    Args:
+        n_docs (int): Number of documents counted.
+        doc_freq (Optional[dict]): term -> number of documents containing it.
+    """
+
+    def __init__(self, n_docs: int = 0, doc_freq=None):
+        self.n_docs = n_docs
+        self.doc_freq = Counter(doc_freq or {})
+
+    def __len__(self):
+        return len(self.doc_freq)
+
+    def add(self, term_sets):
+        """
+        Counts documents, each given as the set of its distinct terms.
+        """
+        for terms in term_sets:
+            self.n_docs += 1
+            self.doc_freq.update(terms)
+
+    def merge(self, other: "IdfModel"):
+        self.n_docs += other.n_docs
+        self.doc_freq.update(other.doc_freq)
+
+    def prune(self, max_terms: int = MAX_TERMS):
+        """
+        Keeps the max_terms most frequent terms; dropped terms score like unseen ones.
+        """
+        if len(self.doc_freq) > max_terms:
+            self.doc_freq = Counter(dict(self.doc_freq.most_common(max_terms)))
+
+    def idf(self, terms) -> np.ndarray:
+        """
+        Smoothed inverse document frequency of each term, as in TfidfVectorizer.
+
+        Returns:
+            np.ndarray: (len(terms),) IDF weights; all 1.0 for an empty model.
+        """
+        doc_freq = self.doc_freq
+        df = np.fromiter((doc_freq.get(term, 0) for term in terms), dtype=np.float64,
+                         count=len(terms))
+        return np.log((1 + self.n_docs) / (1 + df)) + 1
+
+    def save(self, path: str = IDF_MODEL_PATH):
+        """
+        Writes the model atomically (temp file + rename).
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"n_docs": self.n_docs, "doc_freq": self.doc_freq}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = IDF_MODEL_PATH) -> "IdfModel":
+        """
+        Loads a saved model; an empty one if the file does not exist.
+        """
+        if not os.path.exists(path):
+            return cls()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["n_docs"], data["doc_freq"])
+
+
+def _file_version(path: str):
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+
+class SharedIdfModel:
+    """
+    The process-wide model, updated in memory and merged into the file in batches.
+
+    Args:
+        path (str): Model file.
+    """
+
+    def __init__(self, path: str = IDF_MODEL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = IdfModel()  # counts not yet merged into the file
+        self._registered_exit = False
+        self._load()
+
+    def _load(self):
+        self.version = _file_version(self.path)
+        self.model = IdfModel.load(self.path)
+        self.model.merge(self._pending)
+        self._next_check = time.monotonic() + RELOAD_INTERVAL
+
+    def current(self) -> IdfModel:
+        """
+        Returns the model, reloading it if another process changed the file.
+        """
+        if time.monotonic() >= self._next_check:
+            with self._lock:
+                self._next_check = time.monotonic() + RELOAD_INTERVAL
+                if _file_version(self.path) != self.version:
+                    self._load()
+        return self.model
+
+    def add(self, term_sets):
+        """
+        Counts new documents; merges them into the file every FLUSH_EVERY documents.
+        """
+        term_sets = list(term_sets)
+        with self._lock:
+            self.model.add(term_sets)
+            self._pending.add(term_sets)
+            if not self._registered_exit:
+                atexit.register(self.flush)
+                self._registered_exit = True
+            flush = self._pending.n_docs >= FLUSH_EVERY
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Merges the pending counts into the file under an exclusive file lock, then reloads it.
+        """
+        with self._lock:
+            if not self._pending.n_docs:
+                return
+            with open(self.path + ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                model = IdfModel.load(self.path)
+                model.merge(self._pending)
+                model.prune(MAX_TERMS)
+                model.save(self.path)
+            logger.info("Merged %d documents into the tag IDF model (%d documents, %d terms)",
+                        self._pending.n_docs, model.n_docs, len(model))
+            self._pending = IdfModel()
+            self.model = model
+            self.version = _file_version(self.path)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_idf_model() -> SharedIdfModel:
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = SharedIdfModel()
+    return _shared
+
+
+def flush_shared_model():
+    """
+    Merges the pending counts of this process's shared model, if it has one, into the file.
+    For processes that end with os._exit (supervisor workers), which skips atexit.
+    """
+    if _shared is not None:
+        _shared.flush()
+
+
+def iter_promotion_texts(batch_size: int = 1000):
+    """
+    Streams "title summary" of every promotion with a server-side cursor.
+    """
+    from controller.db_controller import close_connection, make_connection
+
+    connection = make_connection()
+    if connection is None:
+        raise RuntimeError("Could not connect to the database")
+    try:
+        with connection.cursor(name="tag_idf_promotions") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute("SELECT title, summary FROM public.promotions")
+            for title, summary in cursor:
+                yield f"{title or ''} {summary or ''}"
+    finally:
+        close_connection(connection)
+
+
+def main():
+    from tag_extraction.get_tags import build_idf_model
+
+    parser = argparse.ArgumentParser(description="Rebuild the tag extraction IDF model.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--from-db", action="store_true",
+                        help="Count the title and summary of every promotion.")
+    source.add_argument("--from-csv", help="Count the text column of a CSV file.")
+    parser.add_argument("--out", default=IDF_MODEL_PATH)
+    args = parser.parse_args()
+
+    if args.from_db:
+        texts = iter_promotion_texts()
+    else:
+        import pandas as pd
+        texts = (str(text) for text in pd.read_csv(args.from_csv)["text"].dropna())
+    model = build_idf_model(texts)
+    model.prune(MAX_TERMS)
+    model.save(args.out)
+    print(f"Saved IDF model of {model.n_docs} documents and {len(model)} terms to {args.out}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
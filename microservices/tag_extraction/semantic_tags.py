@@ -0,0 +1,169 @@
+"""
+semantic_tags.py
+================
+
+Embedding-based keyphrase ranking, the TAG_MODE=semantic alternative to plain TF-IDF tags.
+
+The TF-IDF ranking of get_tags.extract_tags_many proposes TAG_SEMANTIC_CANDIDATES unigrams
+and bigrams per article; they are then ranked by the cosine similarity of their embedding
+to the embedding of the whole article, so tags follow what the article is about rather than
+which words it repeats.
+
+- the article vector is utils.embed_texts(content), the call classify_text already makes:
+  it comes out of the embedding cache (classifier/embedding_cache.py) instead of a second
+  pass over the article. With EMBED_CACHE=0 the article is encoded again; callers that
+  hold the vector can pass it as doc_embeddings.
+- the candidates of all articles of a call are encoded together in one batch, as short
+  sentences; the vectors of the TAG_CANDIDATE_CACHE_SIZE most recently used candidates
+  stay in memory, so frequent phrases are not encoded again. They bypass the shared
+  embedding cache, where thousands of short phrases would evict the article vectors.
+- with INFERENCE_SERVER_URL set, both go through the inference server.
+
+Usage:
+------
+TAG_MODE=semantic python main.py
+
+from tag_extraction.semantic_tags import extract_semantic_tags
+tags = extract_semantic_tags(title, content, top_k=15)
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from classifier.inference_client import INFERENCE_SERVER_URL
+from dotenv import load_dotenv
+from tag_extraction.get_tags import extract_tags_many
+
+load_dotenv()
+
+CANDIDATES = int(os.getenv("TAG_SEMANTIC_CANDIDATES", "50"))  # TF-IDF terms ranked per article
+CANDIDATE_CACHE_SIZE = int(os.getenv("TAG_CANDIDATE_CACHE_SIZE", "50000"))
+
+logger = logging.getLogger(__name__)
+
+
+def _embedding_functions():
+    """
+    embed_texts, embed_sentences and get_engine of the inference server or of this process.
+    """
+    if INFERENCE_SERVER_URL:
+        from classifier.inference_client import embed_sentences, embed_texts, get_engine
+    else:
+        from classifier.embedding_engine import get_engine
+        from classifier.utils import embed_sentences, embed_texts
+    return embed_texts, embed_sentences, get_engine
+
+
+class CandidateCache:
+    """
+    LRU of candidate phrase embeddings, per model.
+
+    Args:
+        max_items (int): Phrases kept.
+    """
+
+    def __init__(self, max_items: int = CANDIDATE_CACHE_SIZE):
+        self.max_items = max_items
+        self._vectors = OrderedDict()  # (model, phrase) -> normalized vector
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed(self, phrases, embedder=None) -> np.ndarray:
+        """
+        Normalized embeddings of phrases; the ones not cached are encoded in one batch.
+
+        Returns:
+            np.ndarray: (len(phrases), dim) array.
+        """
+        _, embed_sentences, get_engine = _embedding_functions()
+        if embedder is None:
+            embedder = get_engine()
+        model = embedder.model_name
+        found = {}
+        with self._lock:
+            for phrase in phrases:
+                vec = self._vectors.get((model, phrase))
+                if vec is not None:
+                    self._vectors.move_to_end((model, phrase))
+                    found[phrase] = vec
+            missing = [phrase for phrase in dict.fromkeys(phrases) if phrase not in found]
+            self.hits += len(phrases) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            vecs = embed_sentences(missing, embedder=embedder, use_cache=False)
+            with self._lock:
+                for phrase, vec in zip(missing, vecs):
+                    found[phrase] = vec
+                    self._vectors[(model, phrase)] = vec
+                while len(self._vectors) > self.max_items:
+                    self._vectors.popitem(last=False)
+        if not phrases:
+            return np.zeros((0, embedder.dimension), dtype=np.float32)
+        return np.stack([found[phrase] for phrase in phrases])
+
+
+candidate_cache = CandidateCache()
+
+
+def rank_candidates(candidates, doc_embedding, candidate_vectors, top_k: int) -> list:
+    """
+    Candidates sorted by cosine similarity to the document, best first; ties keep the
+    TF-IDF order.
+    """
+    if not candidates:
+        return []
+    similarity = candidate_vectors @ np.asarray(doc_embedding, dtype=candidate_vectors.dtype)
+    order = np.argsort(-similarity, kind="stable")[:top_k]
+    return [candidates[i] for i in order]
+
+
+def extract_semantic_tags_many(titles, contents, top_k: int = 15, doc_embeddings=None,
+                               embedder=None) -> list:
+    """
+    Extract the top-k tags of many documents by embedding similarity.
+
+    Args:
+        titles (list of str): Document titles.
+        contents (list of str): Document bodies.
+        top_k (int): Tags per document.
+        doc_embeddings (Optional[np.ndarray]): Normalized document embeddings, as returned
+            by utils.embed_texts(contents); looked up (or computed) when not given.
+        embedder (Optional[EmbeddingEngine]): Embedder (default: the shared engine).
+
+    Returns:
+        list of list of str: Tags of each document, best first.
+    """
+    titles, contents = list(titles), list(contents)
+    candidates = extract_tags_many(titles, contents, top_k=max(top_k, CANDIDATES))
+    if not any(candidates):
+        return candidates
+    embed_texts, _, _ = _embedding_functions()
+    if doc_embeddings is None:
+        # classify_text embedded the same contents, so these come from the embedding cache
+        doc_embeddings = embed_texts(contents, embedder=embedder)
+
+    phrases = list(dict.fromkeys(phrase for terms in candidates for phrase in terms))
+    vectors = candidate_cache.embed(phrases, embedder=embedder)
+    row = {phrase: i for i, phrase in enumerate(phrases)}
+    return [rank_candidates(terms, doc_embedding, vectors[[row[t] for t in terms]], top_k)
+            for terms, doc_embedding in zip(candidates, doc_embeddings)]
+
+
+def extract_semantic_tags(title: str, content: str, top_k: int = 15, doc_embedding=None):
+    """Extract top-k tags ranked by similarity to the article embedding."""
+    doc_embeddings = None if doc_embedding is None else [doc_embedding]
+    return extract_semantic_tags_many([title], [content], top_k=top_k,
+                                      doc_embeddings=doc_embeddings)[0]
+
+
+# Example usage
+if __name__ == "__main__":
+    title = "Android's New Walls: Deconstructing Google's Plan to Verify Every Sideloaded App"
+    content = """
+      Google will require developers to verify their identity before their apps can be
+      installed on certified Android devices, including apps sideloaded outside the Play Store.
+    """
+    print("Extracted Tags:", extract_semantic_tags(title, content, top_k=10))
@@ -1,3 +1,38 @@
+import numpy as np
+from classifier.compiled_head import CompiledHead, verify_compiled_head
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.frozen import FrozenEstimator
+from sklearn.linear_model import SGDClassifier
+
+# the compiled head (model_head.npz) must reproduce the calibrated sklearn pipeline that
+# classifier/train.py fits, for binary and multi-class bundles, with cv=5 and prefit folds
+rng = np.random.default_rng(0)
+for n_classes in (2, 4):
+    centers = rng.normal(scale=2.0, size=(n_classes, 16))
+    y = np.repeat(np.arange(n_classes), 60)
+    X = (centers[y] + rng.normal(size=(len(y), 16))).astype(np.float32)
+    base_clf = SGDClassifier(loss="log_loss", max_iter=1000, tol=1e-3, random_state=0)
+    for clf in (CalibratedClassifierCV(base_clf, method="sigmoid", cv=5),
+                CalibratedClassifierCV(FrozenEstimator(base_clf.fit(X, y)), method="sigmoid")):
+        bundle = {"clf": clf.fit(X, y), "idx2label": {i: f"class{i}" for i in range(n_classes)}}
+        head = CompiledHead.from_bundle(bundle)
+        # in and far outside the training distribution
+        for sample in (X, rng.normal(scale=3.0, size=(256, 16)).astype(np.float32)):
+            max_diff = verify_compiled_head(bundle, head, sample)
+        print(f"Compiled head, {n_classes} classes, {len(clf.calibrated_classifiers_)} fold(s): "
+              f"max abs diff {max_diff:.2e}")
+
+# the fast tag preprocessing must return exactly what the original nltk implementation
+# returns (the full comparison runs in tag_extraction/benchmark_preprocess.py)
+import pandas as pd
+from tag_extraction.benchmark_preprocess import (DATA_PATH, EDGE_CASES, check_golden,
+                                                 make_articles)
+
+texts = pd.read_csv(DATA_PATH, nrows=200)["text"].dropna().astype(str).tolist()
+check_golden(texts, make_articles(texts, 1000, 5, np.random.default_rng(0)))
+print(f"Tag preprocessing: identical on {len(EDGE_CASES) + len(texts)} texts and 5 articles")
+
+# needs the trained bundle and the embedding model
 from classifier.model_service import classify_text
 
 content = "this article will tell you about sport improvements that can take place in 2024 "
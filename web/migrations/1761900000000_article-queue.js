@@ -0,0 +1,72 @@
+/**
+ * @type {import('node-pg-migrate').ColumnDefinitions | undefined}
+ */
+export const shorthands = undefined;
+
+/**
+ * Durable work queue for article promotion requests.
+ *
+ * Producers insert rows (POST /api/bloc/queue); the Python workers lease them with
+ * FOR UPDATE SKIP LOCKED and get woken up through NOTIFY on the `article_queue` channel.
+ *
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @param run {() => void | undefined}
+ * @returns {Promise<void> | void}
+ */
+export const up = (pgm) => {
+  pgm.createTable("article_queue", {
+    item_id: { type: "bigserial", notNull: true, primaryKey: true },
+    payload: { type: "jsonb", notNull: true },
+    // number of times the item was leased by a worker
+    attempts: { type: "integer", notNull: true, default: 0 },
+    // leased items are hidden until their visibility timeout expires
+    visible_at: {
+      type: "timestamp with time zone",
+      notNull: true,
+      default: pgm.func("NOW()"),
+    },
+    created_at: {
+      type: "timestamp with time zone",
+      notNull: true,
+      default: pgm.func("NOW()"),
+    },
+  });
+
+  pgm.createIndex("article_queue", ["visible_at", "item_id"]);
+
+  pgm.createFunction(
+    "notify_article_queue",
+    [],
+    {
+      returns: "trigger",
+      language: "plpgsql",
+      security: "definer",
+    },
+    `
+    BEGIN
+        PERFORM pg_notify('article_queue', NEW.item_id::text);
+        RETURN NEW;
+    END;
+    `
+  );
+
+  pgm.createTrigger("article_queue", "article_queue_notify_trigger", {
+    when: "AFTER",
+    operation: "INSERT",
+    function: "notify_article_queue",
+    level: "ROW",
+  });
+};
+
+/**
+ * @param pgm {import('node-pg-migrate').MigrationBuilder}
+ * @param run {() => void | undefined}
+ * @returns {Promise<void> | void}
+ */
+export const down = (pgm) => {
+  pgm.dropTrigger("article_queue", "article_queue_notify_trigger", {
+    ifExists: true,
+  });
+  pgm.dropFunction("notify_article_queue", [], { ifExists: true });
+  pgm.dropTable("article_queue", { ifExists: true });
+};
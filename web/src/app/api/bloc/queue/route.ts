@@ -1,3 +1,4 @@
+import prisma from "@/lib/prisma";
 import { NextRequest, NextResponse } from "next/server";
 
 type QueueItemType = {
@@ -7,7 +8,9 @@ type QueueItemType = {
   promoter_id: string;
 };
 
-const queue = [] as Array<QueueItemType>;
+// The queue lives in the article_queue table (see migrations) so items survive
+// restarts and can be leased concurrently by the Python workers. GET/DELETE keep
+// serving the head of the queue for workers still using QUEUE_BACKEND=http.
 
 export async function POST(_request: NextRequest) {
   // add item to queue
@@ -27,30 +30,49 @@ export async function POST(_request: NextRequest) {
     );
   }
 
-  queue.push({ website_id, article_url, budget, promoter_id });
+  const item: QueueItemType = { website_id, article_url, budget, promoter_id };
+  await prisma.$executeRaw`
+    INSERT INTO public.article_queue (payload)
+    VALUES (${JSON.stringify(item)}::jsonb)
+  `;
   return NextResponse.json({ message: "Item added to queue" }, { status: 200 });
 }
 
 export async function GET() {
-  // get the first item in queue
-  if (queue.length === 0) {
+  // get the first visible item in queue
+  const rows = await prisma.$queryRaw<Array<{ payload: QueueItemType }>>`
+    SELECT payload FROM public.article_queue
+    WHERE visible_at <= NOW()
+    ORDER BY item_id
+    LIMIT 1
+  `;
+  if (rows.length === 0) {
     return new NextResponse(JSON.stringify({ message: "Queue is empty" }), {
       status: 200,
     });
   }
 
-  return NextResponse.json({ message: queue[0] }, { status: 200 });
+  return NextResponse.json({ message: rows[0].payload }, { status: 200 });
 }
 
 export async function DELETE() {
-  // remove item from queue
-  if (queue.length === 0) {
+  // remove the first visible item from queue
+  const removed = await prisma.$executeRaw`
+    DELETE FROM public.article_queue
+    WHERE item_id = (
+      SELECT item_id FROM public.article_queue
+      WHERE visible_at <= NOW()
+      ORDER BY item_id
+      LIMIT 1
+      FOR UPDATE SKIP LOCKED
+    )
+  `;
+  if (removed === 0) {
     return new NextResponse(JSON.stringify({ message: "Queue is empty" }), {
       status: 200,
     });
   }
 
-  queue.shift();
   return NextResponse.json(
     { message: "Item removed from queue" },
     { status: 200 }